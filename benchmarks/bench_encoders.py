@@ -0,0 +1,83 @@
+"""
+Benchmarks the station encoder backends of the training pipeline on
+synthetic ridership data: fit time, predict latency, pickled model size
+and test AUC, with the same RandomForest for every encoder
+
+To run, from the repo root:
+PYTHONPATH=src python benchmarks/bench_encoders.py --rows 200000 --stations 600
+"""
+import argparse
+import pickle
+import time
+
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import make_pipeline
+from synthetic import make_rides
+
+from bikeshare.model.encoders import ENCODERS, make_encoder, station_stats
+from bikeshare.model.features import TARGET, build_features
+
+PARAMS = {"n_estimators": 50, "max_depth": 12, "random_state": 42}
+
+
+def run(n_rows: int, n_stations: int, encoders: list = ENCODERS):
+    df = build_features(make_rides(n_rows, n_stations, station_spread=0.1))
+    train, test = train_test_split(
+        df, test_size=0.3, stratify=df[TARGET], random_state=42
+    )
+    X_train, y_train = train.drop(TARGET, axis=1), train[TARGET].values
+    X_test, y_test = test.drop(TARGET, axis=1), test[TARGET].values
+    stats = station_stats(X_train, y_train)
+    one_ride = X_test.iloc[:1]
+
+    print(
+        f"{'encoder':>8} {'fit (s)':>8} {'batch (ms)':>11} {'1 ride (ms)':>12} "
+        f"{'size (MB)':>10} {'auc':>6}"
+    )
+    for encoder in encoders:
+        clf = make_pipeline(
+            make_encoder(encoder, stats=stats, handle_unknown="ignore"),
+            RandomForestClassifier(**PARAMS),
+        )
+        start = time.perf_counter()
+        clf.fit(X_train, y_train)
+        t_fit = time.perf_counter() - start
+
+        start = time.perf_counter()
+        y_preds = clf.predict_proba(X_test)[:, 1]
+        t_batch = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(20):
+            clf.predict(one_ride)
+        t_one = (time.perf_counter() - start) / 20
+
+        size = len(pickle.dumps(clf)) / 2**20
+        auc = roc_auc_score(y_test, y_preds)
+        print(
+            f"{encoder:>8} {t_fit:>8.2f} {t_batch * 1e3:>11.1f} {t_one * 1e3:>12.2f} "
+            f"{size:>10.1f} {auc:>6.3f}"
+        )
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument(
+        "--stations",
+        type=int,
+        default=600,
+        help="number of distinct stations, i.e. one-hot columns per station column",
+    )
+    parser.add_argument(
+        "--encoders",
+        type=lambda s: s.split(","),
+        default=ENCODERS,
+        help="comma separated encoders to compare",
+    )
+    args = parser.parse_args()
+
+    run(args.rows, args.stations, args.encoders)
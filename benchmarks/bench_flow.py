@@ -0,0 +1,176 @@
+"""
+Benchmarks the stages of the training flow end to end on synthetic
+ridership data: `read_df`, `preprocess`, the train/test split, a
+single-trial `model_search` and `register_model`, against a local sqlite
+MLflow store
+
+Each stage is timed, and its memory measured as the peak of Python
+allocations (tracemalloc) and the growth of the process's peak RSS.
+Timings include the tracemalloc overhead, so compare them only with
+other runs of this script.
+
+Results are written as JSON; with --baseline, stages slower than the
+baseline by more than --tolerance are reported and the exit code is 1.
+
+To run, from the repo root:
+PYTHONPATH=src python benchmarks/bench_flow.py --scales 10000,100000 \
+    --output bench_flow.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import pandas as pd
+import sklearn
+from sklearn.model_selection import train_test_split
+from synthetic import make_rides
+
+from bikeshare.model.preprocess import preprocess, read_df
+from bikeshare.model.registry import register_model
+from bikeshare.model.trials import model_search
+
+EXP_NAME = "bench-flow"
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss is in kB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(stage: str, func, *args, **kwargs):
+    """Runs one stage, and returns its result and measurements"""
+    rss_before = max_rss_mb()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {
+        "stage": stage,
+        "seconds": round(seconds, 4),
+        "py_peak_mb": round(peak / 2**20, 2),
+        "max_rss_growth_mb": round(max_rss_mb() - rss_before, 2),
+    }
+
+
+def run_scale(n_rows: int, work_dir: Path) -> list:
+    # one experiment per scale, so each registers its own best run
+    os.environ["MLFLOW_EXP_NAME"] = f"{EXP_NAME}-{n_rows}"
+    csv_path = work_dir / f"rides-{n_rows}.csv"
+    make_rides(n_rows, station_spread=0.1).to_csv(csv_path, index=False)
+
+    df, read_stats = measure("read_df", read_df, csv_path)
+    df_bikes, prep_stats = measure("preprocess", preprocess, df)
+    (train, test), split_stats = measure(
+        "split",
+        train_test_split,
+        df_bikes,
+        test_size=0.3,
+        stratify=df_bikes["target"],
+        random_state=42,
+    )
+    _, search_stats = measure("model_search", model_search, train, test, 1)
+    _, register_stats = measure("register_model", register_model)
+
+    stats = [read_stats, prep_stats, split_stats, search_stats, register_stats]
+    for stage_stats in stats:
+        stage_stats["rows"] = n_rows
+        print(
+            f"{n_rows:>10} {stage_stats['stage']:>15} {stage_stats['seconds']:>9.2f}s "
+            f"{stage_stats['py_peak_mb']:>9.1f}MB {stage_stats['max_rss_growth_mb']:>9.1f}MB"
+        )
+    return stats
+
+
+def compare(results: list, baseline_path: Path, tolerance: float) -> list:
+    """Stages slower than in the baseline by more than `tolerance`"""
+    with open(baseline_path, "r") as f_in:
+        baseline = json.load(f_in)
+    base_seconds = {(r["rows"], r["stage"]): r["seconds"] for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        base = base_seconds.get((result["rows"], result["stage"]))
+        if base and result["seconds"] > base * (1 + tolerance):
+            regressions.append({**result, "baseline_seconds": base})
+    return regressions
+
+
+def run(scales: list, output: Path, baseline: Path = None, tolerance: float = 0.2):
+    print(f"{'rows':>10} {'stage':>15} {'time':>10} {'py peak':>11} {'rss growth':>11}")
+    results = []
+    with TemporaryDirectory() as tmp_dir:
+        work_dir = Path(tmp_dir)
+        # a fresh local store; model_search and register_model read these
+        os.environ["MLFLOW_TRACKING_URI"] = f"sqlite:///{work_dir / 'mlflow.db'}"
+        os.environ["MLFLOW_REGISTERED_MODEL"] = EXP_NAME
+        cwd = Path.cwd()
+        # artifacts go to ./mlruns
+        os.chdir(work_dir)
+        try:
+            for n_rows in scales:
+                results.extend(run_scale(n_rows, work_dir))
+        finally:
+            os.chdir(cwd)
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "sklearn": sklearn.__version__,
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    with open(output, "w") as f_out:
+        json.dump(report, f_out, indent=2)
+    print(f"results written to {output}")
+
+    if baseline:
+        regressions = compare(results, baseline, tolerance)
+        for reg in regressions:
+            print(
+                f"regression: {reg['stage']} at {reg['rows']} rows took "
+                f"{reg['seconds']:.2f}s, baseline {reg['baseline_seconds']:.2f}s"
+            )
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--scales",
+        type=lambda s: [int(n) for n in s.split(",")],
+        default=[10_000, 100_000, 1_000_000],
+        help="comma separated row counts to benchmark",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default="bench_flow.json",
+        help="file the JSON results are written to",
+    )
+    parser.add_argument(
+        "--baseline",
+        type=Path,
+        default=None,
+        help="JSON results of an earlier run to compare against",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="slowdown over the baseline reported as a regression, e.g. 0.2 for 20%%",
+    )
+    args = parser.parse_args()
+
+    run(args.scales, args.output, args.baseline, args.tolerance)
@@ -0,0 +1,64 @@
+"""
+Generates synthetic bikeshare ridership in the same schema as the
+Toronto Open Data trip CSVs, for benchmarking the pipeline at scale
+"""
+import numpy as np
+import pandas as pd
+
+SECONDS_PER_YEAR = 365 * 24 * 3600
+
+
+def _fmt_times(ts: pd.Series) -> pd.Series:
+    """Formats datetimes as "13/1/2017 0:05", same as the source data"""
+    return (
+        ts.dt.day.astype(str)
+        + "/"
+        + ts.dt.month.astype(str)
+        + "/"
+        + ts.dt.year.astype(str)
+        + " "
+        + ts.dt.hour.astype(str)
+        + ":"
+        + ts.dt.minute.astype(str).str.zfill(2)
+    )
+
+
+def make_rides(
+    n_rows: int,
+    n_stations: int = 300,
+    member_rate: float = 0.85,
+    year: int = 2017,
+    seed: int = 42,
+    station_spread: float = 0.0,
+) -> pd.DataFrame:
+    """Returns `n_rows` of random trips with the raw ridership columns
+
+    With `station_spread`, each start station gets its own member rate,
+    normally spread around `member_rate`, so models have a signal to learn.
+    """
+    rng = np.random.default_rng(seed)
+    station_ids = np.arange(7000, 7000 + n_stations)
+    offsets = rng.integers(0, SECONDS_PER_YEAR, n_rows)
+    duration = rng.gamma(2.0, 500.0, n_rows).astype("int64") + 60
+    start = pd.Series(pd.Timestamp(f"{year}-01-01") + pd.to_timedelta(offsets, "s"))
+    stop = start + pd.to_timedelta(duration, "s")
+    from_station = rng.choice(station_ids, n_rows)
+    to_station = rng.choice(station_ids, n_rows)
+    station_rates = np.clip(
+        rng.normal(member_rate, station_spread, n_stations), 0.0, 1.0
+    )
+    rates = station_rates[from_station - station_ids[0]]
+    user_type = np.where(rng.random(n_rows) < rates, "Member", "Casual")
+    return pd.DataFrame(
+        {
+            "trip_id": np.arange(n_rows, dtype="int64"),
+            "trip_start_time": _fmt_times(start),
+            "trip_stop_time": _fmt_times(stop),
+            "trip_duration_seconds": duration,
+            "from_station_id": from_station,
+            "from_station_name": "Station " + pd.Series(from_station).astype(str),
+            "to_station_id": to_station,
+            "to_station_name": "Station " + pd.Series(to_station).astype(str),
+            "user_type": user_type,
+        }
+    )
@@ -4,6 +4,7 @@ Prefect flow to batch analyze our web service model
 import json
 import os
 import pickle
+from datetime import datetime, timedelta, timezone
 from typing import Tuple
 
 import pandas as pd
@@ -18,66 +19,16 @@ from evidently.model_profile.sections import (
 from prefect import flow, get_run_logger, task
 from pymongo import MongoClient
 
-MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://127.0.0.1:27017")
-
-
-@task
-def upload_target(filename: str) -> None:
-    """
-    Not needed for to-bikeshare data
-    """
-    mongo_client = MongoClient(MONGODB_URI)
-    db = mongo_client.get_database("prediction_service")
-    collection = db.get_collection("data")
-    with open(filename) as f_target:
-        for line in f_target.readlines():
-            row = line.split(",")
-            collection.update_one({"id": row[0]}, {"$set": {"target": float(row[1])}})
-    mongo_client.close()
-
-
-def preprocess(df_bikes: pd.DataFrame) -> pd.DataFrame:
-    """Preprocesses the bikeshare data
-
-    Converts the datetimes from str obj to datetime objects, and extracts
-    the time of day to convert into hour floats
+from bikeshare.model.features import FEATURES, build_features
+from bikeshare.model.instrument import Instrument
+from bikeshare.model.records import (
+    DATABASE,
+    PREDICTIONS,
+    RECORD_FIELDS,
+    records_to_frame,
+)
 
-    This step is prior to feeding the arrays into the pipeline.
-    """
-    df_bikes["dt_start"] = pd.to_datetime(
-        df_bikes["trip_start_time"],
-        infer_datetime_format=True,
-    )
-    df_bikes["dt_end"] = pd.to_datetime(
-        df_bikes["trip_stop_time"],
-        infer_datetime_format=True,
-    )
-    # get day of week
-    df_bikes["day_of_week"] = df_bikes.apply(
-        lambda x: x["dt_start"].day_of_week, axis=1
-    )
-    # get hours
-    df_bikes["start_hour"] = df_bikes.apply(
-        lambda x: x["dt_start"].hour + x["dt_start"].minute / 60,
-        axis=1,
-    )
-    df_bikes["end_hour"] = df_bikes.apply(
-        lambda x: x["dt_end"].hour + x["dt_end"].minute / 60,
-        axis=1,
-    )
-    df_bikes["target"] = df_bikes["user_type"].apply(lambda type: type == "Member")
-    drops = [
-        "trip_id",
-        "trip_start_time",
-        "trip_stop_time",
-        "from_station_name",
-        "to_station_name",
-        "dt_start",
-        "dt_end",
-        "user_type",
-    ]
-    df_bikes = df_bikes.drop(drops, axis=1)
-    return df_bikes
+MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://127.0.0.1:27017")
 
 
 @task
@@ -94,22 +45,27 @@ def load_reference_data(ref_file: str) -> pd.DataFrame:
         model = pickle.load(f_in)
 
     # Create features
-    features = preprocess(reference_data)
+    features = build_features(reference_data)
 
     # include prediction
-    features["prediction"] = model.predict(features.drop("target", axis=1))
+    features["prediction"] = model.predict(features[FEATURES])
     return features
 
 
 @task
-def fetch_data() -> pd.DataFrame:
-
+def fetch_data(window_days: int = None) -> pd.DataFrame:
+    """Loads the predictions of the last `window_days`, or all that are kept"""
     log = get_run_logger()
 
     mongo_client = MongoClient(MONGODB_URI)
-    db = mongo_client.get_database("prediction_service")
-    data = db.get_collection("data").find()
-    df = pd.DataFrame(list(data))
+    db = mongo_client.get_database(DATABASE)
+    query = {}
+    if window_days:
+        since = datetime.now(timezone.utc) - timedelta(days=window_days)
+        query["ts"] = {"$gte": since}
+    # the service saves the features themselves; only they are read back
+    records = db.get_collection(PREDICTIONS).find(query, RECORD_FIELDS)
+    df = records_to_frame(records)
     log.info(f"{len(df)} records loaded from mongo db")
     mongo_client.close()
     return df
@@ -148,7 +104,7 @@ def run_evidently(ref_data: pd.DataFrame, data: pd.DataFrame) -> Tuple[dict, Das
 @task
 def save_report(profile) -> None:
     mongo_client = MongoClient(MONGODB_URI)
-    db = mongo_client.get_database("prediction_service")
+    db = mongo_client.get_database(DATABASE)
     db.get_collection("report").insert_one(profile)
     mongo_client.close()
 
@@ -159,14 +115,28 @@ def save_html_report(dashboard) -> None:
 
 
 @flow
-def batch_analyze():
-    # input data already contains target
-    # upload_target("target.csv")
-    ref_data = load_reference_data("s3://to-bikeshare-data/source/2017/q1.csv")
-    data = fetch_data()
-    profile, dashboard = run_evidently(ref_data, data)
-    save_report(profile)
-    save_html_report(dashboard)
+def batch_analyze(stats_file: str = None, window_days: int = None):
+    """Stage timings are logged, and appended to `stats_file` if given
+
+    Only the predictions of the last `window_days` are analyzed, if given.
+    """
+    instrument = Instrument("batch_analyze", get_run_logger())
+    try:
+        # the service logs the target with each prediction, from user_type
+        with instrument.stage("load_reference_data") as stats:
+            ref_data = load_reference_data("s3://to-bikeshare-data/source/2017/q1.csv")
+            stats["rows"] = len(ref_data)
+        with instrument.stage("fetch_data") as stats:
+            data = fetch_data(window_days)
+            stats["rows"] = len(data)
+        with instrument.stage("run_evidently", rows=len(ref_data) + len(data)):
+            profile, dashboard = run_evidently(ref_data, data)
+        with instrument.stage("save_reports"):
+            save_report(profile)
+            save_html_report(dashboard)
+    finally:
+        if stats_file:
+            instrument.save(stats_file)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,125 @@
+"""
+Dynamic micro-batching of concurrent prediction requests
+
+Request threads hand their rides to a `MicroBatcher` and wait. A single
+worker thread collects the queued requests until `window_ms` has passed
+since the first of them arrived, or `max_batch` rides are queued, then
+scores them all with one call and hands each request its own results.
+The window bounds the latency added to a request, while under load the
+per-call overhead of featurizing and `model.predict` is shared by the
+whole batch.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+# batches whose size and timings are summarized by `metrics`
+METRICS_WINDOW = 1000
+
+
+class MicroBatcher:
+    """Scores the rides of concurrent requests together
+
+    `score_fn` takes a list of rides and returns one result per ride, in
+    order. If it fails on a batch, the batch's requests are retried one by
+    one, so a bad ride only fails its own request.
+    """
+
+    def __init__(self, score_fn, max_batch: int = 64, window_ms: float = 5.0):
+        self.score_fn = score_fn
+        self.max_batch = max_batch
+        self.window_ms = window_ms
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._counts = {"requests": 0, "rides": 0, "batches": 0, "errors": 0}
+        # (rides, wait_ms, score_ms) of the latest batches
+        self._batches = deque(maxlen=METRICS_WINDOW)
+        self._worker = threading.Thread(
+            target=self._run, name="micro-batcher", daemon=True
+        )
+        self._worker.start()
+
+    def submit(self, rides: list) -> Future:
+        """Queues the rides of one request; returns a future of their results"""
+        future = Future()
+        self._queue.put((rides, future, time.perf_counter()))
+        return future
+
+    def predict(self, rides: list, timeout: float = None) -> list:
+        return self.submit(rides).result(timeout)
+
+    def _collect(self) -> list:
+        """Blocks for a request, then batches whatever follows in the window"""
+        batch = [self._queue.get()]
+        n_rides = len(batch[0][0])
+        deadline = batch[0][2] + self.window_ms / 1000
+        while n_rides < self.max_batch:
+            try:
+                request = self._queue.get(
+                    timeout=max(0, deadline - time.perf_counter())
+                )
+            except queue.Empty:
+                break
+            batch.append(request)
+            n_rides += len(request[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            start = time.perf_counter()
+            # waited by the batch's first request
+            wait_ms = (start - batch[0][2]) * 1000
+            rides = [ride for request in batch for ride in request[0]]
+            try:
+                results = self.score_fn(rides)
+            except Exception as exc:
+                if len(batch) > 1:
+                    self._score_each(batch)
+                else:
+                    self._fail(batch[0][1], exc)
+            else:
+                offset = 0
+                for request_rides, future, _ in batch:
+                    future.set_result(results[offset : offset + len(request_rides)])
+                    offset += len(request_rides)
+            score_ms = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self._counts["requests"] += len(batch)
+                self._counts["rides"] += len(rides)
+                self._counts["batches"] += 1
+                self._batches.append((len(rides), wait_ms, score_ms))
+
+    def _score_each(self, batch: list):
+        for rides, future, _ in batch:
+            try:
+                future.set_result(self.score_fn(rides))
+            except Exception as exc:
+                self._fail(future, exc)
+
+    def _fail(self, future: Future, exc: Exception):
+        logging.warning(f"failed to score request: {exc!r}")
+        with self._lock:
+            self._counts["errors"] += 1
+        future.set_exception(exc)
+
+    def metrics(self) -> dict:
+        """Counters since startup, and summaries of the latest batches"""
+        with self._lock:
+            metrics = dict(self._counts)
+            batches = np.array(self._batches).reshape(-1, 3)
+        metrics["queue_depth"] = self._queue.qsize()
+        metrics["max_batch"] = self.max_batch
+        metrics["window_ms"] = self.window_ms
+        if len(batches):
+            for i, name in enumerate(["batch_size", "wait_ms", "score_ms"]):
+                metrics[f"{name}_mean"] = round(float(batches[:, i].mean()), 3)
+                metrics[f"{name}_p99"] = round(
+                    float(np.percentile(batches[:, i], 99)), 3
+                )
+        return metrics
@@ -1,102 +1,72 @@
 """
 Retrieves and runs the latest version of the registered model
 """
+import atexit
+import json
 import logging
 import os
 import sys
-from datetime import datetime
 
 import mlflow.pyfunc
 import pandas as pd
 from flask import Flask, jsonify, request
 from mlflow.tracking import MlflowClient
 from pymongo import MongoClient
+from werkzeug.exceptions import BadRequest
+
+from bikeshare.deploy.predict_service.batching import MicroBatcher
+from bikeshare.deploy.predict_service.writer import MongoWriter
+from bikeshare.model.fastpath import compile_scorer
+from bikeshare.model.features import (
+    FEATURES,
+    build_features,
+    ride_target,
+    ride_values,
+)
+from bikeshare.model.records import (
+    DATABASE,
+    MODELS,
+    PREDICTIONS,
+    RETENTION_DAYS,
+    ensure_indexes,
+    make_record,
+    model_id,
+    save_model_meta,
+)
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://127.0.0.1:27017")
 mongo_client = MongoClient(MONGODB_URI)
-db = mongo_client.get_database("prediction_service")
-collection = db.get_collection("data")
+db = mongo_client.get_database(DATABASE)
+collection = db.get_collection(PREDICTIONS)
 logging.info("MongoDB connection established")
 
-
-def preprocess_json(ride: dict) -> dict:
-    """Preprocess the json input as dict"""
-    logging.info("Preprocessing request")
-
-    features = {}
-    date_fmt = """%d/%m/%Y %H:%M"""
-    dt_start = datetime.strptime(ride["trip_start_time"], date_fmt)
-    dt_end = datetime.strptime(ride["trip_stop_time"], date_fmt)
-    features["day_of_week"] = dt_start.weekday()
-    features["start_hour"] = dt_start.hour
-    features["end_hour"] = dt_end.hour
-    features["target"] = ride["user_type"] == "Member"
-    features["from_station_id"] = ride["from_station_id"]
-    features["to_station_id"] = ride["to_station_id"]
-    features["trip_duration_seconds"] = ride["trip_duration_seconds"]
-
-    logging.debug(f"Num features returned: {len(features)}")
-    return features
-
-
-def json_to_df(ride: dict) -> pd.DataFrame:
-    # appending dict to row allows pd.DataFrame.from_dict(orient='columns')
-    rows = []
-    rows.append(ride)
-    # I should .set_index('trip_id'), but the trained model pipeline left it in
-    # and so I need to here as well, lest ValueError Missing column be raised
-    df_bike = pd.DataFrame.from_dict(rows, orient="columns")
-    return df_bike
-
-
-def preprocess(df_bikes: pd.DataFrame) -> pd.DataFrame:
-    """Preprocesses the bikeshare data
-
-    Converts the datetimes from str obj to datetime objects, and extracts
-    the time of day to convert into hour floats
-
-    This step is prior to feeding the arrays into the pipeline.
-    """
-    df_bikes["dt_start"] = pd.to_datetime(
-        df_bikes["trip_start_time"],
-        infer_datetime_format=True,
-    )
-    df_bikes["dt_end"] = pd.to_datetime(
-        df_bikes["trip_stop_time"],
-        infer_datetime_format=True,
-    )
-    # get day of week
-    df_bikes["day_of_week"] = df_bikes.apply(
-        lambda x: x["dt_start"].day_of_week, axis=1
-    )
-    # get hours
-    df_bikes["start_hour"] = df_bikes.apply(
-        lambda x: x["dt_start"].hour + x["dt_start"].minute / 60,
-        axis=1,
-    )
-    df_bikes["end_hour"] = df_bikes.apply(
-        lambda x: x["dt_end"].hour + x["dt_end"].minute / 60,
-        axis=1,
-    )
-    df_bikes["target"] = df_bikes["user_type"].apply(lambda type: type == "Member")
-    drops = [
-        "trip_id",
-        "trip_start_time",
-        "trip_stop_time",
-        "from_station_name",
-        "to_station_name",
-        "dt_start",
-        "dt_end",
-        "user_type",
-    ]
-    df_bikes = df_bikes.drop(drops, axis=1)
-    return df_bikes
-
-
-def retrieve() -> mlflow.pyfunc.PyFuncModel:
-    """Retrieves and returns the latest version of the registered model"""
+# most rides scored by one batch request
+MAX_BATCH = int(os.getenv("MAX_BATCH", 10_000))
+NDJSON_TYPES = ("application/x-ndjson", "application/jsonl")
+# concurrent /predict requests are scored together: a batch waits at most
+# BATCH_WINDOW_MS after its first ride, and holds at most BATCH_MAX_SIZE
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", 5))
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", 64))
+# single rides skip pandas when the model can be compiled, and are scored
+# right away instead of by the micro-batcher, which then only serves models
+# the fast path cannot compile; FAST_PATH=0 to micro-batch them instead
+FAST_PATH = os.getenv("FAST_PATH", "1") == "1"
+# predictions are saved in the background, DB_BATCH_SIZE records per write
+# or every DB_FLUSH_MS; with DB_SPILL_DIR set, records that cannot be written
+# are kept there until MongoDB is back, otherwise requests wait for it once
+# DB_MAX_BUFFER records are waiting
+DB_BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", 500))
+DB_FLUSH_MS = float(os.getenv("DB_FLUSH_MS", 1000))
+DB_MAX_BUFFER = int(os.getenv("DB_MAX_BUFFER", 10_000))
+DB_SPILL_DIR = os.getenv("DB_SPILL_DIR")
+# saved predictions expire after RETENTION_DAYS
+PREDICTION_RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", RETENTION_DAYS))
+
+
+def production_version():
+    """The ModelVersion of the registered model in the Production stage"""
     logging.basicConfig(level=logging.INFO, stream=sys.stdout)
     logging.debug(__name__)
     # defaults to ./mlruns if empty
@@ -115,30 +85,43 @@ def retrieve() -> mlflow.pyfunc.PyFuncModel:
             f"version: {mv.version}\nStage: {mv.current_stage}\nSource: {mv.source}"
         )
 
-    model_uris = [mv.source for mv in mv_search if mv.current_stage == "Production"]
-    logging.info(model_uris)
+    production = [mv for mv in mv_search if mv.current_stage == "Production"]
+    logging.info([mv.source for mv in production])
+    return production[0]
+
 
+def retrieve(model_version=None) -> mlflow.pyfunc.PyFuncModel:
+    """Retrieves and returns a version of the registered model, by default
+    the one in Production
+    """
+    model_version = model_version or production_version()
     # alternatively model_uri could also be direct path to s3 bucket:
     # s3://{MLFLOW_ARTIFACT_STORE}/<exp_id>/<run_id>/artifacts/models
     # the models:/model_name/Production uri is only useable if MLflow server is up
     model = mlflow.pyfunc.load_model(
         # model_uri=f'models:/{MLFLOW_REGISTERED_MODEL}/Production'
-        model_uri=model_uris[0]
+        model_uri=model_version.source
     )
     return model
 
 
-def predict(model: mlflow.pyfunc.PyFuncModel, features: pd.DataFrame) -> bool:
-    """Given model and bikeshare trip data, return the predicted membership,
-    as well as the associated probability
+def predict(model: mlflow.pyfunc.PyFuncModel, features: pd.DataFrame) -> list:
+    """Given model and bikeshare trip data, return the predicted membership
+    of each trip, in order
     """
-    pred = model.predict(features)
-    return bool(pred)
+    preds = model.predict(features)
+    # casting as python native bool allows serialization (to json)
+    return [bool(pred) for pred in preds]
+
 
+def save_to_db(record: dict) -> None:
+    """Save a prediction record to a DB for batch monitoring"""
+    writer.write(record)
 
-def save_to_db(result: dict) -> None:
-    """Save prediction metadata to a DB for batch monitoring"""
-    collection.insert_one(result)
+
+def save_many_to_db(records: list) -> None:
+    """Save the prediction records of a batch"""
+    writer.write_many(records)
 
 
 def send_to_evidently(result: dict) -> None:
@@ -150,8 +133,57 @@ def send_to_evidently(result: dict) -> None:
 # retrieve model only if first run?
 AWS_PROFILE = os.getenv("AWS_PROFILE", "default")
 logging.info(f"AWS_PROFILE set to: {AWS_PROFILE}")
-model = retrieve()
+MODEL_VERSION = production_version()
+model = retrieve(MODEL_VERSION)
 logging.info("Model retrieved from artifact store")
+# without .to_json(), jsonify will raise non serializable error
+MODEL_META = model.metadata.to_json()
+# saved predictions point to the model's registry version, whose metadata
+# is saved once under this id
+MODEL_ID = model_id(MODEL_VERSION.name, MODEL_VERSION.version)
+
+
+def setup_db() -> None:
+    """Indexes the predictions, and saves the metadata of the model"""
+    ensure_indexes(collection, PREDICTION_RETENTION_DAYS)
+    save_model_meta(
+        db.get_collection(MODELS),
+        MODEL_VERSION.name,
+        MODEL_VERSION.version,
+        MODEL_VERSION.run_id,
+        MODEL_META,
+    )
+
+
+writer = MongoWriter(
+    collection,
+    batch_size=DB_BATCH_SIZE,
+    flush_ms=DB_FLUSH_MS,
+    max_buffer=DB_MAX_BUFFER,
+    spill_dir=DB_SPILL_DIR,
+    setup=setup_db,
+)
+# buffered records are written when the worker exits
+atexit.register(writer.close, timeout=30)
+
+
+def score_rides(rides: list) -> list:
+    # same feature engineering as training; target is not a model input
+    return predict(model, build_features(rides)[FEATURES])
+
+
+batcher = MicroBatcher(score_rides, max_batch=BATCH_MAX_SIZE, window_ms=BATCH_WINDOW_MS)
+
+
+def sklearn_model(model: mlflow.pyfunc.PyFuncModel):
+    """The fitted pipeline behind a pyfunc sklearn model"""
+    impl = model._model_impl
+    # wrapped by mlflow >= 2, returned as is by mlflow 1.x
+    return getattr(impl, "sklearn_model", impl)
+
+
+fast_scorer = compile_scorer(sklearn_model(model)) if FAST_PATH else None
+logging.info(f"single ride fast path: {'on' if fast_scorer else 'off'}")
 
 app = Flask("bikeshare-membership-prediction")
 
@@ -164,38 +196,111 @@ def predict_endpoint():
     for web service to make the prediction
     """
     # from the POST request
-    ride = request.get_json()
+    try:
+        ride = request.get_json()
+    except BadRequest as exc:
+        return jsonify({"error": f"invalid JSON: {exc}"}), 400
+    if not isinstance(ride, dict):
+        return jsonify({"error": "expected a ride, as a JSON object"}), 400
     logging.info("Received PUT request")
 
-    df_bike = json_to_df(ride)
-    logging.info("Converted json to dataframe")
-
-    features = preprocess(df_bike)
-    logging.info("Preprocessed input data")
-
     # retrieve only on server startup, not every time a request is made
     # to minimize load on S3 and reduce response time
     # model = retrieve()
 
-    # model is global var.
-    # casting as python native bool allows serialization (to json)
-    pred = predict(model, features)
+    # a bad ride fails as the rides of a batch request do, on either path:
+    # ride_values checks its fields and dates before the paths split, and
+    # the batcher re-raises a ride's scoring error here, in its request
+    try:
+        values = ride_values(ride)
+        if fast_scorer:
+            # casting as python native bool allows serialization (to json)
+            pred = bool(fast_scorer.predict_values(values))
+        else:
+            # featurized and scored together with concurrent requests
+            pred = batcher.predict([ride])[0]
+    except KeyError as exc:
+        return jsonify({"error": f"ride is missing {exc}"}), 400
+    except (ValueError, TypeError) as exc:
+        # e.g. a malformed date, or a station the model does not know
+        return jsonify({"error": f"invalid ride: {exc}"}), 400
     result = {
         "predicted_membership": pred,
         "input_data": ride,
         # need custom pyfunc wrapper to include predict_proba
         # "probability": proba,
-        # without .to_json(), jsonify will raise non serializable error
-        "model_meta": model.metadata.to_json(),
+        "model_meta": MODEL_META,
     }
     logging.info("Returning result")
 
-    save_to_db(result.copy())
+    save_to_db(make_record(values, pred, MODEL_ID, ride_target(ride)))
     send_to_evidently(result.copy())
 
     return jsonify(result)
 
 
+def read_rides() -> list:
+    """The rides of a batch request: a JSON array, or one JSON ride per line"""
+    if request.mimetype in NDJSON_TYPES:
+        lines = request.get_data(as_text=True).splitlines()
+        return [json.loads(line) for line in lines if line.strip()]
+    rides = request.get_json()
+    return [rides] if isinstance(rides, dict) else rides
+
+
+@app.route("/predict/batch", methods=["PUT", "POST"])
+def predict_batch_endpoint():
+    """Scores many rides at once
+
+    The rides are featurized in one vectorized pass and scored by a single
+    `model.predict`; the predictions are returned in input order.
+    """
+    try:
+        rides = read_rides()
+    except (ValueError, BadRequest) as exc:
+        # BadRequest: a JSON body that does not parse
+        return jsonify({"error": f"invalid JSON: {exc}"}), 400
+    if not isinstance(rides, list) or not rides:
+        return jsonify({"error": "expected a non-empty list of rides"}), 400
+    if not all(isinstance(ride, dict) for ride in rides):
+        return jsonify({"error": "every ride must be a JSON object"}), 400
+    if len(rides) > MAX_BATCH:
+        return jsonify({"error": f"at most {MAX_BATCH} rides per request"}), 413
+    logging.info(f"Received batch of {len(rides)} rides")
+
+    try:
+        features = build_features(rides)
+        preds = predict(model, features[FEATURES])
+        # per ride, as build_features fills a batch's missing user_type
+        records = [
+            make_record(values, pred, MODEL_ID, ride_target(ride))
+            for values, pred, ride in zip(
+                features[FEATURES].itertuples(index=False, name=None), preds, rides
+            )
+        ]
+    except KeyError as exc:
+        return jsonify({"error": f"rides are missing {exc}"}), 400
+    except (ValueError, TypeError) as exc:
+        # e.g. a malformed date, or a station the model does not know
+        return jsonify({"error": f"invalid rides: {exc}"}), 400
+
+    save_many_to_db(records)
+    return jsonify({"predicted_membership": preds, "model_meta": MODEL_META})
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Micro-batching counters, queue depth, and batch size and latencies,
+    and the counters of the background MongoDB writer
+
+    With the fast path on, single rides bypass the micro-batcher.
+    """
+    metrics = batcher.metrics()
+    metrics["fast_path"] = fast_scorer is not None
+    metrics["db_writer"] = writer.metrics()
+    return jsonify(metrics)
+
+
 if __name__ == "__main__":
     app.run(
         debug=True,
@@ -0,0 +1,204 @@
+"""
+Asynchronous, batched writes of prediction records to MongoDB
+
+Request threads hand their records to a `MongoWriter` and return at once.
+A worker thread buffers them and writes them with one `insert_many` when
+`batch_size` records are queued, or `flush_ms` after the first of them
+arrived. While MongoDB is unreachable, failed batches are either spilled
+to `spill_dir` and written once it is back, or, without a `spill_dir`,
+retried until they succeed: the buffer then fills up, and `write` blocks,
+slowing the callers down rather than growing without bound. `close`
+writes out whatever is buffered.
+"""
+import logging
+import os
+import pickle
+import queue
+import threading
+import time
+from pathlib import Path
+
+# code of the errors of records already inserted by an earlier attempt
+DUPLICATE_KEY = 11000
+
+
+def only_duplicates(exc: Exception) -> bool:
+    """Whether a failed insert only rejected records already written"""
+    details = getattr(exc, "details", None) or {}
+    errors = details.get("writeErrors")
+    return (
+        bool(errors)
+        and all(error.get("code") == DUPLICATE_KEY for error in errors)
+        and not details.get("writeConcernErrors")
+    )
+
+
+class MongoWriter:
+    """Writes records to a collection in batches, from a background thread
+
+    At most `max_buffer` records wait to be written. A batch that fails is
+    spilled to `spill_dir` if given, or retried every `retry_s` seconds.
+    Records keep the `_id` of their first attempt, so a batch that was
+    partly written is not duplicated when written again. `setup`, e.g.
+    creating indexes, is called before the first write, and retried with
+    the writes until it succeeds.
+    """
+
+    def __init__(
+        self,
+        collection,
+        batch_size: int = 500,
+        flush_ms: float = 1000.0,
+        max_buffer: int = 10_000,
+        spill_dir: str = None,
+        retry_s: float = 5.0,
+        setup=None,
+    ):
+        self.collection = collection
+        self._setup = setup
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        self.retry_s = retry_s
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        if self.spill_dir:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+        self._queue = queue.Queue(maxsize=max_buffer)
+        self._closed = threading.Event()
+        self._next_retry = 0.0
+        self._lock = threading.Lock()
+        self._counts = {
+            "written": 0,
+            "batches": 0,
+            "errors": 0,
+            "spilled": 0,
+            "dropped": 0,
+        }
+        self._worker = threading.Thread(
+            target=self._run, name="mongo-writer", daemon=True
+        )
+        self._worker.start()
+
+    def write(self, record: dict) -> None:
+        """Queues a record; blocks while the buffer is full"""
+        if self._closed.is_set():
+            raise RuntimeError("the writer is closed")
+        if self.spill_dir is None:
+            self._queue.put(record)
+            return
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            # the worker is behind; spilling keeps the caller from waiting
+            self._spill([record])
+
+    def write_many(self, records: list) -> None:
+        for record in records:
+            self.write(record)
+
+    def close(self, timeout: float = None) -> None:
+        """Writes out the buffered records and stops the worker"""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._queue.put(None)
+        self._worker.join(timeout)
+
+    def _collect(self):
+        """Waits for records, then batches those that follow in the window
+
+        Returns the batch and whether the writer was closed.
+        """
+        batch = []
+        try:
+            record = self._queue.get(timeout=self.flush_ms / 1000)
+        except queue.Empty:
+            return batch, False
+        if record is None:
+            return batch, True
+        batch.append(record)
+        deadline = time.perf_counter() + self.flush_ms / 1000
+        while len(batch) < self.batch_size:
+            try:
+                record = self._queue.get(timeout=max(0, deadline - time.perf_counter()))
+            except queue.Empty:
+                break
+            if record is None:
+                return batch, True
+            batch.append(record)
+        return batch, False
+
+    def _run(self):
+        closed = False
+        while not closed:
+            batch, closed = self._collect()
+            if batch:
+                self._flush(batch)
+            # spilled records get a last try on close
+            if self.spill_dir and (closed or time.monotonic() >= self._next_retry):
+                self._replay()
+
+    def _insert(self, records: list) -> None:
+        if self._setup:
+            self._setup()
+            self._setup = None
+        try:
+            self.collection.insert_many(records, ordered=False)
+        except Exception as exc:
+            if not only_duplicates(exc):
+                raise
+        with self._lock:
+            self._counts["written"] += len(records)
+            self._counts["batches"] += 1
+
+    def _flush(self, records: list) -> None:
+        while True:
+            try:
+                self._insert(records)
+                return
+            except Exception as exc:
+                logging.warning(f"failed to write {len(records)} records: {exc!r}")
+                with self._lock:
+                    self._counts["errors"] += 1
+                self._next_retry = time.monotonic() + self.retry_s
+            if self.spill_dir:
+                self._spill(records)
+                return
+            # meanwhile the buffer fills up, and `write` blocks
+            if self._closed.wait(self.retry_s):
+                logging.error(f"dropped {len(records)} records on close")
+                with self._lock:
+                    self._counts["dropped"] += len(records)
+                return
+
+    def _spill(self, records: list) -> None:
+        """Saves records to a new file in `spill_dir`, to be written later"""
+        spill_file = self.spill_dir / f"{time.time_ns()}-{threading.get_ident()}.pkl"
+        tmp_file = spill_file.with_suffix(".tmp")
+        with open(tmp_file, "wb") as f_out:
+            pickle.dump(records, f_out)
+        os.replace(tmp_file, spill_file)
+        with self._lock:
+            self._counts["spilled"] += len(records)
+
+    def _replay(self) -> None:
+        """Writes the spilled records, oldest first, until a write fails"""
+        for spill_file in sorted(self.spill_dir.glob("*.pkl")):
+            with open(spill_file, "rb") as f_in:
+                records = pickle.load(f_in)
+            try:
+                self._insert(records)
+            except Exception as exc:
+                logging.warning(f"failed to write spilled records: {exc!r}")
+                self._next_retry = time.monotonic() + self.retry_s
+                return
+            spill_file.unlink()
+            logging.info(f"wrote {len(records)} spilled records")
+
+    def metrics(self) -> dict:
+        """Counters since startup, and records waiting in the buffer or on disk"""
+        with self._lock:
+            metrics = dict(self._counts)
+        metrics["buffered"] = self._queue.qsize()
+        if self.spill_dir:
+            metrics["spill_files"] = len(list(self.spill_dir.glob("*.pkl")))
+        return metrics
@@ -0,0 +1,122 @@
+"""
+Station encoders for the training pipeline
+
+One-hot encoding the from/to stations gives one sparse column per station,
+so fit time and model size grow with the station count. The compact
+backends replace them with a few columns:
+
+- ordinal: one integer code per station column
+- target: smoothed member rate and trip count of each station, from
+  statistics computed once per dataset with `station_stats`
+- hash: the station ids hashed into a fixed number of sparse columns
+"""
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.compose import make_column_transformer
+from sklearn.feature_extraction import FeatureHasher
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import FunctionTransformer, OneHotEncoder, OrdinalEncoder
+
+ENCODERS = ["onehot", "ordinal", "target", "hash"]
+STATIONS = ["from_station_id", "to_station_id"]
+# columns shared by both stations with the hash encoder
+HASH_FEATURES = 64
+# weight of the overall member rate in a station's rate, in trips
+SMOOTHING = 20.0
+
+
+def station_stats(X: pd.DataFrame, y, smoothing: float = SMOOTHING) -> dict:
+    """Member rate and trip count per station, for each station column
+
+    Rates are shrunk towards the overall member rate, so that stations with
+    few trips do not get extreme values. Returns a DataFrame per station
+    column indexed by station id, and the overall rate under "prior".
+    """
+    y = pd.Series(np.asarray(y, dtype="float64"), index=X.index)
+    prior = y.mean()
+    stats = {"prior": prior}
+    for col in STATIONS:
+        grouped = y.groupby(np.asarray(X[col])).agg(["sum", "count"])
+        rate = (grouped["sum"] + smoothing * prior) / (grouped["count"] + smoothing)
+        stats[col] = pd.DataFrame({"rate": rate, "count": grouped["count"]})
+    return stats
+
+
+class StationTargetEncoder(BaseEstimator, TransformerMixin):
+    """Encodes each station column as its member rate and trip count
+
+    With `stats` from `station_stats`, fitting reuses them instead of
+    grouping the training data again. Unknown stations get the overall
+    rate and a count of 0.
+    """
+
+    def __init__(self, stats: dict = None, smoothing: float = SMOOTHING):
+        self.stats = stats
+        self.smoothing = smoothing
+
+    def fit(self, X, y=None):
+        if self.stats is None:
+            self.stats_ = station_stats(X, y, self.smoothing)
+        else:
+            self.stats_ = self.stats
+        return self
+
+    def transform(self, X):
+        encoded = []
+        for col in STATIONS:
+            table = self.stats_[col]
+            idx = table.index.get_indexer(np.asarray(X[col]))
+            known = idx >= 0
+            rate = np.where(known, table["rate"].to_numpy()[idx], self.stats_["prior"])
+            count = np.where(known, table["count"].to_numpy()[idx], 0)
+            encoded.extend([rate, count])
+        return np.column_stack(encoded).astype("float32")
+
+    def get_feature_names_out(self, input_features=None):
+        return np.array(
+            [f"{col}_{stat}" for col in STATIONS for stat in ("rate", "count")]
+        )
+
+
+def station_tokens(X) -> list:
+    """One "column=id" string per station column, per row, for hashing"""
+    return [
+        [f"{col}={station}" for col, station in zip(STATIONS, row)]
+        for row in np.asarray(X[STATIONS]).tolist()
+    ]
+
+
+def make_encoder(
+    encoder: str = "onehot", stats: dict = None, handle_unknown: str = "error"
+):
+    """Column transformer encoding the stations with the chosen backend
+
+    The other features are passed through. `stats` is only used by the
+    target encoder, and `handle_unknown` only by the one-hot encoder; the
+    compact backends always accept unknown stations.
+    """
+    if encoder == "onehot":
+        return make_column_transformer(
+            (OneHotEncoder(handle_unknown=handle_unknown), ["from_station_id"]),
+            (OneHotEncoder(handle_unknown=handle_unknown), ["to_station_id"]),
+            # remainder='drop',
+            remainder="passthrough",
+        )
+    if encoder == "ordinal":
+        station_encoder = OrdinalEncoder(
+            handle_unknown="use_encoded_value", unknown_value=-1
+        )
+    elif encoder == "target":
+        station_encoder = StationTargetEncoder(stats=stats)
+    elif encoder == "hash":
+        station_encoder = make_pipeline(
+            FunctionTransformer(station_tokens),
+            FeatureHasher(n_features=HASH_FEATURES, input_type="string"),
+        )
+    else:
+        raise ValueError(f"encoder must be one of {ENCODERS}, got {encoder}")
+    return make_column_transformer(
+        (station_encoder, STATIONS),
+        remainder="passthrough",
+    )
@@ -0,0 +1,120 @@
+"""
+Streams the trip csvs out of the ridership zips published on Toronto Open
+Data, straight into the chunked preprocessing and the feature store
+
+Archives can be local files or URLs. Remote archives are read in place
+with HTTP Range requests, so neither the zip nor the extracted csvs are
+written to disk.
+"""
+import io
+import zipfile
+from pathlib import Path
+
+import requests
+
+from .features import DATE_FMT
+from .fetch import TIMEOUT
+from .preprocess import CHUNKSIZE, ingest
+
+# bytes fetched per Range request when reading a remote archive
+READ_BLOCK = 4 * 1024 * 1024
+
+
+class HTTPRangeFile(io.RawIOBase):
+    """Read-only, seekable view of a remote file, fetched on demand
+
+    zipfile needs to seek to the central directory at the end of the
+    archive, then to each member; every read becomes a Range request.
+    Wrap in io.BufferedReader so small reads share one request.
+    """
+
+    def __init__(self, url: str, session: requests.Session = None):
+        super().__init__()
+        self.url = url
+        self.session = session or requests.Session()
+        head = self.session.head(url, allow_redirects=True, timeout=TIMEOUT)
+        head.raise_for_status()
+        self.size = int(head.headers["Content-Length"])
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._pos = offset
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        if self._pos >= self.size:
+            return 0
+        end = min(self._pos + len(buffer), self.size) - 1
+        response = self.session.get(
+            self.url, headers={"Range": f"bytes={self._pos}-{end}"}, timeout=TIMEOUT
+        )
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise OSError(f"{self.url} does not support Range requests")
+        data = response.content
+        buffer[: len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+def open_archive(zip_source: str) -> zipfile.ZipFile:
+    """Opens a local or remote (http/https) zip without downloading it"""
+    if str(zip_source).startswith(("http://", "https://")):
+        remote = io.BufferedReader(HTTPRangeFile(zip_source), buffer_size=READ_BLOCK)
+        return zipfile.ZipFile(remote)
+    return zipfile.ZipFile(Path(zip_source))
+
+
+def csv_members(archive: zipfile.ZipFile) -> list:
+    """The trip csvs in an archive, skipping macOS resource forks"""
+    return [
+        info
+        for info in archive.infolist()
+        if info.filename.lower().endswith(".csv")
+        and not info.filename.startswith("__MACOSX/")
+    ]
+
+
+def ingest_archive(
+    zip_source: str,
+    store_path: Path,
+    chunksize: int = CHUNKSIZE,
+    date_fmt: str = DATE_FMT,
+) -> list:
+    """Preprocesses every trip csv in a zip into the feature store
+
+    Each member is decompressed as a stream and read chunk by chunk.
+    Members are fingerprinted by the size and CRC-32 recorded in the
+    archive, so unchanged members are skipped without being read.
+    Returns the sorted (year, month) partitions holding the archive.
+    """
+    partitions = set()
+    with open_archive(zip_source) as archive:
+        for info in csv_members(archive):
+            source = f"zip://{info.filename}::{zip_source}"
+            fingerprint = {"size": info.file_size, "modified": f"crc32:{info.CRC:08x}"}
+            with archive.open(info) as member:
+                partitions.update(
+                    ingest(
+                        member,
+                        store_path,
+                        chunksize=chunksize,
+                        date_fmt=date_fmt,
+                        source=source,
+                        fingerprint=fingerprint,
+                    )
+                )
+    return sorted(partitions)
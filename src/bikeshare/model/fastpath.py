@@ -0,0 +1,122 @@
+"""
+Low-latency scoring of single rides, without pandas
+
+For one ride, building a DataFrame, running the ColumnTransformer and
+going through the forest's input validation and joblib dispatch costs
+far more than walking the trees. `FastScorer` compiles a fitted
+one-hot + forest pipeline once: the output column of every station is
+looked up from the fitted encoders, so a ride becomes a dense float32 row
+directly, and each tree only looks up the leaf the row falls into.
+Its probabilities match `pipeline.predict_proba` on the same ride.
+"""
+import numpy as np
+from sklearn.ensemble._forest import ForestClassifier
+from sklearn.preprocessing import FunctionTransformer, OneHotEncoder
+
+from .features import FEATURES, ride_values
+
+# the dtype trees are evaluated in
+DTYPE = np.float32
+
+
+class FastScorer:
+    """Scores one raw ride at a time with a compiled fitted pipeline
+
+    Supports pipelines of a ColumnTransformer, whose transformers are
+    single-column OneHotEncoders or passed through, and a forest
+    classifier. Raises ValueError for any other pipeline.
+    """
+
+    def __init__(self, pipeline):
+        if len(pipeline) != 2:
+            raise ValueError("expected an encoder and a classifier")
+        encoder, forest = pipeline[0], pipeline[-1]
+        if not isinstance(forest, ForestClassifier):
+            raise ValueError(f"cannot compile {type(forest).__name__}")
+        self.forest = forest
+        # class probabilities of every node of each tree, normalized as
+        # DecisionTreeClassifier.predict_proba does, so a ride only needs
+        # the leaf it falls into
+        self.leaf_proba = []
+        for tree in forest.estimators_:
+            value = tree.tree_.value[:, 0, : forest.n_classes_]
+            normalizer = value.sum(axis=1, keepdims=True)
+            normalizer[normalizer == 0] = 1
+            self.leaf_proba.append(value / normalizer)
+        self.n_columns = sum(s.stop - s.start for s in encoder.output_indices_.values())
+        # feature position -> output column, for passed through features
+        self.passthrough = {}
+        # feature position -> ({category: output column}, handle_unknown)
+        self.onehot = {}
+        for name, transformer, columns in encoder.transformers_:
+            out = encoder.output_indices_[name]
+            # the remainder's columns are indices into the fitted input
+            names = [
+                col if isinstance(col, str) else encoder.feature_names_in_[col]
+                for col in columns
+            ]
+            positions = [FEATURES.index(name) for name in names]
+            if out.stop == out.start:
+                continue
+            # newer sklearn fits a passed through remainder as an identity
+            identity = isinstance(transformer, FunctionTransformer) and (
+                transformer.func is None
+            )
+            if transformer == "passthrough" or identity:
+                for position, column in zip(positions, range(out.start, out.stop)):
+                    self.passthrough[position] = column
+            elif isinstance(transformer, OneHotEncoder) and len(positions) == 1:
+                if transformer.drop_idx_ is not None or getattr(
+                    transformer, "_infrequent_enabled", False
+                ):
+                    raise ValueError("cannot compile dropped or infrequent categories")
+                categories = transformer.categories_[0].tolist()
+                columns = {cat: out.start + i for i, cat in enumerate(categories)}
+                self.onehot[positions[0]] = (columns, transformer.handle_unknown)
+            else:
+                raise ValueError(f"cannot compile the {name} transformer")
+
+    def encode(self, values: list) -> np.ndarray:
+        """The encoded row of a ride's `ride_values`, as a (1, n_columns) array"""
+        row = np.zeros((1, self.n_columns), dtype=DTYPE)
+        for position, column in self.passthrough.items():
+            row[0, column] = values[position]
+        for position, (columns, handle_unknown) in self.onehot.items():
+            column = columns.get(values[position])
+            if column is not None:
+                row[0, column] = 1
+            elif handle_unknown == "error":
+                raise ValueError(
+                    f"unknown {FEATURES[position]} {values[position]} in the ride"
+                )
+        return row
+
+    def transform(self, ride: dict) -> np.ndarray:
+        """The encoded row of a raw ride, as a (1, n_columns) array"""
+        return self.encode(ride_values(ride))
+
+    def predict_proba_values(self, values: list) -> np.ndarray:
+        """Class probabilities of a ride, from its `ride_values`"""
+        row = self.encode(values)
+        proba = np.zeros(self.forest.n_classes_, dtype=np.float64)
+        for tree, leaf_proba in zip(self.forest.estimators_, self.leaf_proba):
+            proba += leaf_proba[tree.tree_.apply(row)[0]]
+        return proba / len(self.leaf_proba)
+
+    def predict_values(self, values: list):
+        """Predicted class of a ride, from its `ride_values`"""
+        return self.forest.classes_[np.argmax(self.predict_proba_values(values))]
+
+    def predict_proba(self, ride: dict) -> np.ndarray:
+        return self.predict_proba_values(ride_values(ride))
+
+    def predict(self, ride: dict):
+        return self.predict_values(ride_values(ride))
+
+
+def compile_scorer(pipeline):
+    """A `FastScorer` of the pipeline, or None if it cannot be compiled"""
+    try:
+        return FastScorer(pipeline)
+    except (ValueError, AttributeError, TypeError):
+        return None
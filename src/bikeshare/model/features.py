@@ -0,0 +1,93 @@
+"""
+Feature engineering shared by training, the prediction service and
+batch monitoring, so that every stage derives features the same way
+
+Accepts a single ride as a dict, a micro-batch as a list of dicts, or a
+full DataFrame of raw trips; all three go through the same columnar path.
+`ride_values` and `ride_target` derive the same features and target for
+one ride without pandas, for low-latency serving.
+"""
+from datetime import datetime
+from typing import Union
+
+import pandas as pd
+
+# trip_start_time and trip_stop_time, e.g. "13/1/2017 0:00"
+DATE_FMT = "%d/%m/%Y %H:%M"
+
+# model inputs, in the column order the training pipeline was fit on
+FEATURES = [
+    "trip_duration_seconds",
+    "from_station_id",
+    "to_station_id",
+    "day_of_week",
+    "start_hour",
+    "end_hour",
+]
+TARGET = "target"
+
+Rides = Union[dict, list, pd.DataFrame]
+
+
+def to_frame(rides: Rides) -> pd.DataFrame:
+    """Wraps a single ride or a list of rides as a DataFrame"""
+    if isinstance(rides, pd.DataFrame):
+        return rides
+    if isinstance(rides, dict):
+        rides = [rides]
+    return pd.DataFrame.from_records(rides)
+
+
+def hour_of_day(dt: pd.Series) -> pd.Series:
+    """Time of day as fractional hours, e.g. 13:45 -> 13.75"""
+    return dt.dt.hour + dt.dt.minute / 60
+
+
+def build_features(
+    rides: Rides, date_fmt: str = DATE_FMT, with_period: bool = False
+) -> pd.DataFrame:
+    """Derives the model features from raw trip records
+
+    Converts the datetimes from str obj to datetime objects, and extracts
+    the day of week and the time of day as hour floats. `target` is
+    included whenever the records carry `user_type`. `with_period` adds
+    the `year` and `month` of the trip start, for partitioning.
+    """
+    df_rides = to_frame(rides)
+    dt_start = pd.to_datetime(df_rides["trip_start_time"], format=date_fmt)
+    dt_end = pd.to_datetime(df_rides["trip_stop_time"], format=date_fmt)
+
+    features = df_rides[FEATURES[:3]].copy()
+    features["day_of_week"] = dt_start.dt.day_of_week.astype("int64")
+    features["start_hour"] = hour_of_day(dt_start)
+    features["end_hour"] = hour_of_day(dt_end)
+    if "user_type" in df_rides:
+        features[TARGET] = df_rides["user_type"] == "Member"
+    if with_period:
+        features["year"] = dt_start.dt.year
+        features["month"] = dt_start.dt.month
+    return features
+
+
+def ride_values(ride: dict, date_fmt: str = DATE_FMT) -> list:
+    """The FEATURES of a single raw ride, in order, without pandas
+
+    Gives the same values as `build_features`, for one ride.
+    """
+    dt_start = datetime.strptime(ride["trip_start_time"], date_fmt)
+    dt_end = datetime.strptime(ride["trip_stop_time"], date_fmt)
+    return [
+        ride["trip_duration_seconds"],
+        ride["from_station_id"],
+        ride["to_station_id"],
+        dt_start.weekday(),
+        dt_start.hour + dt_start.minute / 60,
+        dt_end.hour + dt_end.minute / 60,
+    ]
+
+
+def ride_target(ride: dict):
+    """The target of a single raw ride, or None if it has no `user_type`"""
+    if "user_type" not in ride:
+        return None
+    return ride["user_type"] == "Member"
@@ -4,11 +4,17 @@ If invoked from terminal, takes in year and output_path as parameters
 """
 
 import argparse
+import hashlib
+import json
 import logging
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from urllib.parse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
 
 # Toronto Open Data is stored in a CKAN instance. It's APIs are documented here:
 # https://docs.ckan.org/en/latest/api/
@@ -22,18 +28,82 @@ BASE_URL = "https://ckan0.cf.opendata.inter.prod-toronto.ca/api/3/action/"
 # https://ckan0.cf.opendata.inter.prod-toronto.ca/dataset/7e876c24-177c-4605-9cef-e50dd74c617f/resource/98b63ba7-24ba-41da-a788-1c28d21a39d1/download/bikeshare-ridership-2017.zip
 # {BASE_CKAN_URL}/dataset/<package_id>/resource/<resource_id>/download/<file_name.type>
 
+# concurrent downloads, and the minimum spacing between requests to one host
+# to not hammer the server with requests too quickly
+MAX_WORKERS = 4
+MIN_INTERVAL = 1.0
+RETRIES = 5
+BACKOFF = 2.0
+TIMEOUT = 30
+CHUNK_SIZE = 512 * 1024
+
+# kept in output_path: the cached package_show response, reused for
+# METADATA_TTL seconds, and what was downloaded for each resource id
+METADATA_CACHE = "_package.json"
+METADATA_TTL = 24 * 3600
+MANIFEST = "_manifest.json"
+
 
 def get_package_metadata(
-    api_url: str = "package_show", pkg_id: str = "bike-share-toronto-ridership-data"
+    api_url: str = "package_show",
+    pkg_id: str = "bike-share-toronto-ridership-data",
+    base_url: str = BASE_URL,
 ):
 
     params = {"id": pkg_id}
-    package = requests.get(BASE_URL + api_url, params=params, timeout=5).json()
+    response = requests.get(base_url + api_url, params=params, timeout=TIMEOUT)
+    response.raise_for_status()
+    package = response.json()
     return package
 
 
-# with open('pkg_list.json', 'w') as f_out:
-#     json.dump(package, f_out)
+def load_package_metadata(
+    cache_path: Path, ttl: float = METADATA_TTL, base_url: str = BASE_URL
+) -> dict:
+    """package_show response, from `cache_path` if younger than `ttl` seconds"""
+    if cache_path.exists():
+        with open(cache_path, "r") as f_in:
+            cached = json.load(f_in)
+        if time.time() - cached["fetched_at"] < ttl:
+            logging.info(f"Using package metadata cached in {cache_path}")
+            return cached["package"]
+
+    package = get_package_metadata(base_url=base_url)
+    with open(cache_path, "w") as f_out:
+        json.dump({"fetched_at": time.time(), "package": package}, f_out)
+    return package
+
+
+def load_manifest(manifest_path: Path) -> dict:
+    if not manifest_path.exists():
+        return {}
+    with open(manifest_path, "r") as f_in:
+        return json.load(f_in)
+
+
+def save_manifest(manifest_path: Path, manifest: dict) -> None:
+    with open(manifest_path, "w") as f_out:
+        json.dump(manifest, f_out, indent=2)
+
+
+def manifest_entry(resource: dict, file_path: Path) -> dict:
+    return {
+        "name": resource["name"],
+        "file": file_path.name,
+        "last_modified": resource.get("last_modified"),
+        "size": file_path.stat().st_size,
+        "sha256": file_digest(file_path, "sha256"),
+    }
+
+
+def is_current(resource: dict, entry: dict, output_path: Path) -> bool:
+    """Whether the manifest shows this version of the resource downloaded"""
+    if not entry or entry["last_modified"] != resource.get("last_modified"):
+        return False
+    file_path = output_path / entry["file"]
+    return file_path.exists() and file_path.stat().st_size == entry["size"]
+
+
 def parse_years(years: str) -> set:
     years_list = years.split(",")
     # raise ValueError if non-year values are given
@@ -43,7 +113,7 @@ def parse_years(years: str) -> set:
 
 
 def make_path(output_path: Path) -> bool:
-    if not output_path.exists:
+    if not output_path.exists():
         Path.mkdir(output_path, exist_ok=True, parents=True)
         return True
     else:
@@ -56,35 +126,202 @@ def is_year_present(name: list, years) -> bool:
     return any(present)
 
 
-def run(years, output_path):
-    years = parse_years(years)
-    made_path = make_path(output_path)
-    package = get_package_metadata()
-    # To get resource data:
-    for idx, resource in enumerate(package["result"]["resources"]):
+class HostRateLimiter:
+    """Spaces out the requests made to each host by `min_interval` seconds"""
 
-        # To download the first non datastore_active resource :
-        name_split = resource["name"].split("-")
-        if not resource["datastore_active"] and is_year_present(name_split, years):
-            res_url = resource["url"]
-            with requests.get(res_url, stream=True, timeout=5) as resource_dump_data:
-                resource_dump_data.raise_for_status()
-                # how to convert dump_data to .zip?
-                fname = f"""{resource['name']}.{resource['format'].lower()}"""
-                file_path = Path(output_path / fname)
-                if not file_path.exists():
-                    logging.info(f"Requesting from {res_url}")
-                    with open(file_path, "wb") as file:
-                        logging.info(f"Writing to {file_path}")
+    def __init__(self, min_interval: float = MIN_INTERVAL):
+        self.min_interval = min_interval
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url: str) -> None:
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.min_interval
+        time.sleep(slot - now)
+
+
+def resource_file_name(resource: dict) -> str:
+    return f"""{resource['name']}.{resource['format'].lower()}"""
+
+
+def file_digest(file_path: Path, algorithm: str) -> str:
+    digest = hashlib.new(algorithm)
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parse_hash(resource_hash: str):
+    """Splits a CKAN resource hash into (algorithm, hex digest)
+
+    Accepts "sha256:<hex>" style values, or a bare hex digest whose
+    algorithm is implied by its length. CKAN often leaves it empty.
+    """
+    if not resource_hash:
+        return None
+    if ":" in resource_hash:
+        algorithm, hex_digest = resource_hash.split(":", 1)
+        return algorithm.lower(), hex_digest.lower()
+    algorithm = {32: "md5", 40: "sha1", 64: "sha256"}.get(len(resource_hash))
+    return (algorithm, resource_hash.lower()) if algorithm else None
+
+
+def verify(file_path: Path, resource: dict) -> bool:
+    """Checks a download against the size and hash in the CKAN metadata"""
+    size = resource.get("size")
+    if size and file_path.stat().st_size != int(size):
+        logging.warning(
+            f"{file_path}: {file_path.stat().st_size} bytes, expected {size}"
+        )
+        return False
+    expected = parse_hash(resource.get("hash"))
+    if expected and file_digest(file_path, expected[0]) != expected[1]:
+        logging.warning(f"{file_path}: {expected[0]} checksum mismatch")
+        return False
+    return True
+
+
+def download_resource(
+    resource: dict,
+    output_path: Path,
+    session: requests.Session,
+    limiter: HostRateLimiter,
+    retries: int = RETRIES,
+    backoff: float = BACKOFF,
+) -> Path:
+    """Downloads one resource, resuming from a partial file if present
+
+    Data is written to a `.part` file that is only renamed to the final
+    name once it matches the size and hash in the CKAN metadata, so an
+    interrupted download is never mistaken for a finished one.
+    """
+    res_url = resource["url"]
+    file_path = Path(output_path / resource_file_name(resource))
+    part_path = file_path.with_name(file_path.name + ".part")
+    if file_path.exists():
+        if verify(file_path, resource):
+            logging.warning(f"Already exists: {file_path}")
+            return file_path
+        file_path.unlink()
+
+    for attempt in range(retries + 1):
+        if attempt:
+            delay = backoff * 2 ** (attempt - 1)
+            logging.info(f"Retrying {res_url} in {delay:.1f}s")
+            time.sleep(delay)
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        limiter.wait(res_url)
+        try:
+            logging.info(f"Requesting from {res_url}, from byte {offset}")
+            with session.get(
+                res_url, stream=True, timeout=TIMEOUT, headers=headers
+            ) as resource_dump_data:
+                # 416: nothing left past offset; the part file is complete
+                if resource_dump_data.status_code != 416:
+                    resource_dump_data.raise_for_status()
+                    # 200 instead of 206 means the server ignored the Range
+                    resumed = resource_dump_data.status_code == 206
+                    with open(part_path, "ab" if resumed else "wb") as file:
+                        logging.info(f"Writing to {part_path}")
                         for chunk in resource_dump_data.iter_content(
-                            chunk_size=512 * 1024
+                            chunk_size=CHUNK_SIZE
                         ):
                             file.write(chunk)
-                else:
-                    logging.warn(f"Already exists: {file_path}")
-            # to not hammer the server with quests too quickly
-            time.sleep(1)
-            # resource_urls.append(res_url)
+        except requests.RequestException as exc:
+            logging.warning(f"Download of {res_url} interrupted: {exc}")
+            continue
+
+        if verify(part_path, resource):
+            part_path.replace(file_path)
+            return file_path
+        # corrupt rather than incomplete; start over
+        part_path.unlink()
+
+    raise RuntimeError(f"Failed to download {res_url} after {retries} retries")
+
+
+def select_resources(package: dict, years: set) -> list:
+    resources = []
+    for resource in package["result"]["resources"]:
+        # To download the non datastore_active resources :
+        name_split = resource["name"].split("-")
+        if not resource["datastore_active"] and is_year_present(name_split, years):
+            resources.append(resource)
+    return resources
+
+
+def run(
+    years,
+    output_path,
+    max_workers: int = MAX_WORKERS,
+    min_interval: float = MIN_INTERVAL,
+    base_url: str = BASE_URL,
+    retries: int = RETRIES,
+    backoff: float = BACKOFF,
+    metadata_ttl: float = METADATA_TTL,
+) -> list:
+    """Downloads the new or changed resources for the given years
+
+    Resources whose id and `last_modified` match the manifest from a
+    previous run are skipped; a resource republished under the same name
+    is downloaded again. Returns the paths of all the selected resources.
+    """
+    years = parse_years(years)
+    output_path = Path(output_path)
+    made_path = make_path(output_path)
+    package = load_package_metadata(
+        output_path / METADATA_CACHE, ttl=metadata_ttl, base_url=base_url
+    )
+    resources = select_resources(package, years)
+
+    manifest_path = output_path / MANIFEST
+    manifest = load_manifest(manifest_path)
+    paths = {}
+    stale = []
+    for resource in resources:
+        entry = manifest.get(resource["id"])
+        if is_current(resource, entry, output_path):
+            logging.info(f"Up to date: {entry['file']}")
+            paths[resource["id"]] = output_path / entry["file"]
+            continue
+        # drop an older version so it is neither skipped nor resumed from
+        file_path = output_path / resource_file_name(resource)
+        for path in (file_path, file_path.with_name(file_path.name + ".part")):
+            if entry and path.exists():
+                path.unlink()
+        stale.append(resource)
+
+    limiter = HostRateLimiter(min_interval)
+    with requests.Session() as session:
+        session.mount("http://", HTTPAdapter(pool_maxsize=max_workers))
+        session.mount("https://", HTTPAdapter(pool_maxsize=max_workers))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(
+                    download_resource,
+                    resource,
+                    output_path,
+                    session,
+                    limiter,
+                    retries,
+                    backoff,
+                ): resource
+                for resource in stale
+            }
+            for future in as_completed(futures):
+                resource = futures[future]
+                file_path = future.result()
+                paths[resource["id"]] = file_path
+                # saved as each finishes, so a failed run keeps its progress
+                manifest[resource["id"]] = manifest_entry(resource, file_path)
+                save_manifest(manifest_path, manifest)
+
+    return [paths[resource["id"]] for resource in resources]
 
 
 if __name__ == "__main__":
@@ -101,6 +338,12 @@ if __name__ == "__main__":
         type=Path,
         help="The location where the resulting file will be saved.",
     )
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=MAX_WORKERS,
+        help="Number of resources downloaded concurrently.",
+    )
     args = parser.parse_args()
 
-    run(args.year, args.output_path)
+    run(args.year, args.output_path, max_workers=args.max_workers)
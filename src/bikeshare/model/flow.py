@@ -1,8 +1,25 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import pandas as pd
+from hyperopt.utils import coarse_utcnow
 from prefect import flow, get_run_logger, task
 from sklearn.model_selection import train_test_split
 
-from .preprocess import preprocess, read_df
+from .extract import ingest_archive
+from .incremental import (
+    N_NEW_TREES,
+    PARTITIONS_TAG,
+    format_partitions,
+    trained_partitions,
+    update_model,
+)
+from .instrument import Instrument
+from .preprocess import CHUNKSIZE, ingest, preprocess, read_df, stream_preprocess
 from .registry import register_model
+from .store import partition_filters, read_features
+from .streaming import BACKENDS, SGD_METRIC, stream_search
+from .tracking import end_parent_run, start_parent_run, tracking_env
 from .trials import model_search
 
 
@@ -17,45 +34,320 @@ def preprocess_task(df_bikes):
 
 
 @task
-def model_search_task(train, test, num_trials: int):
+def stream_preprocess_task(path: str, dest_file: Path, chunksize: int):
+    return stream_preprocess(path, dest_file, chunksize=chunksize)
+
+
+@task
+def ingest_task(path: str, store_path: str, chunksize: int):
+    return ingest(path, store_path, chunksize=chunksize)
+
+
+@task
+def ingest_archive_task(path: str, store_path: str, chunksize: int):
+    return ingest_archive(path, store_path, chunksize=chunksize)
+
+
+@task
+def model_search_task(
+    train,
+    test,
+    num_trials: int,
+    n_parallel: int = 1,
+    strategy: str = "tpe",
+    encoder: str = "onehot",
+    run_tags: dict = None,
+    trials_file: str = None,
+    resume: str = "warm",
+):
     logger = get_run_logger()
     # logger.info(f"Looking for train and test.pkl in {Path(dest_path).resolve()}")
-    logger.info(f"Beginning model_search with {num_trials} trials")
-    return model_search(train=train, test=test, num_trials=num_trials)
+    logger.info(f"Beginning {strategy} model_search with {num_trials} trials")
+    return model_search(
+        train=train,
+        test=test,
+        num_trials=num_trials,
+        n_parallel=n_parallel,
+        strategy=strategy,
+        encoder=encoder,
+        run_tags=run_tags,
+        trials_file=trials_file,
+        resume=resume,
+    )
+
+
+@task
+def stream_search_task(
+    store_path: str,
+    num_trials: int,
+    run_tags: dict = None,
+    trials_file: str = None,
+    resume: str = "warm",
+):
+    logger = get_run_logger()
+    logger.info(f"Beginning out-of-core sgd search with {num_trials} trials")
+    return stream_search(
+        store_path,
+        num_trials,
+        run_tags=run_tags,
+        trials_file=trials_file,
+        resume=resume,
+    )
+
+
+@task
+def register_model_task(metric: str = "roc_auc", parent_run_id: str = None):
+    return register_model(metric=metric, parent_run_id=parent_run_id)
 
 
 @task
-def register_model_task():
-    return register_model()
+def update_model_task(
+    df_bikes, n_new_trees: int, run_tags: dict = None, partitions: list = None
+):
+    return update_model(
+        df_bikes, n_new_trees=n_new_trees, run_tags=run_tags, partitions=partitions
+    )
 
 
 @flow()
-def to_bikes_flow(data_path: str, num_trials: int):
-    """Deployment flow for training the TO-bikeshare-classifier"""
+def to_bikes_flow(
+    data_path: str,
+    num_trials: int,
+    chunksize: int = None,
+    store_path: str = None,
+    n_parallel: int = 1,
+    strategy: str = "tpe",
+    encoder: str = "onehot",
+    stats_file: str = None,
+    trials_file: str = None,
+    resume: str = "warm",
+    incremental: bool = False,
+    n_new_trees: int = N_NEW_TREES,
+    backend: str = "forest",
+):
+    """Deployment flow for training the TO-bikeshare-classifier
+
+    With `chunksize`, the raw csv is streamed and preprocessed in chunks of
+    that many rows, so the full raw DataFrame is never held in memory.
+    With `store_path`, the features are kept in that parquet feature store
+    and re-runs on an unchanged csv read them back without re-parsing it.
+    A `data_path` to a .zip, local or URL, is then extracted as a stream.
+    `n_parallel` hyperopt trials are evaluated at a time. With `strategy`
+    "halving", the trials are the survivors of a successive halving search.
+    `encoder` selects the station encoding of the trained pipeline.
+    With `trials_file`, the search is checkpointed there after each trial;
+    by default (`resume` "warm") the next run's TPE search starts from the
+    saved trials, while "continue" finishes an interrupted run instead.
+
+    With `incremental`, only the ingested months the Production model was
+    not trained on are read, as recorded on its run, and instead of a
+    search the Production forest is grown by `n_new_trees` trees fit on
+    them; the result replaces Production only if it scores as well on a
+    holdout of those months. Without new months, nothing is trained.
+
+    With `backend` "sgd", the search instead trains SGD pipelines out of
+    core, on every month in `store_path` streamed in batches, so the
+    history is never loaded into memory at once.
+
+    Every stage's wall and CPU time, peak RSS and rows per second are
+    logged, recorded as metrics of the MLflow run the trials are nested
+    under, and appended to `stats_file` if given.
+    """
     logger = get_run_logger()
+    instrument = Instrument("to_bikes_flow", logger)
+    # the trial runs are nested under a run holding the stage metrics
+    tracking_uri, exp_name = tracking_env()
+    parent_run_id = start_parent_run(tracking_uri, exp_name, "to_bikes_flow")
+    status = "FAILED"
+    try:
+        _train(
+            instrument,
+            data_path,
+            num_trials,
+            chunksize=chunksize,
+            store_path=store_path,
+            n_parallel=n_parallel,
+            strategy=strategy,
+            encoder=encoder,
+            run_tags={"mlflow.parentRunId": parent_run_id},
+            trials_file=trials_file,
+            resume=resume,
+            incremental=incremental,
+            n_new_trees=n_new_trees,
+            backend=backend,
+        )
+        status = "FINISHED"
+    finally:
+        _close_parent_run(instrument, tracking_uri, parent_run_id, status)
+        if stats_file:
+            instrument.save(stats_file)
+
+
+def _close_parent_run(
+    instrument: Instrument, tracking_uri: str, run_id: str, status: str
+):
+    """Logs the stage metrics to the parent run, and ends it
+
+    Both are attempted. Their errors are raised after a successful
+    training, but only logged after a failed one, whose exception is the
+    one to report.
+    """
+    logger = get_run_logger()
+    error = None
+    try:
+        instrument.log_to_mlflow(run_id, tracking_uri)
+    except Exception as exc:
+        error = exc
+        logger.error(f"failed to log the stage metrics to run {run_id}: {exc!r}")
+    try:
+        end_parent_run(tracking_uri, run_id, status)
+    except Exception as exc:
+        error = error or exc
+        logger.error(f"failed to end run {run_id}: {exc!r}")
+    if error is not None and status == "FINISHED":
+        raise error
+
+
+def _train(
+    instrument: Instrument,
+    data_path: str,
+    num_trials: int,
+    chunksize: int = None,
+    store_path: str = None,
+    n_parallel: int = 1,
+    strategy: str = "tpe",
+    encoder: str = "onehot",
+    run_tags: dict = None,
+    trials_file: str = None,
+    resume: str = "warm",
+    incremental: bool = False,
+    n_new_trees: int = N_NEW_TREES,
+    backend: str = "forest",
+):
+    logger = get_run_logger()
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {BACKENDS}, got {backend}")
+    if incremental and not store_path:
+        raise ValueError("incremental training reads new months from a store_path")
+    if backend == "sgd" and not store_path:
+        raise ValueError("the sgd backend streams its data from a store_path")
 
     # Path.mkdir(dest_path, exist_ok=True)
     # logger.debug(f"absolute dest_path: {dest_path.resolve()}")
 
-    logger.info(f"reading data from {data_path}")
-    df = read_data_task(data_path)
+    if store_path:
+        logger.info(f"ingesting {data_path} into feature store {store_path}")
+        if str(data_path).endswith(".zip"):
+            ingest_fn = ingest_archive_task
+        else:
+            ingest_fn = ingest_task
+        with instrument.stage("ingest"):
+            partitions = ingest_fn(data_path, store_path, chunksize or CHUNKSIZE)
+        if backend == "sgd":
+            search_start = coarse_utcnow()
+            with instrument.stage("model_search"):
+                trials = stream_search_task(
+                    store_path,
+                    num_trials,
+                    run_tags=run_tags,
+                    trials_file=trials_file,
+                    resume=resume,
+                )
+            _register(instrument, trials, run_tags, search_start, metric=SGD_METRIC)
+            return
+        if incremental:
+            # ingest returns every month of the source, cached or not
+            trained = trained_partitions()
+            if trained is None:
+                logger.warning("Production records no trained months; using all")
+            else:
+                partitions = [period for period in partitions if period not in trained]
+            if not partitions:
+                logger.info("no months new to the Production model; not updating")
+                return
+        else:
+            run_tags = {
+                **(run_tags or {}),
+                PARTITIONS_TAG: format_partitions(partitions),
+            }
+        with instrument.stage("read_features") as stats:
+            df_bikes = read_features(store_path, filters=partition_filters(partitions))
+            stats["rows"] = len(df_bikes)
+    elif chunksize:
+        logger.info(f"streaming data from {data_path} in chunks of {chunksize}")
+        with instrument.stage("stream_preprocess") as stats:
+            with TemporaryDirectory() as tmp_dir:
+                dest_file = Path(tmp_dir) / "features.parquet"
+                stream_preprocess_task(data_path, dest_file, chunksize)
+                df_bikes = pd.read_parquet(dest_file)
+            stats["rows"] = len(df_bikes)
+    else:
+        logger.info(f"reading data from {data_path}")
+        with instrument.stage("read_data") as stats:
+            df = read_data_task(data_path)
+            stats["rows"] = len(df)
 
-    logger.info("prepping data")
-    df_bikes = preprocess_task(df)
+        logger.info("prepping data")
+        with instrument.stage("preprocess", rows=len(df)):
+            df_bikes = preprocess_task(df)
     logger.info(f"loaded {len(df_bikes)} rows of data")
 
-    train, test = train_test_split(
-        df_bikes,
-        test_size=0.3,
-        stratify=df_bikes["target"],
-    )
+    if incremental:
+        with instrument.stage("update_model", rows=len(df_bikes)):
+            latest_vers = update_model_task(
+                df_bikes, n_new_trees, run_tags, partitions=partitions
+            )
+        if latest_vers:
+            logger.info(f"updated model run ID: {latest_vers.run_id}")
+        else:
+            logger.info("update scored below Production; not registered")
+        return
+
+    with instrument.stage("split", rows=len(df_bikes)):
+        train, test = train_test_split(
+            df_bikes,
+            test_size=0.3,
+            stratify=df_bikes["target"],
+        )
     logger.info(f"Train size: {len(train)}\tTest size: {len(test)}")
 
-    trials = model_search_task(train=train, test=test, num_trials=num_trials)
+    search_start = coarse_utcnow()
+    with instrument.stage("model_search", rows=len(train)):
+        trials = model_search_task(
+            train=train,
+            test=test,
+            num_trials=num_trials,
+            n_parallel=n_parallel,
+            strategy=strategy,
+            encoder=encoder,
+            run_tags=run_tags,
+            trials_file=trials_file,
+            resume=resume,
+        )
+    _register(instrument, trials, run_tags, search_start)
+
+
+def _register(instrument: Instrument, trials, run_tags: dict, since, metric="roc_auc"):
+    """Promotes the best of the trials the search ran `since`, by `metric`
+
+    Only the runs of this search compete, so runs scored on other data or
+    by another backend are not compared with them. Trials loaded from a
+    trials file were logged under earlier runs, so a search that ran none,
+    e.g. resumed from a finished file, registers nothing.
+    """
+    logger = get_run_logger()
     if trials:
         for trial in trials:
             logger.debug(f"Trial {trial['tid']}: {trial['result']}")
-        latest_vers = register_model_task()
+        if not any(
+            trial["book_time"] and trial["book_time"] >= since for trial in trials
+        ):
+            logger.warning("the search ran no new trials; not registering")
+            return
+        with instrument.stage("register_model"):
+            latest_vers = register_model_task(
+                metric, (run_tags or {}).get("mlflow.parentRunId")
+            )
         logger.info(f"best model run ID: {latest_vers.run_id}")
         logger.info(f"source: {latest_vers.source}")
     else:
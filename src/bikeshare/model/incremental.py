@@ -0,0 +1,159 @@
+"""
+Incremental retraining of the Production model on newly arrived months
+
+Rather than searching and refitting from scratch, `update_model` keeps the
+fitted encoder and trees of the Production pipeline, and grows its forest
+with trees fit on the new months only (`warm_start`). The updated pipeline
+is logged as a run, and registered only if it scores at least as well as
+Production on a holdout of the new months. Runs record the (year, month)
+partitions their model was trained on, so `trained_partitions` tells
+which months are new to Production.
+"""
+import copy
+import logging
+import os
+
+import mlflow
+import numpy as np
+from mlflow.exceptions import MlflowException
+from mlflow.tracking import MlflowClient
+from sklearn.ensemble._forest import BaseForest
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import OneHotEncoder
+
+from .features import FEATURES, TARGET
+from .matrices import to_matrix
+from .registry import promote_run
+from .tracking import tracking_env
+
+# trees added per update
+N_NEW_TREES = 20
+# share of the new rows held out to compare the updated and Production models
+HOLDOUT = 0.2
+# run tag of the (year, month) partitions a model was trained on
+PARTITIONS_TAG = "partitions"
+
+
+def format_partitions(partitions) -> str:
+    """Tag value of (year, month) partitions, e.g. "2017-01,2017-02" """
+    return ",".join(f"{year}-{month:02}" for year, month in sorted(partitions))
+
+
+def parse_partitions(value: str) -> set:
+    return {
+        tuple(int(v) for v in period.split("-"))
+        for period in value.split(",")
+        if period
+    }
+
+
+def production_version(client: MlflowClient, model_name: str):
+    """The Production version of a registered model, or None"""
+    try:
+        versions = client.get_latest_versions(model_name, stages=["Production"])
+    except MlflowException:
+        # the model is not registered yet
+        return None
+    return versions[0] if versions else None
+
+
+def trained_partitions(model_name: str = None):
+    """The partitions the Production model was trained on
+
+    None if there is no Production version, or if its run did not record
+    them.
+    """
+    tracking_uri, _ = tracking_env()
+    model_name = model_name or os.getenv("MLFLOW_REGISTERED_MODEL", "TO-bikeshare-clf")
+    client = MlflowClient(tracking_uri=tracking_uri)
+    version = production_version(client, model_name)
+    if version is None:
+        return None
+    value = client.get_run(version.run_id).data.tags.get(PARTITIONS_TAG)
+    return None if value is None else parse_partitions(value)
+
+
+def add_trees(pipeline, X, y, n_new_trees: int = N_NEW_TREES):
+    """A copy of a fitted pipeline, its forest grown by trees fit on X, y
+
+    The fitted encoder is kept, so the existing trees see the columns they
+    were fit on; stations it has not seen are encoded as unknown.
+    """
+    updated = copy.deepcopy(pipeline)
+    encoder, forest = updated[0], updated[-1]
+    if not isinstance(forest, BaseForest):
+        raise TypeError(f"only forests can be grown, got {type(forest).__name__}")
+    for _, transformer, _ in encoder.transformers_:
+        if isinstance(transformer, OneHotEncoder):
+            transformer.set_params(handle_unknown="ignore")
+
+    forest.set_params(warm_start=True, n_estimators=forest.n_estimators + n_new_trees)
+    forest.fit(to_matrix(encoder.transform(X), "csc"), y)
+    forest.set_params(warm_start=False)
+    return updated
+
+
+def update_model(
+    df_new,
+    n_new_trees: int = N_NEW_TREES,
+    min_gain: float = 0.0,
+    run_tags=None,
+    partitions: list = None,
+):
+    """Grows the Production model on `df_new`, and promotes it if no worse
+
+    The update is promoted if its holdout roc_auc beats Production's by at
+    least `min_gain`. Returns the new Production ModelVersion, or None if
+    the current one is kept. Raises ValueError if there is no Production
+    version to update. `partitions` are those `df_new` was read from; the
+    update's run records them, with those of Production, as trained on.
+    """
+    tracking_uri, exp_name = tracking_env()
+    model_name = os.getenv("MLFLOW_REGISTERED_MODEL", "TO-bikeshare-clf")
+    mlflow.set_tracking_uri(tracking_uri)
+    client = MlflowClient(tracking_uri=tracking_uri)
+
+    base_version = production_version(client, model_name)
+    if base_version is None:
+        raise ValueError(f"{model_name} has no Production version to update")
+    base_model = mlflow.sklearn.load_model(base_version.source)
+
+    X, y = df_new[FEATURES], df_new[TARGET].to_numpy()
+    X_fit, X_holdout, y_fit, y_holdout = train_test_split(
+        X, y, test_size=HOLDOUT, stratify=y, random_state=42
+    )
+    model = add_trees(base_model, X_fit, y_fit, n_new_trees)
+
+    base_auc = roc_auc_score(y_holdout, base_model.predict_proba(X_holdout)[:, 1])
+    roc_auc = roc_auc_score(y_holdout, model.predict_proba(X_holdout)[:, 1])
+    logging.info(
+        f"holdout roc_auc of version {base_version.version} grown by "
+        f"{n_new_trees} trees: {roc_auc:.4f}, was {base_auc:.4f}"
+    )
+
+    tags = {"model": "to-bikeshare-clf", "incremental": "true"}
+    tags.update(run_tags or {})
+    if partitions:
+        base_tag = client.get_run(base_version.run_id).data.tags.get(PARTITIONS_TAG)
+        trained = parse_partitions(base_tag or "") | set(map(tuple, partitions))
+        tags[PARTITIONS_TAG] = format_partitions(trained)
+    mlflow.set_experiment(exp_name)
+    with mlflow.start_run(tags=tags) as run:
+        mlflow.log_params(
+            {"base_version": base_version.version, "n_new_trees": n_new_trees}
+        )
+        mlflow.log_metrics(
+            {
+                "roc_auc": roc_auc,
+                "roc_auc_production": base_auc,
+                "n_rows": int(np.size(y_fit)),
+            }
+        )
+        if roc_auc < base_auc + min_gain:
+            logging.info(f"keeping version {base_version.version} in Production")
+            return None
+        # not tagged MODEL_LOGGED: its roc_auc is on another holdout than the
+        # search trials' `register_model` ranks
+        mlflow.sklearn.log_model(model, "models")
+    return promote_run(client, run.info.run_id, model_name)
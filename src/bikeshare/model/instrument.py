@@ -0,0 +1,120 @@
+"""
+Stage-level instrumentation for the flows
+
+`Instrument.stage` records the wall time, CPU time, peak RSS and rows per
+second of a block of work. Each stage is logged as it ends; the whole
+run can then be logged as MLflow metrics and appended to a JSON file.
+Measuring costs a few system calls per stage, so it is left on.
+"""
+import json
+import logging
+import resource
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+# linux only; elsewhere the peak RSS is the process's high-water mark
+CLEAR_REFS = Path("/proc/self/clear_refs")
+STATUS = Path("/proc/self/status")
+
+
+def reset_peak_rss() -> None:
+    """Resets the process's peak RSS to its current RSS, where supported"""
+    try:
+        CLEAR_REFS.write_text("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb() -> float:
+    try:
+        for line in STATUS.read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def cpu_seconds() -> float:
+    """User and system time of this process and its finished children"""
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+class Instrument:
+    """Collects the stage stats of one flow run
+
+    Stats are logged to `logger`, e.g. the Prefect run logger.
+    """
+
+    def __init__(self, name: str, logger: logging.Logger = None):
+        self.name = name
+        self.logger = logger or logging.getLogger(__name__)
+        self.started = datetime.now(timezone.utc).isoformat()
+        self.stages = []
+
+    @contextmanager
+    def stage(self, stage_name: str, rows: int = None):
+        """Measures a block of work, and yields its stats
+
+        Set `stats["rows"]` in the block when the row count is only known
+        at the end:
+
+        with instrument.stage("read_data") as stats:
+            df = read_df(path)
+            stats["rows"] = len(df)
+        """
+        stats = {"stage": stage_name, "rows": rows}
+        reset_peak_rss()
+        wall_start, cpu_start = time.perf_counter(), cpu_seconds()
+        try:
+            yield stats
+        finally:
+            wall = time.perf_counter() - wall_start
+            stats["wall_s"] = round(wall, 4)
+            stats["cpu_s"] = round(cpu_seconds() - cpu_start, 4)
+            stats["peak_rss_mb"] = round(peak_rss_mb(), 1)
+            if stats["rows"] is not None and wall > 0:
+                stats["rows_per_s"] = round(stats["rows"] / wall, 1)
+            self.stages.append(stats)
+            message = (
+                f"{stage_name}: {stats['wall_s']:.2f}s wall, {stats['cpu_s']:.2f}s cpu, "
+                f"{stats['peak_rss_mb']:.0f}MB peak rss"
+            )
+            if "rows_per_s" in stats:
+                message += f", {stats['rows_per_s']:.0f} rows/s"
+            self.logger.info(message)
+
+    def metrics(self) -> dict:
+        """The stats flattened to "<stage>_<stat>" metrics"""
+        return {
+            f"{stats['stage']}_{key}": value
+            for stats in self.stages
+            for key, value in stats.items()
+            if key != "stage" and value is not None
+        }
+
+    def log_to_mlflow(self, run_id: str, tracking_uri: str = None) -> None:
+        """Logs the stats as metrics of an existing run"""
+        # the monitoring image has no mlflow
+        from mlflow.entities import Metric
+        from mlflow.tracking import MlflowClient
+
+        client = MlflowClient(tracking_uri=tracking_uri)
+        timestamp = int(time.time() * 1000)
+        client.log_batch(
+            run_id,
+            metrics=[Metric(k, v, timestamp, 0) for k, v in self.metrics().items()],
+        )
+
+    def save(self, path: Path) -> None:
+        """Appends this run's stats to a JSON lines file"""
+        record = {"flow": self.name, "started": self.started, "stages": self.stages}
+        with open(path, "a") as f_out:
+            f_out.write(json.dumps(record) + "\n")
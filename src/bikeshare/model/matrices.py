@@ -0,0 +1,47 @@
+"""
+Training matrices shared between search processes through memory mapping
+
+Encoded features are converted once to the float32 layout the tree
+models use internally, and saved with joblib. Each process then loads
+them with mmap_mode, so every trial worker and CV job reads the same
+pages of the files instead of holding its own copy of the data.
+"""
+from pathlib import Path
+
+import joblib
+import numpy as np
+import scipy.sparse as sp
+
+DTYPE = np.float32
+
+
+def to_matrix(Xt, sparse_format: str = "csr"):
+    """Float32 matrix of encoded features, in the layout sklearn won't copy
+
+    Dense features become a C-contiguous array. Sparse features become
+    CSC for matrices that trees are fit on, and CSR for the others.
+    """
+    if sp.issparse(Xt):
+        Xt = Xt.asformat(sparse_format).astype(DTYPE)
+        Xt.sort_indices()
+        return Xt
+    return np.ascontiguousarray(Xt, dtype=DTYPE)
+
+
+def dump_matrices(matrices: dict, cache_dir: Path) -> dict:
+    """Saves each matrix to its own file, and returns the paths by name"""
+    paths = {}
+    for name, matrix in matrices.items():
+        paths[name] = Path(cache_dir) / f"{name}.joblib"
+        joblib.dump(matrix, paths[name])
+    return paths
+
+
+def load_matrices(paths: dict, mmap_mode: str = "r") -> dict:
+    """Loads saved matrices as read-only memory maps
+
+    Sparse matrices are mapped too, through their data and index arrays.
+    """
+    return {
+        name: joblib.load(path, mmap_mode=mmap_mode) for name, path in paths.items()
+    }
@@ -1,78 +1,130 @@
 import argparse
-import pickle
+import logging
 from pathlib import Path
 
 import pandas as pd
-from sklearn.model_selection import train_test_split
+import pyarrow as pa
+import pyarrow.parquet as pq
 
+from . import store
+from .features import DATE_FMT, build_features
 
-def read_df(path: str):
+# rows per chunk when streaming; ~100 MB of raw trips
+CHUNKSIZE = 500_000
+
+# explicit dtypes for the raw columns the features are built from, so each
+# chunk skips type inference and every chunk has the same schema
+RAW_DTYPES = {
+    "trip_start_time": "str",
+    "trip_stop_time": "str",
+    "trip_duration_seconds": "int64",
+    "from_station_id": "int64",
+    "to_station_id": "int64",
+    "user_type": "category",
+}
+
+
+def read_df(path: str, chunksize: int = None):
     # can accept local and S3 filepath
+    # with chunksize, returns an iterator of DataFrames of at most that many rows
+    if chunksize:
+        return pd.read_csv(
+            path,
+            usecols=list(RAW_DTYPES),
+            dtype=RAW_DTYPES,
+            chunksize=chunksize,
+        )
     df = pd.read_csv(path)
     return df
 
 
-def dump_pickle(obj, filename) -> None:
-    with open(filename, "wb") as f_out:
-        pickle.dump(obj, f_out)
+def stream_preprocess(
+    raw_data_path: str, dest_file: Path, chunksize: int = CHUNKSIZE
+) -> int:
+    """Preprocesses the raw trips chunk by chunk into a parquet file
 
-
-def preprocess(df_bikes: pd.DataFrame) -> pd.DataFrame:
+    Each chunk is written out as its own row group as soon as it is
+    preprocessed, so peak memory is bounded by `chunksize` rather than the
+    size of the csv. Returns the number of rows written.
+    """
+    writer = None
+    n_rows = 0
+    try:
+        with read_df(raw_data_path, chunksize=chunksize) as reader:
+            for chunk in reader:
+                table = pa.Table.from_pandas(
+                    build_features(chunk), preserve_index=False
+                )
+                if writer is None:
+                    writer = pq.ParquetWriter(dest_file, table.schema)
+                writer.write_table(table)
+                n_rows += table.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return n_rows
+
+
+def preprocess(df_bikes: pd.DataFrame, date_fmt: str = DATE_FMT) -> pd.DataFrame:
     """Preprocesses the bikeshare data
 
     Converts the datetimes from str obj to datetime objects, and extracts
-    the time of day to convert into hour floats
+    the time of day to convert into hour floats. See `features.build_features`,
+    which the prediction service and batch monitoring use as well.
 
     This step is prior to feeding the arrays into the pipeline.
     """
-    df_bikes["dt_start"] = pd.to_datetime(
-        df_bikes["trip_start_time"],
-        infer_datetime_format=True,
-    )
-    df_bikes["dt_end"] = pd.to_datetime(
-        df_bikes["trip_stop_time"],
-        infer_datetime_format=True,
-    )
-    # get day of week
-    df_bikes["day_of_week"] = df_bikes.apply(
-        lambda x: x["dt_start"].day_of_week, axis=1
-    )
-    # get hours
-    df_bikes["start_hour"] = df_bikes.apply(
-        lambda x: x["dt_start"].hour + x["dt_start"].minute / 60,
-        axis=1,
-    )
-    df_bikes["end_hour"] = df_bikes.apply(
-        lambda x: x["dt_end"].hour + x["dt_end"].minute / 60,
-        axis=1,
-    )
-    df_bikes["target"] = df_bikes["user_type"].apply(lambda type: type == "Member")
-    drops = [
-        "trip_id",
-        "trip_start_time",
-        "trip_stop_time",
-        "from_station_name",
-        "to_station_name",
-        "dt_start",
-        "dt_end",
-        "user_type",
-    ]
-    df_bikes = df_bikes.drop(drops, axis=1)
-    return df_bikes
-
-
-def run(raw_data_path: str, dest_path: str):
-    Path.mkdir(dest_path, exist_ok=True)
-    df = read_df(raw_data_path)
-    df_bikes = preprocess(df)
-    train, test = train_test_split(
-        df_bikes,
-        test_size=0.3,
-        stratify=df_bikes["target"],
-    )
+    return build_features(df_bikes, date_fmt=date_fmt)
+
+
+def ingest(
+    raw_data_path,
+    store_path: Path,
+    chunksize: int = CHUNKSIZE,
+    date_fmt: str = DATE_FMT,
+    source: str = None,
+    fingerprint: dict = None,
+) -> list:
+    """Preprocesses a raw trips csv into the store, chunk by chunk
 
-    dump_pickle(train, Path(dest_path / "train.pkl"))
-    dump_pickle(test, Path(dest_path / "test.pkl"))
+    Skipped if the same csv, unchanged, has already been ingested.
+    Returns the sorted (year, month) partitions holding the source.
+
+    `raw_data_path` may also be an open file, e.g. a member streamed out
+    of a zip; `source` and `fingerprint` then identify it in the manifest
+    in place of the path and its size/mtime.
+    """
+    store_path = Path(store_path)
+    store_path.mkdir(parents=True, exist_ok=True)
+    manifest = store.load_manifest(store_path)
+    source = source or str(raw_data_path)
+    fingerprint = fingerprint or store.source_fingerprint(source)
+
+    cached = manifest.get(source)
+    if cached and cached["fingerprint"] == fingerprint:
+        logging.info(f"{source} unchanged since last ingest; using cached features")
+        return [tuple(period) for period in cached["partitions"]]
+
+    key = store.source_key(source)
+    store.remove_source_files(store_path, key)
+    partitions = set()
+    with read_df(raw_data_path, chunksize=chunksize) as reader:
+        for idx, chunk in enumerate(reader):
+            df_features = build_features(chunk, date_fmt=date_fmt, with_period=True)
+            partitions.update(
+                store.write_partitions(df_features, store_path, f"{key}-{idx}")
+            )
+    partitions = sorted(partitions)
+    logging.info(f"ingested {source} into {len(partitions)} partitions")
+
+    manifest[source] = {"fingerprint": fingerprint, "partitions": partitions}
+    store.save_manifest(store_path, manifest)
+    return partitions
+
+
+def run(raw_data_path: str, dest_path: str, chunksize: int = CHUNKSIZE):
+    partitions = ingest(raw_data_path, dest_path, chunksize=chunksize)
+    logging.info(f"{raw_data_path} stored in {dest_path} as {partitions}")
 
 
 if __name__ == "__main__":
@@ -86,8 +138,14 @@ if __name__ == "__main__":
     parser.add_argument(
         "--dest_path",
         type=Path,
-        help="where the resulting .pkl will be saved.",
+        help="root of the parquet feature store the features are written to.",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=CHUNKSIZE,
+        help="number of raw rows preprocessed at a time.",
     )
     args = parser.parse_args()
 
-    run(args.raw_data_path, args.dest_path)
+    run(args.raw_data_path, args.dest_path, args.chunksize)
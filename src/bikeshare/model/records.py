@@ -0,0 +1,91 @@
+"""
+Compact schema of the predictions logged by the web service
+
+Every prediction is one small document: its time, the id of the model
+that made it, the FEATURES it was made from, in order, and the
+prediction, plus the target when the ride carries one. The model id is
+its registered name and version, and the model's run id and metadata are
+saved once, in the `models` collection, under that id.
+Predictions expire after a retention period, through a TTL index on
+their time; batch monitoring reads them back with `records_to_frame`.
+"""
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from .features import FEATURES, TARGET
+
+DATABASE = "prediction_service"
+PREDICTIONS = "predictions"
+MODELS = "models"
+# days predictions are kept for
+RETENTION_DAYS = 90
+# types the FEATURES are saved as
+FEATURE_TYPES = [int, int, int, int, float, float]
+# fields read back by batch monitoring
+RECORD_FIELDS = {"_id": 0, "x": 1, "pred": 1, TARGET: 1}
+
+
+def model_id(name: str, version) -> str:
+    """Id of a registered model version, e.g. "TO-bikeshare-clf/3" """
+    return f"{name}/{version}"
+
+
+def make_record(
+    values: list, prediction: bool, model: str, target: bool = None
+) -> dict:
+    """The document logged for one prediction
+
+    `values` are the ride's FEATURES, in order; `model` is the `model_id`
+    of the model that made the prediction.
+    """
+    record = {
+        "ts": datetime.now(timezone.utc),
+        "model": model,
+        "x": [cast(value) for cast, value in zip(FEATURE_TYPES, values)],
+        "pred": bool(prediction),
+    }
+    if target is not None:
+        record[TARGET] = bool(target)
+    return record
+
+
+def ensure_indexes(predictions, retention_days: int = RETENTION_DAYS) -> None:
+    """Indexes the predictions by time, expiring them after `retention_days`
+
+    MongoDB keeps the options of an existing index, so a new retention
+    only applies once the `ts_1` index is dropped.
+    """
+    predictions.create_index("ts", expireAfterSeconds=retention_days * 24 * 3600)
+    predictions.create_index([("model", 1), ("ts", 1)])
+
+
+def save_model_meta(models, name: str, version, run_id: str, model_meta: str) -> str:
+    """Saves a registered model version and its metadata, unless already
+    saved; returns its `model_id`
+    """
+    model = model_id(name, version)
+    models.update_one(
+        {"_id": model},
+        {
+            "$setOnInsert": {
+                "name": name,
+                "version": str(version),
+                "run_id": run_id,
+                "metadata": model_meta,
+                "ts": datetime.now(timezone.utc),
+            }
+        },
+        upsert=True,
+    )
+    return model
+
+
+def records_to_frame(records) -> pd.DataFrame:
+    """The features, `prediction` and, if logged, target of the records"""
+    records = list(records)
+    df = pd.DataFrame([record["x"] for record in records], columns=FEATURES)
+    df["prediction"] = [record["pred"] for record in records]
+    if any(TARGET in record for record in records):
+        df[TARGET] = [record.get(TARGET) for record in records]
+    return df
@@ -10,8 +10,15 @@ from dotenv import load_dotenv
 from mlflow.entities import ViewType
 from mlflow.tracking import MlflowClient
 
+from .tracking import MODEL_LOGGED
 
-def register_model():
+
+def register_model(metric: str = "roc_auc", parent_run_id: str = None):
+    """Promotes the logged model of the run with the highest `metric`
+
+    With `parent_run_id`, only the runs nested under it compete, e.g. the
+    trials of one search; otherwise every run of the experiment does.
+    """
     dotenv_path = Path.cwd() / ".env"
     load_dotenv(dotenv_path)
 
@@ -21,36 +28,46 @@ def register_model():
 
     client = MlflowClient(tracking_uri=MLFLOW_TRACKING_URI)
     exp = client.get_experiment_by_name(MLFLOW_EXP_NAME)
+    # only the best trials of a search upload their model
+    filter_string = f"tags.{MODEL_LOGGED} = 'true'"
+    if parent_run_id:
+        filter_string += f" and tags.mlflow.parentRunId = '{parent_run_id}'"
     best_runs = client.search_runs(
         experiment_ids=exp.experiment_id,
+        filter_string=filter_string,
         run_view_type=ViewType.ACTIVE_ONLY,
         max_results=3,
-        order_by=["metrics.roc_auc DESC"],
+        order_by=[f"metrics.{metric} DESC"],
     )
     for run in best_runs:
         logging.debug(run.info.run_id)
+    if not best_runs:
+        scope = f"under run {parent_run_id}" if parent_run_id else "in the experiment"
+        raise ValueError(f"no run {scope} has a logged model to register")
     # Register
     # get runs_ID and assign registry name
     run_ID = best_runs[0].info.run_id
-    model_uri = f"runs:/{run_ID}/models"
+    return promote_run(client, run_ID, MLFLOW_REGISTERED_MODEL)
+
+
+def promote_run(client: MlflowClient, run_id: str, model_name: str):
+    """Registers the model of a run, and moves it to the Production stage"""
+    model_uri = f"runs:/{run_id}/models"
     model_vers = mlflow.register_model(
         model_uri,
-        MLFLOW_REGISTERED_MODEL,
+        model_name,
     )
 
     # Promote to production stage
-    # how to retrieve latest version?
-    latest_vers = client.get_latest_versions(name=MLFLOW_REGISTERED_MODEL)
-    logging.info(latest_vers)
-    client.transition_model_version_stage(
-        name=MLFLOW_REGISTERED_MODEL,
-        version=latest_vers[-1].version,
+    # the version just registered; the latest versions are listed per stage,
+    # so with a Production version already there the last may not be it
+    logging.info(model_vers)
+    return client.transition_model_version_stage(
+        name=model_name,
+        version=model_vers.version,
         stage="Production",
         archive_existing_versions=True,
     )
-    # for rm in client.list_registered_models():
-    #     pprint(dict(rm), indent=4)
-    return latest_vers[-1]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,149 @@
+"""
+Parquet feature store for the preprocessed trips
+
+Features are partitioned by year/month of the trip start and kept in
+compact dtypes. Readers can project columns and push predicates down to
+the partitions, so only the slices they need are read. Each ingested raw
+csv is fingerprinted, so `preprocess.ingest` can skip unchanged sources.
+"""
+import hashlib
+import json
+from pathlib import Path
+
+import fsspec
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from .features import FEATURES, TARGET
+
+PARTITIONS = ["year", "month"]
+STORE_DTYPES = {
+    "trip_duration_seconds": "int32",
+    "from_station_id": "category",
+    "to_station_id": "category",
+    "day_of_week": "int8",
+    "start_hour": "float32",
+    "end_hour": "float32",
+    TARGET: "bool",
+}
+# records the fingerprint and partitions of every ingested source
+MANIFEST = "_sources.json"
+
+
+def to_store_dtypes(df_features: pd.DataFrame) -> pd.DataFrame:
+    return df_features.astype(STORE_DTYPES)
+
+
+def source_fingerprint(path: str) -> dict:
+    """Size and modification marker of a local or remote file"""
+    fs, fs_path = fsspec.core.url_to_fs(str(path))
+    info = fs.info(fs_path)
+    # S3 reports an ETag, local filesystems a mtime
+    modified = info.get("ETag") or info.get("LastModified") or info.get("mtime")
+    return {"size": info["size"], "modified": str(modified)}
+
+
+def source_key(path: str) -> str:
+    """Short stable id of a source, used to name its parquet files"""
+    return hashlib.sha1(str(path).encode()).hexdigest()[:12]
+
+
+def load_manifest(store_path: Path) -> dict:
+    manifest_path = Path(store_path) / MANIFEST
+    if not manifest_path.exists():
+        return {}
+    with open(manifest_path, "r") as f_in:
+        return json.load(f_in)
+
+
+def save_manifest(store_path: Path, manifest: dict) -> None:
+    with open(Path(store_path) / MANIFEST, "w") as f_out:
+        json.dump(manifest, f_out, indent=2)
+
+
+def remove_source_files(store_path: Path, key: str) -> None:
+    for part_file in Path(store_path).rglob(f"{key}-*.parquet"):
+        part_file.unlink()
+
+
+def write_partitions(
+    df_features: pd.DataFrame, store_path: Path, basename: str
+) -> list:
+    """Writes features with `year` and `month` columns into the store
+
+    Returns the (year, month) partitions that were written to
+    """
+    table = pa.Table.from_pandas(to_store_dtypes(df_features), preserve_index=False)
+    pq.write_to_dataset(
+        table,
+        root_path=str(store_path),
+        partition_cols=PARTITIONS,
+        basename_template=f"{basename}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+    periods = df_features[PARTITIONS].drop_duplicates()
+    return [tuple(int(v) for v in period) for period in periods.itertuples(index=False)]
+
+
+def partition_filters(partitions: list) -> list:
+    """Predicate selecting the given (year, month) partitions"""
+    return [[("year", "=", year), ("month", "=", month)] for year, month in partitions]
+
+
+def read_features(
+    store_path: Path,
+    columns: list = None,
+    filters: list = None,
+) -> pd.DataFrame:
+    """Reads features from the store
+
+    `columns` defaults to the model features and target. `filters` are in
+    pyarrow's DNF form, e.g. [("year", "=", 2017), ("month", "<=", 3)], and
+    prune whole partitions before any file is opened.
+    """
+    if columns is None:
+        columns = FEATURES + [TARGET]
+    table = pq.read_table(str(store_path), columns=columns, filters=filters)
+    df_features = table.to_pandas()
+    # dictionaries differ between files, so categories are restored here
+    dtypes = {col: STORE_DTYPES[col] for col in columns if col in STORE_DTYPES}
+    return df_features.astype(dtypes)
+
+
+def iter_features(
+    store_path: Path,
+    columns: list = None,
+    filters: list = None,
+    batch_size: int = 100_000,
+):
+    """Reads features from the store in batches of about `batch_size` rows
+
+    Like `read_features`, but only a batch or two is held in memory at a
+    time. Batches come in the same order on every pass over an unchanged
+    store.
+    """
+    if columns is None:
+        columns = FEATURES + [TARGET]
+    dataset = ds.dataset(str(store_path), format="parquet", partitioning="hive")
+    expression = pq.filters_to_expression(filters) if filters else None
+    dtypes = {col: STORE_DTYPES[col] for col in columns if col in STORE_DTYPES}
+    # pyarrow reads ahead up to 16 batches of 4 files by default
+    batches = dataset.to_batches(
+        columns=columns,
+        filter=expression,
+        batch_size=batch_size,
+        batch_readahead=1,
+        fragment_readahead=1,
+    )
+    # record batches end with their file, and ingest writes small files
+    pending, n_pending = [], 0
+    for batch in batches:
+        pending.append(batch)
+        n_pending += batch.num_rows
+        if n_pending >= batch_size:
+            yield pa.Table.from_batches(pending).to_pandas().astype(dtypes)
+            pending, n_pending = [], 0
+    if n_pending:
+        yield pa.Table.from_batches(pending).to_pandas().astype(dtypes)
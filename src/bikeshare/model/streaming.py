@@ -0,0 +1,203 @@
+"""
+Out-of-core model search, for feature stores larger than memory
+
+The RandomForest search needs the whole train set in memory. This backend
+streams the store instead: `prepare_stream` reads it batch by batch,
+encodes each batch with the stateless hashing encoder and saves it as
+memory-mapped matrices, and each trial then fits an `SGDClassifier` with
+`partial_fit`, one batch at a time, over a few epochs. Only one batch is
+held in memory at once, so the data can be any size that fits on disk.
+
+Trials are logged to MLflow like the RandomForest ones, and the models of
+the best `keep_models` are uploaded, as pipelines taking raw features.
+"""
+import bisect
+import logging
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import mlflow
+import numpy as np
+from hyperopt import STATUS_OK, Trials, hp
+from hyperopt.pyll import scope
+from sklearn.linear_model import SGDClassifier
+from sklearn.metrics import roc_auc_score
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+from .encoders import make_encoder
+from .features import FEATURES, TARGET
+from .matrices import dump_matrices, load_matrices, to_matrix
+from .store import iter_features
+from .tracking import KEEP_MODELS, RunLogger, tracking_env
+from .trials import RESUME_MODES, load_trials, parallel_fmin
+
+BACKENDS = ["forest", "sgd"]
+# rows per batch read from the store, and per partial_fit call
+BATCH_ROWS = 100_000
+# share of each batch's rows held out to score the trials
+TEST_SIZE = 0.3
+CLASSES = np.array([False, True])
+# scored on a holdout of every batch rather than the forest's test set, so
+# logged apart from its `roc_auc`
+SGD_METRIC = "roc_auc_holdout"
+
+SGD_SPACE = {
+    "loss": hp.choice("loss", ["log_loss", "modified_huber"]),
+    "penalty": hp.choice("penalty", ["l2", "l1", "elasticnet"]),
+    "alpha": hp.loguniform("alpha", np.log(1e-6), np.log(1e-2)),
+    "l1_ratio": hp.uniform("l1_ratio", 0, 1),
+    "epochs": scope.int(hp.quniform("epochs", 1, 5, 1)),
+    "random_state": 42,
+}
+
+# stream search state, set by `prepare_stream`, like trials._SEARCH
+_STREAM = {}
+
+
+def holdout_mask(n_rows: int, batch_idx: int, test_size: float = TEST_SIZE):
+    """Rows of a batch held out for testing, the same on every pass"""
+    rng = np.random.default_rng([42, batch_idx])
+    return rng.random(n_rows) < test_size
+
+
+def prepare_stream(
+    store_path: Path, cache_dir: Path, filters: list = None, batch_size=BATCH_ROWS
+) -> dict:
+    """Encodes the store batch by batch, and saves the batches in `cache_dir`
+
+    The hashing encoder needs no statistics of the data, so it is fit on
+    the first batch. A scaler, which SGD needs, is fit on the train rows
+    of every batch as they are encoded. Returns the encoder, the scaler
+    and the paths of each batch's saved matrices.
+    """
+    encoder, scaler = None, StandardScaler(with_mean=False)
+    batch_paths = []
+    for batch_idx, df_batch in enumerate(
+        iter_features(store_path, filters=filters, batch_size=batch_size)
+    ):
+        X, y = df_batch[FEATURES], df_batch[TARGET].to_numpy()
+        if encoder is None:
+            encoder = make_encoder("hash").fit(X, y)
+        Xt = to_matrix(encoder.transform(X))
+        mask = holdout_mask(len(y), batch_idx)
+        scaler.partial_fit(Xt[~mask])
+
+        batch_dir = Path(cache_dir) / f"batch{batch_idx}"
+        batch_dir.mkdir()
+        batch_paths.append(dump_matrices({"Xt": Xt, "y": y, "test": mask}, batch_dir))
+    if encoder is None:
+        raise ValueError(f"no features in {store_path} match {filters}")
+    logging.info(f"encoded {len(batch_paths)} batches of {store_path}")
+    return {"encoder": encoder, "scaler": scaler, "batch_paths": batch_paths}
+
+
+def iter_batches(test: bool = False):
+    """The train, or test, rows of each saved batch, scaled"""
+    scaler = _STREAM["scaler"]
+    for paths in _STREAM["batch_paths"]:
+        batch = load_matrices(paths)
+        rows = batch["test"] if test else ~batch["test"]
+        if rows.any():
+            yield scaler.transform(batch["Xt"][rows]), batch["y"][rows]
+
+
+def sgd_objective(params):
+    """Fits SGD over the saved batches for a number of epochs
+
+    The loss is 1 / holdout roc_auc, logged as `SGD_METRIC`. Only the models
+    of the best `keep_models` trials are staged for upload.
+    """
+    start_time = int(time.time() * 1000)
+    tags = {"model": "to-bikeshare-clf", "encoder": "hash", "backend": "sgd"}
+    tags.update(_STREAM["run_tags"])
+
+    params = dict(params)
+    epochs = params.pop("epochs")
+    sgd = SGDClassifier(**params)
+    rng = np.random.default_rng(params["random_state"])
+    for _ in range(epochs):
+        for Xt, y in iter_batches():
+            # the store is ordered by month; shuffled within each batch
+            order = rng.permutation(len(y))
+            sgd.partial_fit(Xt[order], y[order], classes=CLASSES)
+
+    scores, labels = [], []
+    for Xt, y in iter_batches(test=True):
+        scores.append(sgd.decision_function(Xt).astype(np.float32))
+        labels.append(y)
+    roc_auc = roc_auc_score(np.concatenate(labels), np.concatenate(scores))
+    loss = 1 / roc_auc
+
+    clf = None
+    top_losses = _STREAM["top_losses"]
+    if len(top_losses) < _STREAM["keep_models"] or loss < top_losses[-1]:
+        bisect.insort(top_losses, loss)
+        del top_losses[_STREAM["keep_models"] :]
+        clf = make_pipeline(_STREAM["encoder"], _STREAM["scaler"], sgd)
+
+    _STREAM["run_logger"].log_run(
+        {**params, "epochs": epochs},
+        {SGD_METRIC: roc_auc},
+        tags=tags,
+        model=clf,
+        loss=loss,
+        start_time=start_time,
+    )
+    return {"loss": loss, "status": STATUS_OK}
+
+
+def stream_search(
+    store_path: Path,
+    num_trials: int,
+    filters: list = None,
+    batch_size: int = BATCH_ROWS,
+    cache_dir: str = None,
+    keep_models: int = KEEP_MODELS,
+    run_tags: dict = None,
+    trials_file: str = None,
+    resume: str = "continue",
+):
+    """Hyperopt search over SGD pipelines, trained out of core
+
+    Reads the `filters` partitions of the feature store at `store_path`,
+    `batch_size` rows at a time. The encoded batches are kept in a
+    temporary directory under `cache_dir`, about 55 bytes per row. As with
+    `trials.model_search`, `run_tags` are added to each trial's run, and
+    with `trials_file` the search is checkpointed and resumed, as set by
+    `resume`.
+    """
+    if resume not in RESUME_MODES:
+        raise ValueError(f"resume must be one of {RESUME_MODES}, got {resume}")
+    tracking_uri, exp_name = tracking_env()
+    mlflow.set_tracking_uri(tracking_uri)
+    exp = mlflow.set_experiment(exp_name)
+    trials = load_trials(trials_file, resume) if trials_file else Trials()
+    max_evals = num_trials
+    if resume == "warm":
+        max_evals += len(trials)
+
+    with TemporaryDirectory(dir=cache_dir) as tmp_dir:
+        _STREAM.update(prepare_stream(store_path, tmp_dir, filters, batch_size))
+        _STREAM["top_losses"] = []
+        _STREAM["keep_models"] = keep_models
+        _STREAM["run_tags"] = run_tags or {}
+        _STREAM["run_logger"] = RunLogger(
+            tracking_uri, exp.experiment_id, keep_models=keep_models
+        )
+        try:
+            parallel_fmin(
+                fn=sgd_objective,
+                space=SGD_SPACE,
+                trials=trials,
+                max_evals=max_evals,
+                rstate=np.random.default_rng(42 + len(trials)),
+                executor=None,
+                n_parallel=1,
+                trials_file=trials_file,
+            )
+        finally:
+            _STREAM["run_logger"].close()
+            _STREAM.clear()
+    return trials
@@ -0,0 +1,199 @@
+"""
+Background MLflow logging for the model search
+
+Trials hand their params, metrics, tags and model to a `RunLogger` and
+carry on; worker threads create the run and log everything else in one
+`log_batch` call, so a slow tracking server overlaps with training
+instead of stalling it. Models are staged on local disk, and only the
+best `keep_models` of them are uploaded to the artifact store, when the
+logger is closed.
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from tempfile import mkdtemp
+
+import mlflow
+from dotenv import load_dotenv
+from mlflow.entities import Metric, Param, RunTag
+from mlflow.models import Model
+from mlflow.tracking import MlflowClient
+
+# concurrent uploads
+MAX_WORKERS = 2
+# runs queued or logging before `log_run` blocks, bounding the models
+# held in memory
+MAX_PENDING = 8
+# models uploaded per logger; the registry picks from the top 3 runs
+KEEP_MODELS = 3
+# tag of the runs whose model was uploaded
+MODEL_LOGGED = "model_logged"
+
+
+def tracking_env() -> tuple:
+    """Tracking URI and experiment name, from the environment or ./.env"""
+    load_dotenv(Path.cwd() / ".env")
+    tracking_uri = os.getenv("MLFLOW_TRACKING_URI", "sqlite:///mlflow.db")
+    exp_name = os.getenv("MLFLOW_EXP_NAME", "TO-bikeshare-clf")
+    return tracking_uri, exp_name
+
+
+def start_parent_run(tracking_uri: str, exp_name: str, run_name: str) -> str:
+    """Creates the run a flow's trial runs are nested under
+
+    Returns its id; pass {"mlflow.parentRunId": id} as the trials' tags.
+    """
+    client = MlflowClient(tracking_uri=tracking_uri)
+    exp = client.get_experiment_by_name(exp_name)
+    if exp is None:
+        exp_id = client.create_experiment(exp_name)
+    else:
+        exp_id = exp.experiment_id
+    run = client.create_run(exp_id, run_name=run_name)
+    return run.info.run_id
+
+
+def end_parent_run(tracking_uri: str, run_id: str, status: str = "FINISHED"):
+    MlflowClient(tracking_uri=tracking_uri).set_terminated(run_id, status=status)
+
+
+class RunLogger:
+    """Logs whole runs to an experiment from background threads
+
+    `close` waits for every queued run, uploads the staged models and tags
+    their runs with `MODEL_LOGGED`, and raises if anything failed to log.
+    Models are staged under `staging_dir`, by default the system temp dir.
+    Only the process that created the logger can close it; in a forked
+    child, `close` leaves the parent's staged models alone.
+    """
+
+    def __init__(
+        self,
+        tracking_uri: str,
+        experiment_id: str,
+        max_workers: int = MAX_WORKERS,
+        max_pending: int = MAX_PENDING,
+        keep_models: int = KEEP_MODELS,
+        staging_dir: str = None,
+    ):
+        self.client = MlflowClient(tracking_uri=tracking_uri)
+        self.experiment_id = experiment_id
+        # forked processes inherit the logger, but not its threads or models
+        self.pid = os.getpid()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="mlflow-logger"
+        )
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._futures = []
+        self.keep_models = keep_models
+        # not a TemporaryDirectory, which a forked child would remove when it
+        # garbage collects its copy of the logger
+        self._staging = Path(mkdtemp(prefix="staged-models-", dir=staging_dir))
+        # (loss, run id, model path) of the staged models, best first
+        self._staged = []
+
+    def log_run(
+        self,
+        params: dict,
+        metrics: dict,
+        tags: dict = None,
+        model=None,
+        loss: float = None,
+        start_time: int = None,
+    ):
+        """Queues one finished run
+
+        `model` is an sklearn model scored by `loss`, lower is better. It
+        is staged, and evicted once `keep_models` staged models beat it.
+        Returns a future of the run id. Blocks while `max_pending` runs are
+        still being logged.
+        """
+        start_time = start_time or int(time.time() * 1000)
+        end_time = int(time.time() * 1000)
+        self._slots.acquire()
+        future = self._executor.submit(
+            self._log, params, metrics, tags or {}, model, loss, start_time, end_time
+        )
+        future.add_done_callback(self._done)
+        with self._lock:
+            self._futures.append(future)
+        return future
+
+    def _log(self, params, metrics, tags, model, loss, start_time, end_time) -> str:
+        run = self.client.create_run(self.experiment_id, start_time=start_time)
+        run_id = run.info.run_id
+        self.client.log_batch(
+            run_id,
+            metrics=[Metric(k, v, end_time, 0) for k, v in metrics.items()],
+            params=[Param(k, str(v)) for k, v in params.items()],
+            tags=[RunTag(k, str(v)) for k, v in tags.items()],
+        )
+        self.client.set_terminated(run_id, end_time=end_time)
+        if model is not None:
+            self._stage(run_id, model, loss)
+        return run_id
+
+    def _stage(self, run_id: str, model, loss: float):
+        model_path = self._staging / run_id
+        # as log_model would, so the served model's metadata names its run
+        mlflow_model = Model(run_id=run_id, artifact_path="models")
+        mlflow.sklearn.save_model(model, model_path, mlflow_model=mlflow_model)
+        with self._lock:
+            self._staged.append((loss, run_id, model_path))
+            self._staged.sort(key=lambda staged: staged[0])
+            evicted = self._staged[self.keep_models :]
+            del self._staged[self.keep_models :]
+        for _, _, evicted_path in evicted:
+            shutil.rmtree(evicted_path)
+
+    def _upload(self, run_id: str, model_path: Path):
+        self.client.log_artifacts(run_id, str(model_path), "models")
+        self.client.set_tag(run_id, MODEL_LOGGED, "true")
+        shutil.rmtree(model_path)
+
+    def _done(self, future):
+        self._slots.release()
+        if future.exception():
+            logging.error(f"failed to log run: {future.exception()!r}")
+
+    def _wait_pending(self) -> int:
+        """Waits for the queued runs, and returns how many failed"""
+        with self._lock:
+            futures, self._futures = self._futures, []
+        return sum(future.exception() is not None for future in futures)
+
+    def flush(self):
+        """Waits until every queued run is logged"""
+        n_failed = self._wait_pending()
+        if n_failed:
+            raise RuntimeError(f"{n_failed} runs failed to log to MLflow")
+
+    def close(self):
+        """Flushes the queued runs, then uploads the staged models
+
+        The uploads run in the calling thread: at most `keep_models` of
+        them, and thread pools no longer take work once the interpreter
+        is exiting, which is when trial workers close their loggers.
+        """
+        if os.getpid() != self.pid:
+            return
+        try:
+            n_failed = self._wait_pending()
+            with self._lock:
+                staged, self._staged = self._staged, []
+            for _, run_id, model_path in staged:
+                try:
+                    self._upload(run_id, model_path)
+                except Exception as exc:
+                    n_failed += 1
+                    logging.error(f"failed to upload model: {exc!r}")
+        finally:
+            self._executor.shutdown()
+            shutil.rmtree(self._staging, ignore_errors=True)
+        if n_failed:
+            raise RuntimeError(f"{n_failed} runs failed to log to MLflow")
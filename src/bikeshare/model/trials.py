@@ -1,82 +1,454 @@
 import argparse
+import bisect
+import logging
+import multiprocessing
 import os
 import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing.util import Finalize
 from pathlib import Path
+from tempfile import TemporaryDirectory
 
 import mlflow
 import numpy as np
-from dotenv import load_dotenv
-from hyperopt import STATUS_OK, Trials, fmin, hp, tpe
+from hyperopt import STATUS_OK, Trials, base, fmin, hp, rand, space_eval, tpe
+from hyperopt.fmin import generate_trial
 from hyperopt.pyll import scope
-from sklearn.compose import make_column_transformer
+from hyperopt.utils import coarse_utcnow
+from joblib import Parallel, delayed
+from sklearn.base import clone
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import roc_auc_score
-from sklearn.model_selection import StratifiedKFold, cross_val_score
+from sklearn.model_selection import StratifiedKFold, train_test_split
 from sklearn.pipeline import make_pipeline
-from sklearn.preprocessing import OneHotEncoder
 
+from .encoders import ENCODERS, make_encoder, station_stats
+from .matrices import dump_matrices, load_matrices, to_matrix
+from .store import read_features
+from .tracking import KEEP_MODELS, RunLogger, tracking_env
 
-def load_pickle(path: Path):
-    with open(path, "rb") as f_in:
-        return pickle.load(f_in)
+STRATEGIES = ["tpe", "halving"]
+# how a search picks up the trials checkpointed by an earlier one
+RESUME_MODES = ["continue", "warm"]
+# share of the train set held out to score candidates in the halving rungs
+HOLDOUT = 0.2
 
+N_FOLDS = 5
 
-def model_search(train, test, num_trials):
+# search state, set once per process by `init_search`; module level so that
+# trial worker processes load the data once rather than with every trial
+_SEARCH = {}
 
-    dotenv_path = Path.cwd() / ".env"
-    load_dotenv(dotenv_path)
 
-    MLFLOW_TRACKING_URI = os.getenv("MLFLOW_TRACKING_URI", "sqlite:///mlflow.db")
-    MLFLOW_EXP_NAME = os.getenv("MLFLOW_EXP_NAME", "TO-bikeshare-clf")
-    mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
-    mlflow.set_experiment(MLFLOW_EXP_NAME)
+def transform_split(
+    X, y, fit_idx, X_eval, encoder: str, stats: dict, handle_unknown: str = "error"
+):
+    """Fits the station encoder on the `fit_idx` rows of X
 
-    # train = load_pickle(Path(data_path) / "train.pkl")
-    # test = load_pickle(Path(data_path) / "test.pkl")
+    Returns the fitted encoder, the transformed fit rows as a matrix to fit
+    trees on, and the transformed `X_eval` as a matrix to predict on.
+    """
+    ct = make_encoder(encoder, stats=stats, handle_unknown=handle_unknown)
+    Xt_fit = ct.fit_transform(X.iloc[fit_idx], y[fit_idx])
+    return ct, to_matrix(Xt_fit, "csc"), to_matrix(ct.transform(X_eval))
 
-    X_train = train.drop("target", axis=1)
-    y_train = train["target"].values
 
-    X_test = test.drop("target", axis=1)
-    y_test = test["target"].values
+def prepare_search(
+    train, test, cache_dir: Path, encoder: str = "onehot", halving: bool = False
+) -> dict:
+    """Encodes the search data once, and saves it for `init_search`
 
-    def objective(params):
-        with mlflow.start_run():
-            mlflow.set_tag("model", "to-bikeshare-clf")
-            # log only the hyperparameters passed
-            mlflow.log_params(params)
+    The encoder does not depend on the trial, so it is fit here on every
+    split the search needs: the whole train set, each CV fold, and with
+    `halving` the rungs' fit rows. Trials then only fit the classifier.
+    Each split's encoder only sees the labels of its fit rows, so target
+    encoding does not leak the validation labels into the CV score.
+    Returns the path of each saved object, by name.
+    """
+    X_train, y_train = train.drop("target", axis=1), train["target"].values
+    X_test, y_test = test.drop("target", axis=1), test["target"].values
+    # of the whole train set, so only for the encoder fit on all of it
+    stats = station_stats(X_train, y_train) if encoder == "target" else None
+    all_idx = np.arange(len(train))
 
-            ct = make_column_transformer(
-                (OneHotEncoder(), ["from_station_id"]),
-                (OneHotEncoder(), ["to_station_id"]),
-                # remainder='drop',
-                remainder="passthrough",
-            )
-            clf = make_pipeline(ct, RandomForestClassifier(**params))
-            clf.fit(X_train, y_train)
-
-            cv = StratifiedKFold()
-            scores_train = cross_val_score(
-                clf,
-                X_train,
-                y_train,
-                cv=cv,
-                scoring="roc_auc",
-                n_jobs=-1,
-            )
-            roc_auc_train = np.average(scores_train)
-            mlflow.log_metric("roc_auc_train", roc_auc_train)
+    ct, Xt_train, Xt_test = transform_split(
+        X_train, y_train, all_idx, X_test, encoder, stats
+    )
+    objects = {"ct": ct, "Xt_train": Xt_train, "y_train": y_train}
+    objects.update({"Xt_test": Xt_test, "y_test": y_test})
+
+    folds = StratifiedKFold(n_splits=N_FOLDS).split(all_idx, y_train)
+    for i, (fit_idx, val_idx) in enumerate(folds):
+        # stations missing from a fold must not fail the validation transform
+        _, Xt_fit, Xt_val = transform_split(
+            X_train,
+            y_train,
+            fit_idx,
+            X_train.iloc[val_idx],
+            encoder,
+            stats=None,
+            handle_unknown="ignore",
+        )
+        objects.update({f"fold{i}_Xt_fit": Xt_fit, f"fold{i}_y_fit": y_train[fit_idx]})
+        objects.update({f"fold{i}_Xt_val": Xt_val, f"fold{i}_y_val": y_train[val_idx]})
+
+    if halving:
+        # shuffled, so any prefix of fit_idx is a random sample of the train set
+        fit_idx, holdout_idx = train_test_split(
+            all_idx, test_size=HOLDOUT, stratify=y_train, random_state=42
+        )
+        _, Xt_fit, Xt_holdout = transform_split(
+            X_train,
+            y_train,
+            fit_idx,
+            X_train.iloc[holdout_idx],
+            encoder,
+            stats=None,
+            handle_unknown="ignore",
+        )
+        # rungs fit on row prefixes, which CSR slices without a copy
+        objects.update({"rung_Xt_fit": to_matrix(Xt_fit, "csr")})
+        objects.update({"rung_y_fit": y_train[fit_idx]})
+        objects.update({"rung_Xt_holdout": Xt_holdout})
+        objects.update({"rung_y_holdout": y_train[holdout_idx]})
+    return dump_matrices(objects, cache_dir)
+
+
+def close_worker_logger(run_logger: RunLogger, failures) -> None:
+    """Closes a trial worker's logger as the worker exits
+
+    The pool ignores errors raised while a worker exits, so a failure is
+    logged and counted in `failures`, shared with the parent process.
+    """
+    try:
+        run_logger.close()
+    except Exception as exc:
+        logging.error(f"trial worker {os.getpid()} failed to log: {exc!r}")
+        with failures.get_lock():
+            failures.value += 1
+
+
+def init_search(
+    paths: dict,
+    cv_jobs: int,
+    tracking_uri: str,
+    exp_name: str,
+    encoder: str = "onehot",
+    keep_models: int = KEEP_MODELS,
+    run_tags: dict = None,
+    failures=None,
+):
+    """Loads the data saved by `prepare_search`, memory mapped
+
+    Also starts the process's background MLflow logger, which uploads the
+    models of its `keep_models` best trials. In a trial worker it is
+    closed when the pool shuts the worker down, and a failure to log is
+    counted in the shared `failures` value. `run_tags` are added to every
+    trial's run.
+    """
+    mlflow.set_tracking_uri(tracking_uri)
+    exp = mlflow.set_experiment(exp_name)
+    # a forked worker inherits the parent's logger, which is not its to close
+    if "run_logger" in _SEARCH and _SEARCH["run_logger"].pid == os.getpid():
+        _SEARCH["run_logger"].close()
+    run_logger = RunLogger(tracking_uri, exp.experiment_id, keep_models=keep_models)
+    if multiprocessing.parent_process() is not None:
+        Finalize(
+            run_logger, close_worker_logger, (run_logger, failures), exitpriority=10
+        )
+
+    data = load_matrices(paths)
+    _SEARCH.clear()
+    _SEARCH.update(data)
+    _SEARCH["cv_folds"] = [
+        tuple(
+            data[f"fold{i}_{name}"] for name in ["Xt_fit", "y_fit", "Xt_val", "y_val"]
+        )
+        for i in range(N_FOLDS)
+    ]
+    _SEARCH["cv_jobs"] = cv_jobs
+    _SEARCH["encoder"] = encoder
+    # losses of the best trials so far, the ones whose model is staged
+    _SEARCH["top_losses"] = []
+    _SEARCH["keep_models"] = keep_models
+    _SEARCH["run_tags"] = run_tags or {}
+    _SEARCH["run_logger"] = run_logger
+
+
+def fold_score(clf, Xt_fit, y_fit, Xt_val, y_val) -> float:
+    clf.fit(Xt_fit, y_fit)
+    return roc_auc_score(y_val, clf.predict_proba(Xt_val)[:, 1])
+
+
+def objective(params):
+    """Scores one candidate by cross-validation on the train set
+
+    The CV score is the loss, so no full fit is needed to rank a trial.
+    Only a trial among the `keep_models` best losses seen by this process
+    is refit on all of the train set, scored on the test set, and has its
+    model staged; the overall best trials are therefore always among them.
+    The run is logged in the background by the process's `RunLogger`,
+    which uploads the models still in the top when the search ends.
+    """
+    start_time = int(time.time() * 1000)
+    tags = {"model": "to-bikeshare-clf", "encoder": _SEARCH["encoder"]}
+    tags.update(_SEARCH["run_tags"])
+    metrics = {}
+
+    rf = RandomForestClassifier(**params)
+    scores_train = Parallel(n_jobs=_SEARCH["cv_jobs"])(
+        delayed(fold_score)(clone(rf), *fold) for fold in _SEARCH["cv_folds"]
+    )
+    roc_auc_train = np.average(scores_train)
+    metrics["roc_auc_train"] = roc_auc_train
+
+    inv_roc_auc = 1 / roc_auc_train
+    clf = None
+    top_losses = _SEARCH["top_losses"]
+    if len(top_losses) < _SEARCH["keep_models"] or inv_roc_auc < top_losses[-1]:
+        bisect.insort(top_losses, inv_roc_auc)
+        del top_losses[_SEARCH["keep_models"] :]
+        rf.fit(_SEARCH["Xt_train"], _SEARCH["y_train"])
+
+        # the log of a pure leaf's zero probability is -inf, which
+        # roc_auc_score rejects; both rank the rides the same
+        y_preds = rf.predict_proba(_SEARCH["Xt_test"])[:, 1]
+        roc_auc = np.average(roc_auc_score(_SEARCH["y_test"], y_preds))
+        metrics["roc_auc"] = roc_auc
+
+        # the served model takes raw features, so the encoder fit on the
+        # whole train set is put back in front of the classifier
+        clf = make_pipeline(_SEARCH["ct"], rf)
+
+    # log only the hyperparameters passed; logs while the next trial runs
+    _SEARCH["run_logger"].log_run(
+        params, metrics, tags=tags, model=clf, loss=inv_roc_auc, start_time=start_time
+    )
+    return {"loss": inv_roc_auc, "status": STATUS_OK}
+
+
+def parallel_fmin(
+    fn, space, trials, max_evals, rstate, executor, n_parallel, trials_file=None
+):
+    """fmin, evaluating `n_parallel` TPE suggestions at a time on `executor`
+
+    Without an executor the trials run in this process, one after another.
+
+    Each batch is suggested one trial at a time; pending trials count as
+    unfinished (infinite loss) for TPE, so the batch is spread out instead
+    of repeating one point. The whole batch is awaited before the next is
+    suggested, so for a given `rstate` and `n_parallel` the search is
+    reproducible regardless of which trial finishes first. Trials already
+    queued in `trials`, e.g. by `queue_points`, run first.
+
+    With `trials_file`, `trials` is saved there as each trial finishes.
+    """
+    domain = base.Domain(fn, space)
+    while True:
+        pending = [
+            trial
+            for trial in trials._dynamic_trials
+            if trial["state"] == base.JOB_STATE_NEW
+        ][:n_parallel]
+        if not pending:
+            if len(trials) >= max_evals:
+                break
+            n_batch = min(n_parallel, max_evals - len(trials))
+            for _ in range(n_batch):
+                new_ids = trials.new_trial_ids(1)
+                trials.refresh()
+                new_trials = tpe.suggest(
+                    new_ids, domain, trials, rstate.integers(2**31 - 1)
+                )
+                trials.insert_trial_docs(new_trials)
+                trials.refresh()
+            continue
+
+        configs = []
+        for trial in pending:
+            trial["state"] = base.JOB_STATE_RUNNING
+            trial["book_time"] = trial["refresh_time"] = coarse_utcnow()
+            configs.append(space_eval(space, base.spec_from_misc(trial["misc"])))
+
+        map_fn = executor.map if executor else map
+        for trial, result in zip(pending, map_fn(fn, configs)):
+            trial["state"] = base.JOB_STATE_DONE
+            trial["result"] = result
+            trial["refresh_time"] = coarse_utcnow()
+            trials.refresh()
+            if trials_file:
+                save_trials(trials, trials_file)
+    return trials
+
+
+def save_trials(trials: Trials, trials_file: Path):
+    """Pickles `trials`, replacing `trials_file` only once fully written"""
+    tmp_file = Path(f"{trials_file}.tmp")
+    with open(tmp_file, "wb") as f_out:
+        pickle.dump(trials, f_out)
+    os.replace(tmp_file, trials_file)
+
+
+def load_trials(trials_file: Path, resume: str = "continue") -> Trials:
+    """The trials checkpointed to `trials_file`, or new ones if it is missing
+
+    With `resume` "continue", trials that were running when the search
+    stopped are queued to run again. With "warm", only the finished
+    trials are kept, as the history the next TPE suggestions are drawn
+    from.
+    """
+    if not Path(trials_file).exists():
+        return Trials()
+    with open(trials_file, "rb") as f_in:
+        trials = pickle.load(f_in)
+    if resume == "warm":
+        done = [t for t in trials._dynamic_trials if t["state"] == base.JOB_STATE_DONE]
+        trials._dynamic_trials = done
+    else:
+        for trial in trials._dynamic_trials:
+            if trial["state"] == base.JOB_STATE_RUNNING:
+                trial["state"] = base.JOB_STATE_NEW
+    trials.refresh()
+    logging.info(f"loaded {len(trials)} trials from {trials_file}")
+    return trials
 
-            y_preds = clf.predict_log_proba(X_test)[:, 1]
-            roc_auc = np.average(roc_auc_score(y_test, y_preds))
 
-            mlflow.log_metric("roc_auc", roc_auc)
-            mlflow.sklearn.log_model(clf, artifact_path="models")
+def queue_points(trials: Trials, points: list):
+    """Queues `points`, in label space, to be evaluated before any suggestion"""
+    tids = trials.new_trial_ids(len(points))
+    trials.insert_trial_docs([generate_trial(tid, x) for tid, x in zip(tids, points)])
+    trials.refresh()
 
-            inv_roc_auc = 1 / roc_auc
 
-        return {"loss": inv_roc_auc, "status": STATUS_OK}
+def rung_score(params, fraction: float) -> float:
+    """Holdout roc_auc of a candidate fit on `fraction` of the train set
+
+    The encoder is fit once on all of the rungs' fit rows, so only the
+    classifier sees the smaller samples.
+    """
+    Xt_fit, y_fit = _SEARCH["rung_Xt_fit"], _SEARCH["rung_y_fit"]
+    n_rows = max(2, int(len(y_fit) * fraction))
+    # a sample too small to hold both classes cannot be scored
+    if len(np.unique(y_fit[:n_rows])) < 2:
+        return 0.0
+    clf = RandomForestClassifier(**params)
+    return fold_score(
+        clf,
+        Xt_fit[:n_rows],
+        y_fit[:n_rows],
+        _SEARCH["rung_Xt_holdout"],
+        _SEARCH["rung_y_holdout"],
+    )
+
+
+def sample_points(space, n_points: int, rstate) -> list:
+    """Random points of a hyperopt space, in its label space
+
+    The points can be queued with `queue_points`, and turned
+    into parameters with `space_eval`.
+    """
+    domain = base.Domain(objective, space)
+    scratch = Trials()
+    docs = rand.suggest(
+        scratch.new_trial_ids(n_points), domain, scratch, rstate.integers(2**31 - 1)
+    )
+    return [
+        {label: vals[0] for label, vals in doc["misc"]["vals"].items() if vals}
+        for doc in docs
+    ]
+
+
+def successive_halving(
+    space, num_trials: int, rstate, map_fn=map, eta: int = 3, min_fraction=1 / 9
+) -> list:
+    """Prunes random candidates on growing train fractions
+
+    Starts from num_trials * eta ** k candidates, where k is the number of
+    rungs between `min_fraction` and the full train set. Each rung fits
+    the candidates on a fraction of the train set, scores them on a
+    holdout, and keeps the best 1 / eta for a fraction eta times larger.
+    Returns the `num_trials` surviving points, best first, for the full
+    cross-validated evaluation.
+    """
+    fractions = []
+    fraction = min_fraction
+    while fraction < 1:
+        fractions.append(fraction)
+        fraction *= eta
+    points = sample_points(space, num_trials * eta ** len(fractions), rstate)
+
+    for fraction in fractions:
+        configs = [space_eval(space, point) for point in points]
+        scores = list(map_fn(rung_score, configs, repeat(fraction)))
+        ranked = np.argsort(scores, kind="stable")[::-1]
+        n_keep = max(num_trials, len(points) // eta)
+        logging.info(
+            f"rung at {fraction:.0%} of train: kept {n_keep} of {len(points)}, "
+            f"best roc_auc {scores[ranked[0]]:.4f}"
+        )
+        points = [points[i] for i in ranked[:n_keep]]
+    return points
+
+
+def model_search(
+    train,
+    test,
+    num_trials,
+    n_parallel: int = 1,
+    cv_jobs: int = None,
+    strategy: str = "tpe",
+    encoder: str = "onehot",
+    cache_dir: str = None,
+    keep_models: int = KEEP_MODELS,
+    run_tags: dict = None,
+    trials_file: str = None,
+    resume: str = "continue",
+):
+    """Hyperopt search over the RandomForest pipeline
+
+    `strategy` is "tpe" to run `num_trials` TPE trials, or "halving" to
+    prune many random candidates with `successive_halving` and run the
+    `num_trials` survivors as the trials.
+
+    `encoder` selects how the stations are encoded, see `encoders`.
+
+    `n_parallel` trials run at once in a local process pool, and each
+    trial scores its CV folds on `cv_jobs` cores; by default the cores
+    are split evenly between the concurrent trials. The encoded data is
+    shared between them as memory-mapped files, in a temporary directory
+    under `cache_dir` (by default the system's).
+
+    Every trial's params and metrics are logged, but each process only
+    uploads the models of its `keep_models` best trials, once it is done.
+    `run_tags` are added to every trial's run, e.g. to nest them under a
+    parent run.
+
+    With `trials_file`, the search is checkpointed there after every trial,
+    and picks up the trials already saved in it. `resume` "continue"
+    finishes an interrupted search: the saved trials count towards
+    `num_trials`, so a re-run only evaluates the missing ones. "warm"
+    starts a new search, e.g. on next month's data, whose TPE suggestions
+    are drawn from the saved trials, and runs `num_trials` new ones on top.
+    The saved trials' losses were measured on the earlier data, so
+    `trials.best_trial` may be one of them.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"strategy must be one of {STRATEGIES}, got {strategy}")
+    if resume not in RESUME_MODES:
+        raise ValueError(f"resume must be one of {RESUME_MODES}, got {resume}")
+    if encoder not in ENCODERS:
+        raise ValueError(f"encoder must be one of {ENCODERS}, got {encoder}")
+
+    MLFLOW_TRACKING_URI, MLFLOW_EXP_NAME = tracking_env()
+
+    # train = load_pickle(Path(data_path) / "train.pkl")
+    # test = load_pickle(Path(data_path) / "test.pkl")
+
+    if cv_jobs is None:
+        cv_jobs = -1 if n_parallel == 1 else max(1, os.cpu_count() // n_parallel)
 
     search_space = {
         "n_estimators": scope.int(hp.quniform("n_estimators", 10, 100, 1)),
@@ -87,24 +459,95 @@ def model_search(train, test, num_trials):
         "random_state": 42,
     }
 
-    rstate = np.random.default_rng(42)  # for reproducible results
-    trials = Trials()
-    fmin(
-        fn=objective,
-        space=search_space,
-        algo=tpe.suggest,
-        max_evals=num_trials,
-        trials=trials,
-        rstate=rstate,
-        return_argmin=True,
-    )
+    trials = load_trials(trials_file, resume) if trials_file else Trials()
+    max_evals = num_trials
+    if resume == "warm":
+        max_evals += len(trials)
+    # for reproducible results; offset so a resumed search does not
+    # replay the random draws of the one it resumes
+    rstate = np.random.default_rng(42 + len(trials))
+    with TemporaryDirectory(dir=cache_dir) as tmp_dir:
+        paths = prepare_search(
+            train, test, Path(tmp_dir), encoder, halving=strategy == "halving"
+        )
+        search_args = (
+            paths,
+            cv_jobs,
+            MLFLOW_TRACKING_URI,
+            MLFLOW_EXP_NAME,
+            encoder,
+            keep_models,
+            run_tags,
+        )
+        # also creates the tracking tables and experiment before any worker does
+        init_search(*search_args)
+        executor = None
+        # workers that failed to log their runs as they exited
+        worker_failures = multiprocessing.Value("i", 0)
+        if n_parallel > 1:
+            executor = ProcessPoolExecutor(
+                max_workers=n_parallel,
+                initializer=init_search,
+                initargs=(*search_args, worker_failures),
+            )
+        try:
+            # a resumed halving search already queued its survivors
+            if strategy == "halving" and len(trials) < max_evals:
+                map_fn = executor.map if executor else map
+                points = successive_halving(search_space, num_trials, rstate, map_fn)
+                queue_points(trials, points)
+            # fmin would run `num_trials` TPE trials on top of the queued ones,
+            # and does not checkpoint atomically
+            if executor or strategy == "halving" or trials_file:
+                parallel_fmin(
+                    fn=objective,
+                    space=search_space,
+                    trials=trials,
+                    max_evals=max_evals,
+                    rstate=rstate,
+                    executor=executor,
+                    n_parallel=max(1, n_parallel),
+                    trials_file=trials_file,
+                )
+            else:
+                fmin(
+                    fn=objective,
+                    space=search_space,
+                    algo=tpe.suggest,
+                    max_evals=max_evals,
+                    trials=trials,
+                    rstate=rstate,
+                    return_argmin=True,
+                )
+        finally:
+            # workers close their run loggers as they exit
+            if executor:
+                executor.shutdown()
+            _SEARCH["run_logger"].close()
+    if worker_failures.value:
+        raise RuntimeError(
+            f"{worker_failures.value} trial workers failed to log to MLflow"
+        )
     return trials
 
 
-def _run(data_path, max_evals):
-    train = load_pickle(data_path / "train.pkl")
-    test = load_pickle(data_path / "test.pkl")
-    model_search(train=train, test=test, num_trials=max_evals)
+def _run(data_path, max_evals, n_parallel, strategy, encoder, trials_file, resume):
+    df_bikes = read_features(data_path)
+    train, test = train_test_split(
+        df_bikes,
+        test_size=0.3,
+        stratify=df_bikes["target"],
+    )
+    model_search(
+        train=train,
+        test=test,
+        num_trials=max_evals,
+        n_parallel=n_parallel,
+        strategy=strategy,
+        encoder=encoder,
+        trials_file=trials_file,
+        resume=resume,
+    )
 
 
 if __name__ == "__main__":
@@ -114,7 +557,7 @@ if __name__ == "__main__":
         "--data_path",
         type=Path,
         default="../data/output",
-        help="the location where the processed TO bikeshare data was saved.",
+        help="root of the feature store the processed TO bikeshare data was saved to.",
     )
     parser.add_argument(
         "--max_evals",
@@ -122,6 +565,44 @@ if __name__ == "__main__":
         default=10,
         help="the number of parameter evaluations for the optimizer to explore.",
     )
+    parser.add_argument(
+        "--n_parallel",
+        type=int,
+        default=1,
+        help="the number of trials evaluated at the same time.",
+    )
+    parser.add_argument(
+        "--strategy",
+        choices=STRATEGIES,
+        default="tpe",
+        help="tpe trials, or successive halving of random candidates.",
+    )
+    parser.add_argument(
+        "--encoder",
+        choices=ENCODERS,
+        default="onehot",
+        help="how the from and to stations are encoded.",
+    )
+    parser.add_argument(
+        "--trials_file",
+        type=Path,
+        default=None,
+        help="file the search is checkpointed to, and resumed from if it exists.",
+    )
+    parser.add_argument(
+        "--resume",
+        choices=RESUME_MODES,
+        default="continue",
+        help="finish the checkpointed search, or warm start a new one from it.",
+    )
     args = parser.parse_args()
 
-    _run(args.data_path, args.max_evals)
+    _run(
+        args.data_path,
+        args.max_evals,
+        args.n_parallel,
+        args.strategy,
+        args.encoder,
+        args.trials_file,
+        args.resume,
+    )
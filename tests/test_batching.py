@@ -0,0 +1,51 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from bikeshare.deploy.predict_service.batching import MicroBatcher
+
+
+def test_concurrent_requests_are_scored_in_batches():
+    calls = []
+
+    def score(rides):
+        calls.append(len(rides))
+        return [ride * 10 for ride in rides]
+
+    batcher = MicroBatcher(score, max_batch=8, window_ms=50)
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(lambda i: batcher.predict([i, -i]), range(32)))
+
+    assert results == [[i * 10, -i * 10] for i in range(32)]
+    assert sum(calls) == 64 and max(calls) <= 8 and len(calls) < 32
+    metrics = batcher.metrics()
+    assert metrics["requests"] == 32 and metrics["rides"] == 64
+    assert metrics["batches"] == len(calls)
+    assert metrics["batch_size_mean"] == 64 / len(calls)
+    assert metrics["queue_depth"] == 0
+
+
+def test_window_bounds_the_wait_of_a_lone_request():
+    batcher = MicroBatcher(lambda rides: rides, window_ms=20)
+
+    start = time.perf_counter()
+    assert batcher.predict(["ride"]) == ["ride"]
+
+    assert time.perf_counter() - start < 0.5
+    assert 15 <= batcher.metrics()["wait_ms_p99"] < 500
+
+
+def test_bad_ride_only_fails_its_own_request():
+    def score(rides):
+        if "bad" in rides:
+            raise KeyError("trip_start_time")
+        return rides
+
+    batcher = MicroBatcher(score, window_ms=50)
+    futures = [batcher.submit([ride]) for ride in ["a", "bad", "b"]]
+
+    assert futures[0].result() == ["a"] and futures[2].result() == ["b"]
+    with pytest.raises(KeyError):
+        futures[1].result()
+    assert batcher.metrics()["errors"] == 1
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.pipeline import make_pipeline
+
+from bikeshare.model.encoders import (
+    ENCODERS,
+    StationTargetEncoder,
+    make_encoder,
+    station_stats,
+)
+
+
+@pytest.fixture
+def rides():
+    rng = np.random.default_rng(0)
+    n_rows = 200
+    X = pd.DataFrame(
+        {
+            "trip_duration_seconds": rng.integers(60, 3600, n_rows),
+            "from_station_id": rng.integers(7000, 7005, n_rows),
+            "to_station_id": rng.integers(7000, 7005, n_rows),
+            "day_of_week": rng.integers(0, 7, n_rows),
+            "start_hour": rng.uniform(0, 24, n_rows),
+            "end_hour": rng.uniform(0, 24, n_rows),
+        }
+    )
+    y = (X["from_station_id"] < 7002).values
+    return X, y
+
+
+def test_station_stats_are_smoothed_towards_prior(rides):
+    X, y = rides
+    stats = station_stats(X, y, smoothing=0)
+
+    assert stats["prior"] == pytest.approx(y.mean())
+    assert stats["from_station_id"].loc[7000, "rate"] == 1.0
+    assert stats["from_station_id"].loc[7004, "rate"] == 0.0
+    assert stats["from_station_id"]["count"].sum() == len(X)
+
+    smoothed = station_stats(X, y)
+    assert 0 < smoothed["from_station_id"].loc[7004, "rate"] < stats["prior"]
+
+
+def test_target_encoder_reuses_precomputed_stats(rides):
+    X, y = rides
+    fitted = StationTargetEncoder().fit(X, y).transform(X)
+    # y is ignored when the stats are given
+    reused = StationTargetEncoder(stats=station_stats(X, y)).fit(X).transform(X)
+
+    np.testing.assert_array_equal(fitted, reused)
+    assert fitted.shape == (len(X), 4)
+
+
+def test_target_encoder_unknown_station_gets_prior(rides):
+    X, y = rides
+    encoder = StationTargetEncoder().fit(X, y)
+    unseen = X.head(1).assign(from_station_id=9999)
+
+    rate, count = encoder.transform(unseen)[0, :2]
+    assert rate == pytest.approx(encoder.stats_["prior"])
+    assert count == 0
+
+
+@pytest.mark.parametrize("encoder", ENCODERS)
+def test_encoders_fit_and_predict_unseen_stations(rides, encoder):
+    X, y = rides
+    clf = make_pipeline(
+        make_encoder(encoder, handle_unknown="ignore"),
+        RandomForestClassifier(n_estimators=5, random_state=42),
+    )
+    clf.fit(X, y)
+    unseen = X.head(3).assign(from_station_id=9999, to_station_id=9998)
+
+    assert clf.predict_proba(unseen).shape == (3, 2)
@@ -0,0 +1,88 @@
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from bikeshare.model import store
+from bikeshare.model.extract import ingest_archive
+
+HEADER = (
+    "trip_id,trip_start_time,trip_stop_time,trip_duration_seconds,"
+    "from_station_id,from_station_name,to_station_id,to_station_name,user_type\n"
+)
+Q1 = HEADER + (
+    "1,1/1/2017 0:00,1/1/2017 0:03,223,7051,a,7089,b,Member\n"
+    "2,13/2/2017 17:45,13/2/2017 18:10,1394,7143,c,7029,d,Casual\n"
+)
+Q2 = HEADER + "3,2/4/2017 8:15,2/4/2017 8:30,900,7051,a,7000,e,Member\n"
+
+
+@pytest.fixture
+def zip_path(tmp_path):
+    path = tmp_path / "bikeshare-ridership-2017.zip"
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("2017/Bikeshare Ridership (2017 Q1).csv", Q1)
+        archive.writestr("2017/Bikeshare Ridership (2017 Q2).csv", Q2)
+        archive.writestr("__MACOSX/2017/._Bikeshare Ridership (2017 Q1).csv", "")
+    return path
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.server.payload)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+        start, end = self.headers["Range"].split("=")[1].split("-")
+        body = self.server.payload[int(start) : int(end) + 1]
+        self.send_response(206)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_ingest_local_archive(zip_path, tmp_path):
+    store_path = tmp_path / "store"
+    partitions = ingest_archive(zip_path, store_path, chunksize=1)
+
+    assert partitions == [(2017, 1), (2017, 2), (2017, 4)]
+    assert not list(tmp_path.glob("**/*.csv"))
+    df_features = store.read_features(store_path)
+    assert sorted(df_features["trip_duration_seconds"]) == [223, 900, 1394]
+
+
+def test_ingest_remote_archive(zip_path, tmp_path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    server.payload = zip_path.read_bytes()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/bikeshare-ridership-2017.zip"
+    try:
+        partitions = ingest_archive(url, tmp_path / "store")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert partitions == [(2017, 1), (2017, 2), (2017, 4)]
+    manifest = store.load_manifest(tmp_path / "store")
+    assert len(manifest) == 2
+    assert all(source.endswith(f"::{url}") for source in manifest)
+
+
+def test_unchanged_members_are_skipped(zip_path, tmp_path, monkeypatch):
+    ingest_archive(zip_path, tmp_path / "store")
+
+    def fail(*args, **kwargs):
+        raise AssertionError("unchanged member was parsed again")
+
+    monkeypatch.setattr("bikeshare.model.preprocess.read_df", fail)
+    assert ingest_archive(zip_path, tmp_path / "store") == [
+        (2017, 1),
+        (2017, 2),
+        (2017, 4),
+    ]
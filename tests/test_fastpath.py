@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.pipeline import make_pipeline
+from sklearn.tree import DecisionTreeClassifier
+
+from bikeshare.model.encoders import make_encoder
+from bikeshare.model.fastpath import FastScorer, compile_scorer
+from bikeshare.model.features import FEATURES, TARGET, build_features, ride_values
+
+
+def sample_rides(n_rides, seed, stations=(7000, 7030)):
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2017-01-01") + pd.to_timedelta(
+        rng.integers(0, 365 * 24 * 60, n_rides), unit="min"
+    )
+    duration = rng.integers(60, 7200, n_rides)
+    stop = start + pd.to_timedelta(duration, unit="s")
+    return [
+        {
+            "trip_id": i,
+            # day and month not zero padded, as in the raw data
+            "trip_start_time": f"{t0.day}/{t0.month}/{t0.year} {t0.hour}:{t0.minute:02}",
+            "trip_stop_time": f"{t1.day}/{t1.month}/{t1.year} {t1.hour}:{t1.minute:02}",
+            "trip_duration_seconds": int(d),
+            "from_station_id": int(rng.integers(*stations)),
+            "to_station_id": int(rng.integers(*stations)),
+            "user_type": "Member" if rng.random() < 0.7 else "Casual",
+        }
+        for i, (t0, t1, d) in enumerate(zip(start, stop, duration))
+    ]
+
+
+def fit_pipeline(encoder="onehot", handle_unknown="ignore"):
+    df = build_features(sample_rides(2000, seed=0))
+    pipeline = make_pipeline(
+        make_encoder(encoder, handle_unknown=handle_unknown),
+        RandomForestClassifier(n_estimators=20, max_depth=8, random_state=42),
+    )
+    return pipeline.fit(df[FEATURES], df[TARGET])
+
+
+def test_ride_values_match_build_features():
+    rides = sample_rides(200, seed=1)
+    expected = build_features(rides)[FEATURES].to_numpy()
+    np.testing.assert_array_equal([ride_values(r) for r in rides], expected)
+
+
+def test_fast_scorer_matches_pipeline_on_sampled_rides():
+    pipeline = fit_pipeline()
+    scorer = FastScorer(pipeline)
+    # new stations are unknown to the encoder
+    rides = sample_rides(300, seed=2, stations=(7020, 7040))
+
+    expected = pipeline.predict_proba(build_features(rides)[FEATURES])
+    fast = np.array([scorer.predict_proba(ride) for ride in rides])
+
+    np.testing.assert_allclose(fast, expected, rtol=0, atol=1e-12)
+    preds = [scorer.predict(ride) for ride in rides]
+    assert preds == pipeline.predict(build_features(rides)[FEATURES]).tolist()
+
+
+def test_fast_scorer_raises_on_unknown_station_like_the_pipeline():
+    scorer = FastScorer(fit_pipeline(handle_unknown="error"))
+    ride = sample_rides(1, seed=3)[0]
+    ride["from_station_id"] = 9999
+
+    with pytest.raises(ValueError, match="unknown from_station_id"):
+        scorer.predict(ride)
+
+
+def test_unsupported_pipelines_are_not_compiled():
+    df = build_features(sample_rides(200, seed=0))
+    tree = make_pipeline(make_encoder("onehot"), DecisionTreeClassifier())
+    tree.fit(df[FEATURES], df[TARGET])
+
+    assert compile_scorer(tree) is None
+    assert compile_scorer(fit_pipeline(encoder="target")) is None
+
+
+def test_scores_from_precomputed_values():
+    pipeline = fit_pipeline()
+    scorer = FastScorer(pipeline)
+    for ride in sample_rides(20, seed=3):
+        values = ride_values(ride)
+        assert scorer.predict_values(values) == scorer.predict(ride)
+        np.testing.assert_array_equal(
+            scorer.predict_proba_values(values), scorer.predict_proba(ride)
+        )
@@ -0,0 +1,48 @@
+import pandas as pd
+
+from bikeshare.model.features import FEATURES, TARGET, build_features
+
+RIDES = [
+    {
+        "trip_id": 712382,
+        "trip_start_time": "1/1/2017 0:00",
+        "trip_stop_time": "1/1/2017 0:03",
+        "trip_duration_seconds": 223,
+        "from_station_id": 7051,
+        "from_station_name": "Wellesley St E / Yonge St Green P",
+        "to_station_id": 7089,
+        "to_station_name": "Church St  / Wood St",
+        "user_type": "Member",
+    },
+    {
+        "trip_id": 712384,
+        "trip_start_time": "13/1/2017 17:45",
+        "trip_stop_time": "13/1/2017 18:10",
+        "trip_duration_seconds": 1394,
+        "from_station_id": 7143,
+        "from_station_name": "Kendal Ave",
+        "to_station_id": 7029,
+        "to_station_name": "Bay St / Bloor St W",
+        "user_type": "Casual",
+    },
+]
+
+
+def test_single_batch_and_frame_agree():
+    df_features = build_features(pd.DataFrame(RIDES))
+    batch = build_features(RIDES)
+    single = build_features(RIDES[1])
+    pd.testing.assert_frame_equal(batch, df_features)
+    pd.testing.assert_frame_equal(single, df_features.iloc[[1]].reset_index(drop=True))
+    assert list(df_features.columns) == FEATURES + [TARGET]
+
+
+def test_fractional_hours_for_serving():
+    # serving used to truncate to whole hours, unlike training
+    single = build_features(RIDES[1])
+    assert single.loc[0, "start_hour"] == 17.75
+
+
+def test_target_only_when_labelled():
+    ride = {k: v for k, v in RIDES[0].items() if k != "user_type"}
+    assert list(build_features(ride).columns) == FEATURES
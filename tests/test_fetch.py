@@ -0,0 +1,152 @@
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from bikeshare.model import fetch
+
+PAYLOAD = bytes(range(256)) * 4096  # 1 MiB
+
+
+class CKANStandIn(BaseHTTPRequestHandler):
+    """Serves package_show and one resource, with Range support
+
+    The first download of the resource is cut off half-way through
+    """
+
+    drop_first = True
+    requests_seen = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.requests_seen.append((self.path, self.headers.get("Range")))
+        if self.path.startswith("/api/3/action/package_show"):
+            self.send_json(self.server.package)
+        elif self.path == "/download/bikeshare-ridership-2017.zip":
+            self.send_payload()
+        else:
+            self.send_error(404)
+
+    def send_json(self, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_payload(self):
+        start = 0
+        if self.headers.get("Range"):
+            start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(PAYLOAD) - 1}/{len(PAYLOAD)}"
+            )
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(PAYLOAD) - start))
+        self.end_headers()
+        if CKANStandIn.drop_first:
+            CKANStandIn.drop_first = False
+            self.wfile.write(PAYLOAD[start : len(PAYLOAD) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(PAYLOAD[start:])
+
+
+@pytest.fixture
+def ckan_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CKANStandIn)
+    host = f"http://127.0.0.1:{server.server_port}"
+    CKANStandIn.server_package = server.package = {
+        "result": {
+            "resources": [
+                {
+                    "id": "98b63ba7",
+                    "last_modified": "2018-01-04T15:20:08",
+                    "name": "bikeshare-ridership-2017",
+                    "format": "ZIP",
+                    "datastore_active": False,
+                    "url": f"{host}/download/bikeshare-ridership-2017.zip",
+                    "size": len(PAYLOAD),
+                    "hash": "sha256:" + hashlib.sha256(PAYLOAD).hexdigest(),
+                },
+                {
+                    "id": "c2d8d3f5",
+                    "last_modified": "2019-01-07T09:12:40",
+                    "name": "bikeshare-ridership-2018",
+                    "format": "ZIP",
+                    "datastore_active": False,
+                    "url": f"{host}/download/bikeshare-ridership-2018.zip",
+                },
+            ]
+        }
+    }
+    CKANStandIn.drop_first = True
+    CKANStandIn.requests_seen = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"{host}/api/3/action/"
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_resumes_after_drop(ckan_server, tmp_path):
+    paths = fetch.run("2017", tmp_path, min_interval=0, base_url=ckan_server, backoff=0)
+
+    assert paths == [tmp_path / "bikeshare-ridership-2017.zip"]
+    assert paths[0].read_bytes() == PAYLOAD
+    assert not (tmp_path / "bikeshare-ridership-2017.zip.part").exists()
+    downloads = [rng for path, rng in CKANStandIn.requests_seen if "download" in path]
+    assert downloads == [None, f"bytes={len(PAYLOAD) // 2}-"]
+
+
+def test_partial_file_is_not_skipped(ckan_server, tmp_path):
+    (tmp_path / "bikeshare-ridership-2017.zip").write_bytes(PAYLOAD[:10])
+    CKANStandIn.drop_first = False
+
+    paths = fetch.run("2017", tmp_path, min_interval=0, base_url=ckan_server, backoff=0)
+
+    assert paths[0].read_bytes() == PAYLOAD
+
+
+def test_rate_limiter_spaces_requests_per_host():
+    limiter = fetch.HostRateLimiter(min_interval=0.05)
+    start = fetch.time.monotonic()
+    for _ in range(3):
+        limiter.wait("http://a.example/x")
+    limiter.wait("http://b.example/x")
+    assert fetch.time.monotonic() - start >= 0.1
+
+
+def test_rerun_uses_cache_and_manifest(ckan_server, tmp_path):
+    CKANStandIn.drop_first = False
+    fetch.run("2017", tmp_path, min_interval=0, base_url=ckan_server)
+    CKANStandIn.requests_seen.clear()
+
+    paths = fetch.run("2017", tmp_path, min_interval=0, base_url=ckan_server)
+
+    assert paths == [tmp_path / "bikeshare-ridership-2017.zip"]
+    assert CKANStandIn.requests_seen == []
+
+
+def test_republished_resource_is_refreshed(ckan_server, tmp_path):
+    CKANStandIn.drop_first = False
+    fetch.run("2017", tmp_path, min_interval=0, base_url=ckan_server)
+    CKANStandIn.requests_seen.clear()
+    CKANStandIn.server_package["result"]["resources"][0][
+        "last_modified"
+    ] = "2020-06-01T00:00:00"
+
+    fetch.run("2017", tmp_path, min_interval=0, base_url=ckan_server, metadata_ttl=0)
+
+    paths_seen = [path for path, _ in CKANStandIn.requests_seen]
+    assert paths_seen[0].startswith("/api/3/action/package_show")
+    assert paths_seen[1:] == ["/download/bikeshare-ridership-2017.zip"]
+    manifest = fetch.load_manifest(tmp_path / fetch.MANIFEST)
+    assert manifest["98b63ba7"]["last_modified"] == "2020-06-01T00:00:00"
@@ -0,0 +1,89 @@
+import mlflow
+import numpy as np
+import pandas as pd
+import pytest
+from mlflow.tracking import MlflowClient
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.pipeline import make_pipeline
+
+from bikeshare.model.encoders import make_encoder
+from bikeshare.model.features import FEATURES, TARGET
+from bikeshare.model.incremental import (
+    PARTITIONS_TAG,
+    add_trees,
+    trained_partitions,
+    update_model,
+)
+from bikeshare.model.registry import promote_run
+
+
+def make_month(seed, stations=(7000, 7010), n_rows=600):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(
+        {
+            "trip_duration_seconds": rng.integers(60, 3600, n_rows),
+            "from_station_id": rng.integers(*stations, n_rows),
+            "to_station_id": rng.integers(*stations, n_rows),
+            "day_of_week": rng.integers(0, 7, n_rows),
+            "start_hour": rng.uniform(0, 24, n_rows),
+            "end_hour": rng.uniform(0, 24, n_rows),
+        }
+    )
+    df[TARGET] = df["trip_duration_seconds"] < 1800
+    return df
+
+
+def fit_base(df):
+    pipeline = make_pipeline(
+        make_encoder("onehot"), RandomForestClassifier(n_estimators=5, random_state=42)
+    )
+    return pipeline.fit(df[FEATURES], df[TARGET])
+
+
+def test_add_trees_grows_a_copy_of_the_forest():
+    base = fit_base(make_month(0))
+    # new stations open in the new month
+    new_month = make_month(1, stations=(7005, 7020))
+
+    updated = add_trees(base, new_month[FEATURES], new_month[TARGET], n_new_trees=3)
+
+    assert len(base[-1].estimators_) == 5
+    assert len(updated[-1].estimators_) == 8
+    assert updated[-1].estimators_[:5] != base[-1].estimators_[:5]
+    assert updated.predict_proba(new_month[FEATURES]).shape == (600, 2)
+
+
+def test_update_model_promotes_only_a_better_model(tmp_path, monkeypatch):
+    tracking_uri = f"sqlite:///{tmp_path / 'mlflow.db'}"
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("MLFLOW_TRACKING_URI", tracking_uri)
+    monkeypatch.setenv("MLFLOW_EXP_NAME", "test")
+    monkeypatch.setenv("MLFLOW_REGISTERED_MODEL", "test-clf")
+    mlflow.set_tracking_uri(tracking_uri)
+    mlflow.set_experiment("test")
+    with mlflow.start_run(tags={PARTITIONS_TAG: "2017-01"}) as run:
+        mlflow.sklearn.log_model(fit_base(make_month(0)), "models")
+    client = MlflowClient(tracking_uri=tracking_uri)
+    promote_run(client, run.info.run_id, "test-clf")
+    assert trained_partitions() == {(2017, 1)}
+
+    assert update_model(make_month(1), n_new_trees=3, min_gain=1.0) is None
+    version = update_model(
+        make_month(1), n_new_trees=3, min_gain=-1.0, partitions=[(2017, 2)]
+    )
+
+    assert int(version.version) == 2 and version.current_stage == "Production"
+    stages = {int(v.version): v.current_stage for v in client.search_model_versions()}
+    assert stages == {1: "Archived", 2: "Production"}
+    model = mlflow.sklearn.load_model(version.source)
+    assert len(model[-1].estimators_) == 8
+    assert trained_partitions() == {(2017, 1), (2017, 2)}
+
+
+def test_update_model_needs_a_production_version(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("MLFLOW_TRACKING_URI", f"sqlite:///{tmp_path / 'mlflow.db'}")
+    monkeypatch.setenv("MLFLOW_REGISTERED_MODEL", "test-clf")
+
+    with pytest.raises(ValueError, match="no Production version"):
+        update_model(make_month(1))
@@ -0,0 +1,48 @@
+import json
+
+import numpy as np
+from mlflow.tracking import MlflowClient
+
+from bikeshare.model.instrument import Instrument
+
+
+def test_stage_records_time_memory_and_throughput():
+    instrument = Instrument("test")
+
+    with instrument.stage("allocate") as stats:
+        data = np.ones(20 * 2**20, dtype="uint8")
+        stats["rows"] = len(data)
+    with instrument.stage("noop", rows=0):
+        pass
+
+    allocate, noop = instrument.stages
+    assert allocate["stage"] == "allocate"
+    assert allocate["wall_s"] >= 0 and allocate["cpu_s"] >= 0
+    assert allocate["peak_rss_mb"] >= 20
+    assert allocate["rows_per_s"] > 0
+    assert noop["rows"] == 0
+
+
+def test_stats_are_saved_and_logged_to_mlflow(tmp_path):
+    instrument = Instrument("test")
+    with instrument.stage("read", rows=10):
+        pass
+    with instrument.stage("register"):
+        pass
+
+    instrument.save(tmp_path / "stats.json")
+    instrument.save(tmp_path / "stats.json")
+    records = (tmp_path / "stats.json").read_text().splitlines()
+    assert len(records) == 2
+    assert [s["stage"] for s in json.loads(records[0])["stages"]] == [
+        "read",
+        "register",
+    ]
+
+    client = MlflowClient(tracking_uri=(tmp_path / "mlruns").as_uri())
+    run = client.create_run(client.create_experiment("test"))
+    instrument.log_to_mlflow(run.info.run_id, (tmp_path / "mlruns").as_uri())
+    metrics = client.get_run(run.info.run_id).data.metrics
+    assert metrics["read_rows"] == 10
+    assert "read_rows_per_s" in metrics and "register_wall_s" in metrics
+    assert "register_rows" not in metrics
@@ -0,0 +1,31 @@
+import numpy as np
+import scipy.sparse as sp
+
+from bikeshare.model.matrices import dump_matrices, load_matrices, to_matrix
+
+
+def test_to_matrix_layouts():
+    dense = np.arange(6, dtype="float64").reshape(2, 3)[:, ::2]
+    assert not dense.flags["C_CONTIGUOUS"]
+
+    matrix = to_matrix(dense)
+    assert matrix.dtype == np.float32 and matrix.flags["C_CONTIGUOUS"]
+    np.testing.assert_array_equal(matrix, dense)
+
+    sparse = sp.random(20, 10, density=0.2, format="coo", random_state=0)
+    assert to_matrix(sparse, "csc").format == "csc"
+    assert to_matrix(sparse).format == "csr"
+    assert to_matrix(sparse).dtype == np.float32
+
+
+def test_load_matrices_memory_maps(tmp_path):
+    dense = to_matrix(np.ones((4, 3)))
+    sparse = to_matrix(sp.eye(4, format="csr"))
+
+    paths = dump_matrices({"dense": dense, "sparse": sparse}, tmp_path)
+    loaded = load_matrices(paths)
+
+    assert isinstance(loaded["dense"], np.memmap)
+    assert isinstance(loaded["sparse"].data, np.memmap)
+    assert not loaded["dense"].flags["WRITEABLE"]
+    np.testing.assert_array_equal(loaded["sparse"].toarray(), np.eye(4))
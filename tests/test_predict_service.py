@@ -0,0 +1,177 @@
+import importlib
+import json
+import sys
+
+import mlflow
+import mongomock
+import numpy as np
+import pytest
+from mlflow.tracking import MlflowClient
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.pipeline import make_pipeline
+
+from bikeshare.model.encoders import make_encoder
+from bikeshare.model.features import FEATURES, TARGET, build_features
+from bikeshare.model.registry import promote_run
+
+
+def make_rides(n_rides, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            "trip_id": i,
+            "trip_start_time": f"{rng.integers(1, 29)}/1/2017 {rng.integers(0, 23)}:00",
+            "trip_stop_time": f"{rng.integers(1, 29)}/1/2017 23:30",
+            "trip_duration_seconds": int(rng.integers(60, 3600)),
+            "from_station_id": int(rng.integers(7000, 7010)),
+            "to_station_id": int(rng.integers(7000, 7010)),
+            "user_type": "Member" if rng.random() < 0.7 else "Casual",
+        }
+        for i in range(n_rides)
+    ]
+
+
+@pytest.fixture(scope="module")
+def service(tmp_path_factory):
+    """The prediction service, serving a registered model, on mongomock"""
+    tmp_path = tmp_path_factory.mktemp("service")
+    tracking_uri = f"sqlite:///{tmp_path / 'mlflow.db'}"
+    df = build_features(make_rides(500))
+    pipeline = make_pipeline(
+        make_encoder("onehot"), RandomForestClassifier(n_estimators=5, random_state=0)
+    ).fit(df[FEATURES], df[TARGET])
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setenv("MLFLOW_TRACKING_URI", tracking_uri)
+        monkeypatch.setenv("MLFLOW_REGISTERED_MODEL", "test-clf")
+        mlflow.set_tracking_uri(tracking_uri)
+        mlflow.set_experiment("test")
+        with mlflow.start_run() as run:
+            mlflow.sklearn.log_model(pipeline, "models")
+        promote_run(MlflowClient(tracking_uri), run.info.run_id, "test-clf")
+
+        sys.modules.pop("bikeshare.deploy.predict_service.predict", None)
+        with mongomock.patch(servers=(("127.0.0.1", 27017),)):
+            predict = importlib.import_module(
+                "bikeshare.deploy.predict_service.predict"
+            )
+        yield predict
+        predict.writer.close()
+
+
+def test_batch_predictions_are_returned_in_order(service):
+    rides = make_rides(20, seed=1)
+    response = service.app.test_client().post("/predict/batch", json=rides)
+
+    assert response.status_code == 200
+    expected = service.predict(service.model, build_features(rides)[FEATURES])
+    assert response.get_json()["predicted_membership"] == expected
+
+
+def test_batch_records_keep_each_rides_target(service, monkeypatch):
+    saved = []
+    monkeypatch.setattr(service, "save_many_to_db", saved.extend)
+    rides = make_rides(4, seed=3)
+    # riders of unknown type, e.g. from a client that does not send it
+    for ride in rides[1::2]:
+        del ride["user_type"]
+    response = service.app.test_client().post("/predict/batch", json=rides)
+
+    assert response.status_code == 200
+    assert [record.get(TARGET) for record in saved] == [
+        rides[0]["user_type"] == "Member",
+        None,
+        rides[2]["user_type"] == "Member",
+        None,
+    ]
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        # malformed date
+        [{**make_rides(1)[0], "trip_start_time": "2017-01-01 00:00"}],
+        # station the model was not fit on
+        [{**make_rides(1)[0], "from_station_id": 9999}],
+        # not rides
+        [1, 2],
+        [make_rides(1)[0], "ride"],
+        # missing a feature
+        [{"trip_id": 1}],
+    ],
+)
+def test_bad_rides_get_a_json_400(service, body):
+    response = service.app.test_client().post("/predict/batch", json=body)
+
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+@pytest.mark.parametrize(
+    "ride",
+    [
+        {**make_rides(1)[0], "trip_start_time": "2017-01-01 00:00"},
+        {**make_rides(1)[0], "from_station_id": 9999},
+        {"trip_id": 1},
+        [make_rides(1)[0]],
+    ],
+)
+@pytest.mark.parametrize("fast_path", [True, False])
+def test_bad_ride_gets_a_json_400(service, monkeypatch, ride, fast_path):
+    if not fast_path:
+        monkeypatch.setattr(service, "fast_scorer", None)
+    response = service.app.test_client().put("/predict", json=ride)
+
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_rides_fail_alike_on_both_paths(service, monkeypatch):
+    # the model was not fit on this station: only scoring finds it out
+    ride = {**make_rides(1)[0], "from_station_id": 9999}
+    fast = service.app.test_client().put("/predict", json=ride)
+    monkeypatch.setattr(service, "fast_scorer", None)
+    errors = service.batcher.metrics()["errors"]
+    batched = service.app.test_client().put("/predict", json=ride)
+
+    assert fast.status_code == batched.status_code == 400
+    assert fast.get_json()["error"].startswith("invalid ride")
+    assert batched.get_json()["error"].startswith("invalid ride")
+    # scored, and failed, by the micro-batcher
+    assert service.batcher.metrics()["errors"] == errors + 1
+
+
+def test_malformed_json_gets_a_json_400(service):
+    response = service.app.test_client().post(
+        "/predict/batch", data="[{", content_type="application/json"
+    )
+
+    assert response.status_code == 400
+    assert response.get_json()["error"].startswith("invalid JSON")
+    response = service.app.test_client().put(
+        "/predict", data="{", content_type="application/json"
+    )
+    assert response.status_code == 400
+    assert response.get_json()["error"].startswith("invalid JSON")
+
+
+def test_single_rides_take_the_fast_path(service):
+    ride = make_rides(1, seed=2)[0]
+    requests = service.batcher.metrics()["requests"]
+    response = service.app.test_client().put("/predict", json=ride)
+
+    assert response.status_code == 200
+    expected = service.predict(service.model, build_features(ride)[FEATURES])
+    assert response.get_json()["predicted_membership"] == expected[0]
+    metrics = service.app.test_client().get("/metrics").get_json()
+    assert metrics["fast_path"] and metrics["requests"] == requests
+
+
+def test_predictions_point_to_the_registered_version(service):
+    service.setup_db()
+    (doc,) = service.db.get_collection("models").find()
+
+    assert doc["_id"] == service.MODEL_ID == f"test-clf/{service.MODEL_VERSION.version}"
+    assert doc["run_id"] == service.MODEL_VERSION.run_id
+    assert json.loads(doc["metadata"])["run_id"] == doc["run_id"]
@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+
+from bikeshare.model.preprocess import preprocess, stream_preprocess
+
+
+@pytest.fixture
+def raw_rides():
+    return pd.DataFrame(
+        {
+            "trip_id": [712382, 712384],
+            "trip_start_time": ["1/1/2017 0:00", "13/1/2017 17:45"],
+            "trip_stop_time": ["1/1/2017 0:03", "13/1/2017 18:10"],
+            "trip_duration_seconds": [223, 1394],
+            "from_station_id": [7051, 7143],
+            "from_station_name": ["Wellesley St E / Yonge St Green P", "Kendal Ave"],
+            "to_station_id": [7089, 7029],
+            "to_station_name": ["Church St  / Wood St", "Bay St / Bloor St W"],
+            "user_type": ["Member", "Casual"],
+        }
+    )
+
+
+def test_preprocess(raw_rides):
+    df_bikes = preprocess(raw_rides)
+    assert list(df_bikes.columns) == [
+        "trip_duration_seconds",
+        "from_station_id",
+        "to_station_id",
+        "day_of_week",
+        "start_hour",
+        "end_hour",
+        "target",
+    ]
+    # 2017-01-01 was a Sunday, 2017-01-13 a Friday
+    assert df_bikes["day_of_week"].tolist() == [6, 4]
+    assert df_bikes["start_hour"].tolist() == [0.0, 17.75]
+    assert df_bikes["end_hour"].tolist() == [0.05, 18 + 10 / 60]
+    assert df_bikes["target"].tolist() == [True, False]
+
+
+def test_stream_preprocess(raw_rides, tmp_path):
+    raw_path = tmp_path / "rides.csv"
+    raw_rides.to_csv(raw_path, index=False)
+    dest_file = tmp_path / "features.parquet"
+
+    n_rows = stream_preprocess(raw_path, dest_file, chunksize=1)
+
+    assert n_rows == len(raw_rides)
+    pd.testing.assert_frame_equal(pd.read_parquet(dest_file), preprocess(raw_rides))
@@ -0,0 +1,129 @@
+import json
+
+import mlflow
+import mongomock
+import numpy as np
+import pandas as pd
+from mlflow.tracking import MlflowClient
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.pipeline import make_pipeline
+
+from bikeshare.model.encoders import make_encoder
+from bikeshare.model.features import (
+    FEATURES,
+    TARGET,
+    build_features,
+    ride_target,
+    ride_values,
+)
+from bikeshare.model.records import (
+    RECORD_FIELDS,
+    ensure_indexes,
+    make_record,
+    model_id,
+    records_to_frame,
+    save_model_meta,
+)
+from bikeshare.model.registry import promote_run
+
+RIDES = [
+    {
+        "trip_id": 712382,
+        "trip_start_time": "1/1/2017 0:00",
+        "trip_stop_time": "1/1/2017 0:03",
+        "trip_duration_seconds": 223,
+        "from_station_id": 7051,
+        "from_station_name": "Wellesley St E / Yonge St Green P",
+        "to_station_id": 7089,
+        "to_station_name": "Church St  / Wood St",
+        "user_type": "Member",
+    },
+    {
+        "trip_id": 712384,
+        "trip_start_time": "13/2/2017 17:45",
+        "trip_stop_time": "13/2/2017 18:08",
+        "trip_duration_seconds": 1394,
+        "from_station_id": 7000,
+        "to_station_id": 7022,
+        "user_type": "Casual",
+    },
+]
+
+
+def test_records_read_back_as_the_service_features():
+    records = [
+        make_record(ride_values(ride), pred, "model", ride_target(ride))
+        for ride, pred in zip(RIDES, [True, False])
+    ]
+    # the batch endpoint saves from the DataFrame of features
+    features = build_features(RIDES)
+    batch_records = [
+        make_record(values, pred, "model", target)
+        for values, pred, target in zip(
+            features[FEATURES].itertuples(index=False, name=None),
+            np.array([True, False]),
+            features[TARGET],
+        )
+    ]
+    for record, batch_record in zip(records, batch_records):
+        assert record["x"] == batch_record["x"]
+        # saved as native types, which BSON encodes
+        assert [type(value) for value in batch_record["x"]] == [
+            int,
+            int,
+            int,
+            int,
+            float,
+            float,
+        ]
+        assert type(batch_record["pred"]) is bool
+
+    df = records_to_frame(records)
+    expected = features.assign(prediction=[True, False])
+    pd.testing.assert_frame_equal(
+        df[FEATURES + ["prediction", TARGET]],
+        expected[FEATURES + ["prediction", TARGET]],
+        check_dtype=False,
+    )
+
+
+def test_records_without_target():
+    ride = {key: value for key, value in RIDES[0].items() if key != "user_type"}
+    record = make_record(ride_values(ride), True, "model", ride_target(ride))
+    assert TARGET not in record
+    assert TARGET not in records_to_frame([record])
+    assert list(records_to_frame([]).columns) == FEATURES + ["prediction"]
+
+
+def test_model_meta_is_saved_once_and_predictions_expire(tmp_path, monkeypatch):
+    # the metadata of a registered model, as the service loads it
+    monkeypatch.chdir(tmp_path)
+    tracking_uri = f"sqlite:///{tmp_path / 'mlflow.db'}"
+    mlflow.set_tracking_uri(tracking_uri)
+    mlflow.set_experiment("records")
+    df = build_features(RIDES)
+    pipeline = make_pipeline(
+        make_encoder("onehot"), RandomForestClassifier(n_estimators=2)
+    ).fit(df[FEATURES], df[TARGET])
+    with mlflow.start_run() as run:
+        mlflow.sklearn.log_model(pipeline, "models")
+    mv = promote_run(MlflowClient(tracking_uri), run.info.run_id, "test-clf")
+    meta = mlflow.pyfunc.load_model(mv.source).metadata.to_json()
+
+    db = mongomock.MongoClient().get_database("prediction_service")
+    for _ in range(2):
+        saved = save_model_meta(db["models"], mv.name, mv.version, mv.run_id, meta)
+        assert saved == model_id("test-clf", mv.version) == f"test-clf/{mv.version}"
+    (doc,) = db["models"].find()
+    assert doc["_id"] == saved and doc["version"] == str(mv.version)
+    assert doc["run_id"] == run.info.run_id
+    assert json.loads(doc["metadata"])["run_id"] == run.info.run_id
+
+    ensure_indexes(db["predictions"], retention_days=7)
+    indexes = db["predictions"].index_information()
+    assert indexes["ts_1"]["expireAfterSeconds"] == 7 * 24 * 3600
+    assert "model_1_ts_1" in indexes
+
+    db["predictions"].insert_one(make_record(ride_values(RIDES[0]), True, saved))
+    (record,) = db["predictions"].find({}, RECORD_FIELDS)
+    assert set(record) == {"x", "pred"}
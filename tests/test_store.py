@@ -0,0 +1,73 @@
+import pandas as pd
+import pytest
+
+from bikeshare.model import store
+from bikeshare.model.preprocess import ingest
+
+
+@pytest.fixture
+def raw_path(tmp_path):
+    rides = pd.DataFrame(
+        {
+            "trip_id": [1, 2, 3, 4],
+            "trip_start_time": [
+                "1/1/2017 0:00",
+                "13/1/2017 17:45",
+                "2/2/2017 8:15",
+                "28/2/2017 23:50",
+            ],
+            "trip_stop_time": [
+                "1/1/2017 0:03",
+                "13/1/2017 18:10",
+                "2/2/2017 8:30",
+                "1/3/2017 0:05",
+            ],
+            "trip_duration_seconds": [223, 1394, 900, 900],
+            "from_station_id": [7051, 7143, 7051, 7000],
+            "from_station_name": ["a", "b", "a", "c"],
+            "to_station_id": [7089, 7029, 7000, 7051],
+            "to_station_name": ["d", "e", "c", "a"],
+            "user_type": ["Member", "Casual", "Member", "Member"],
+        }
+    )
+    path = tmp_path / "rides.csv"
+    rides.to_csv(path, index=False)
+    return path
+
+
+def test_ingest_partitions_by_month(raw_path, tmp_path):
+    store_path = tmp_path / "store"
+    partitions = ingest(raw_path, store_path, chunksize=3)
+
+    assert partitions == [(2017, 1), (2017, 2)]
+    assert (store_path / "year=2017" / "month=2").is_dir()
+
+    df_features = store.read_features(store_path)
+    assert len(df_features) == 4
+    assert df_features["from_station_id"].dtype == "category"
+    assert df_features["day_of_week"].dtype == "int8"
+    assert df_features["start_hour"].dtype == "float32"
+
+
+def test_read_features_pushdown(raw_path, tmp_path):
+    store_path = tmp_path / "store"
+    ingest(raw_path, store_path)
+
+    feb = store.read_features(
+        store_path,
+        columns=["start_hour"],
+        filters=store.partition_filters([(2017, 2)]),
+    )
+    assert list(feb.columns) == ["start_hour"]
+    assert feb["start_hour"].tolist() == pytest.approx([8.25, 23 + 50 / 60])
+
+
+def test_ingest_skips_unchanged_source(raw_path, tmp_path, monkeypatch):
+    store_path = tmp_path / "store"
+    ingest(raw_path, store_path)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("unchanged csv was parsed again")
+
+    monkeypatch.setattr("bikeshare.model.preprocess.read_df", fail)
+    assert ingest(raw_path, store_path) == [(2017, 1), (2017, 2)]
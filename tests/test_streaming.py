@@ -0,0 +1,120 @@
+import mlflow
+import numpy as np
+import pandas as pd
+import pytest
+from mlflow.tracking import MlflowClient
+
+from bikeshare.model.features import FEATURES, TARGET
+from bikeshare.model.registry import register_model
+from bikeshare.model.store import iter_features, write_partitions
+from bikeshare.model.streaming import SGD_METRIC, stream_search
+from bikeshare.model.tracking import MODEL_LOGGED
+
+
+def make_store(store_path, n_files=4, n_rows=200):
+    rng = np.random.default_rng(0)
+    for i in range(n_files):
+        df = pd.DataFrame(
+            {
+                "trip_duration_seconds": rng.integers(60, 3600, n_rows),
+                "from_station_id": rng.integers(7000, 7010, n_rows),
+                "to_station_id": rng.integers(7000, 7010, n_rows),
+                "day_of_week": rng.integers(0, 7, n_rows),
+                "start_hour": rng.uniform(0, 24, n_rows),
+                "end_hour": rng.uniform(0, 24, n_rows),
+                "year": 2017,
+                "month": i + 1,
+            }
+        )
+        df[TARGET] = df["trip_duration_seconds"] < 1800
+        write_partitions(df, store_path, f"source-{i}")
+
+
+def test_iter_features_coalesces_small_files(tmp_path):
+    make_store(tmp_path)
+
+    batches = list(iter_features(tmp_path, batch_size=300))
+
+    assert [len(batch) for batch in batches] == [400, 400]
+    assert list(batches[0].columns) == FEATURES + [TARGET]
+    filtered = iter_features(tmp_path, filters=[("month", "=", 2)], batch_size=300)
+    assert sum(len(batch) for batch in filtered) == 200
+
+
+def test_stream_search_logs_pipelines_on_raw_features(tmp_path, monkeypatch):
+    make_store(tmp_path / "store")
+    tracking_uri = f"sqlite:///{tmp_path / 'mlflow.db'}"
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("MLFLOW_TRACKING_URI", tracking_uri)
+    monkeypatch.setenv("MLFLOW_EXP_NAME", "test")
+
+    trials = stream_search(tmp_path / "store", 3, batch_size=300, keep_models=1)
+
+    assert len(trials.losses()) == 3
+    client = MlflowClient(tracking_uri=tracking_uri)
+    exp_id = client.get_experiment_by_name("test").experiment_id
+    runs = client.search_runs([exp_id], filter_string=f"tags.{MODEL_LOGGED} = 'true'")
+    assert len(runs) == 1 and runs[0].data.tags["backend"] == "sgd"
+    assert 1 / runs[0].data.metrics[SGD_METRIC] == min(trials.losses())
+
+    model = mlflow.sklearn.load_model(f"runs:/{runs[0].info.run_id}/models")
+    rides = next(iter_features(tmp_path / "store"))[FEATURES]
+    assert model.predict(rides).shape == (len(rides),)
+
+
+def test_register_model_ranks_only_the_current_search(tmp_path, monkeypatch):
+    make_store(tmp_path / "store")
+    tracking_uri = f"sqlite:///{tmp_path / 'mlflow.db'}"
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("MLFLOW_TRACKING_URI", tracking_uri)
+    monkeypatch.setenv("MLFLOW_EXP_NAME", "test")
+    monkeypatch.setenv("MLFLOW_REGISTERED_MODEL", "test-clf")
+    client = MlflowClient(tracking_uri=tracking_uri)
+    exp_id = client.create_experiment("test")
+    # an earlier search's trial, scored on other data
+    earlier = client.create_run(exp_id)
+    client.log_metric(earlier.info.run_id, "roc_auc", 0.99)
+    client.log_metric(earlier.info.run_id, SGD_METRIC, 0.99)
+    client.set_tag(earlier.info.run_id, MODEL_LOGGED, "true")
+    parent = client.create_run(exp_id)
+
+    run_tags = {"mlflow.parentRunId": parent.info.run_id}
+    stream_search(tmp_path / "store", 2, batch_size=300, run_tags=run_tags)
+    version = register_model(SGD_METRIC, parent_run_id=parent.info.run_id)
+
+    run = client.get_run(version.run_id)
+    assert run.data.tags["mlflow.parentRunId"] == parent.info.run_id
+    assert "roc_auc" not in run.data.metrics
+
+
+def test_warm_search_runs_new_trials_on_a_saved_file(tmp_path, monkeypatch):
+    make_store(tmp_path / "store")
+    tracking_uri = f"sqlite:///{tmp_path / 'mlflow.db'}"
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("MLFLOW_TRACKING_URI", tracking_uri)
+    monkeypatch.setenv("MLFLOW_EXP_NAME", "test")
+    monkeypatch.setenv("MLFLOW_REGISTERED_MODEL", "test-clf")
+    client = MlflowClient(tracking_uri=tracking_uri)
+    exp_id = client.create_experiment("test")
+    trials_file = tmp_path / "trials.pkl"
+
+    search = dict(batch_size=300, trials_file=trials_file)
+    stream_search(tmp_path / "store", 2, resume="warm", **search)
+    parent = client.create_run(exp_id)
+    run_tags = {"mlflow.parentRunId": parent.info.run_id}
+    trials = stream_search(
+        tmp_path / "store", 2, run_tags=run_tags, resume="warm", **search
+    )
+
+    assert len(trials) == 4
+    version = register_model(SGD_METRIC, parent_run_id=parent.info.run_id)
+    run = client.get_run(version.run_id)
+    assert run.data.tags["mlflow.parentRunId"] == parent.info.run_id
+
+    # resuming the finished search runs nothing new under another parent
+    other = client.create_run(exp_id)
+    run_tags = {"mlflow.parentRunId": other.info.run_id}
+    trials = stream_search(tmp_path / "store", 4, run_tags=run_tags, **search)
+    assert len(trials) == 4
+    with pytest.raises(ValueError, match=other.info.run_id):
+        register_model(SGD_METRIC, parent_run_id=other.info.run_id)
@@ -0,0 +1,100 @@
+import gc
+import multiprocessing
+
+import mlflow
+import numpy as np
+import pytest
+from mlflow.tracking import MlflowClient
+from sklearn.linear_model import LogisticRegression
+
+from bikeshare.model.tracking import MODEL_LOGGED, RunLogger
+
+
+@pytest.fixture
+def store(tmp_path):
+    tracking_uri = (tmp_path / "mlruns").as_uri()
+    client = MlflowClient(tracking_uri=tracking_uri)
+    return tracking_uri, client, client.create_experiment("test")
+
+
+def test_run_logger_logs_batched_runs(store):
+    tracking_uri, client, exp_id = store
+    model = LogisticRegression().fit(np.array([[0.0], [1.0]]), [0, 1])
+
+    run_logger = RunLogger(tracking_uri, exp_id, max_pending=2)
+    futures = [
+        run_logger.log_run(
+            {"C": c},
+            {"roc_auc": c / 10},
+            tags={"model": "test"},
+            model=model if c == 0 else None,
+            loss=1.0,
+        )
+        for c in range(5)
+    ]
+    run_logger.close()
+
+    runs = client.search_runs([exp_id], order_by=["params.C"])
+    assert [run.data.params["C"] for run in runs] == ["0", "1", "2", "3", "4"]
+    assert runs[3].data.metrics == {"roc_auc": 0.3}
+    assert runs[3].data.tags["model"] == "test"
+    assert all(run.info.status == "FINISHED" for run in runs)
+    run_id = futures[0].result()
+    assert "models/MLmodel" in [f.path for f in client.list_artifacts(run_id, "models")]
+    assert client.get_run(run_id).data.tags[MODEL_LOGGED] == "true"
+    # the served model knows the run it came from
+    mlflow.set_tracking_uri(tracking_uri)
+    served = mlflow.pyfunc.load_model(f"runs:/{run_id}/models")
+    assert served.metadata.run_id == run_id
+    assert served.metadata.artifact_path == "models"
+
+
+def test_run_logger_uploads_only_top_models(store):
+    tracking_uri, client, exp_id = store
+    model = LogisticRegression().fit(np.array([[0.0], [1.0]]), [0, 1])
+
+    run_logger = RunLogger(tracking_uri, exp_id, keep_models=2)
+    futures = {
+        loss: run_logger.log_run({"loss": loss}, {}, model=model, loss=loss)
+        for loss in [1.3, 1.1, 1.4, 1.2]
+    }
+    run_logger.close()
+
+    for loss, future in futures.items():
+        run_id = future.result()
+        uploaded = bool(client.list_artifacts(run_id, "models"))
+        assert uploaded == (loss in (1.1, 1.2))
+        assert (MODEL_LOGGED in client.get_run(run_id).data.tags) == uploaded
+
+
+def test_run_logger_raises_on_failed_runs(store):
+    tracking_uri, _, exp_id = store
+
+    run_logger = RunLogger(tracking_uri, exp_id)
+    # mlflow rejects param keys with "?"
+    run_logger.log_run({"C?": 1}, {"roc_auc": 0.5})
+
+    with pytest.raises(RuntimeError, match="1 runs failed"):
+        run_logger.close()
+
+
+def close_and_drop(run_logger):
+    run_logger.close()
+    del run_logger
+    gc.collect()
+
+
+def test_forked_copy_leaves_the_staged_models(store):
+    tracking_uri, client, exp_id = store
+    model = LogisticRegression().fit(np.array([[0.0], [1.0]]), [0, 1])
+
+    run_logger = RunLogger(tracking_uri, exp_id)
+    run_id = run_logger.log_run({}, {}, model=model, loss=1.0).result()
+    child = multiprocessing.get_context("fork").Process(
+        target=close_and_drop, args=(run_logger,)
+    )
+    child.start()
+    child.join()
+    assert child.exitcode == 0
+    run_logger.close()
+    assert client.get_run(run_id).data.tags[MODEL_LOGGED] == "true"
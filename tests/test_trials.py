@@ -0,0 +1,223 @@
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+from hyperopt import STATUS_OK, Trials, hp
+from hyperopt.pyll import scope
+from mlflow.tracking import MlflowClient
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import StratifiedKFold
+from sklearn.pipeline import make_pipeline
+
+from bikeshare.model import trials as trials_module
+from bikeshare.model.encoders import make_encoder
+from bikeshare.model.matrices import load_matrices, to_matrix
+from bikeshare.model.tracking import RunLogger
+from bikeshare.model.trials import (
+    _SEARCH,
+    close_worker_logger,
+    init_search,
+    load_trials,
+    objective,
+    parallel_fmin,
+    prepare_search,
+    successive_halving,
+)
+
+SPACE = {
+    "x": hp.uniform("x", -5, 5),
+    "kind": hp.choice("kind", ["a", "b"]),
+}
+
+
+def quadratic(params):
+    offset = 0 if params["kind"] == "a" else 1
+    return {"loss": (params["x"] - 1) ** 2 + offset, "status": STATUS_OK}
+
+
+def search(n_parallel, max_evals=25):
+    trials = Trials()
+    with ThreadPoolExecutor(max_workers=n_parallel) as executor:
+        parallel_fmin(
+            fn=quadratic,
+            space=SPACE,
+            trials=trials,
+            max_evals=max_evals,
+            rstate=np.random.default_rng(42),
+            executor=executor,
+            n_parallel=n_parallel,
+        )
+    return trials
+
+
+def test_parallel_fmin_is_reproducible():
+    first, second = search(n_parallel=4), search(n_parallel=4)
+
+    assert len(first) == 25
+    assert first.losses() == second.losses()
+    assert [t["misc"]["vals"] for t in first] == [t["misc"]["vals"] for t in second]
+
+
+def test_parallel_fmin_batches_are_distinct():
+    trials = search(n_parallel=4)
+
+    xs = [t["misc"]["vals"]["x"][0] for t in trials]
+    # past the random startup trials, a batch must not repeat one TPE point
+    assert len(set(xs[20:24])) == 4
+    assert min(trials.losses()) < 0.5
+
+
+def test_checkpointed_search_resumes_or_warm_starts(tmp_path):
+    trials_file = tmp_path / "trials.pkl"
+    calls = []
+
+    def crashing(params):
+        calls.append(params)
+        if len(calls) == 8:
+            raise RuntimeError("agent crashed")
+        return quadratic(params)
+
+    def run(fn, trials, max_evals):
+        parallel_fmin(
+            fn=fn,
+            space=SPACE,
+            trials=trials,
+            max_evals=max_evals,
+            rstate=np.random.default_rng(42),
+            executor=None,
+            n_parallel=2,
+            trials_file=trials_file,
+        )
+
+    with pytest.raises(RuntimeError):
+        run(crashing, Trials(), 10)
+
+    # the trial running alongside the crashed one is queued again
+    calls.clear()
+    trials = load_trials(trials_file)
+    assert len(trials) == 8 and trials.statuses().count("ok") == 7
+    run(crashing, trials, 10)
+    assert len(calls) == 3
+    assert load_trials(trials_file).statuses().count("ok") == 10
+
+    calls.clear()
+    trials = load_trials(trials_file, resume="warm")
+    run(crashing, trials, len(trials) + 5)
+    assert len(calls) == 5
+    assert len(load_trials(trials_file)) == 15
+
+
+def make_features(n_rows=600):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "trip_duration_seconds": rng.integers(60, 3600, n_rows),
+            "from_station_id": rng.integers(7000, 7010, n_rows),
+            "to_station_id": rng.integers(7000, 7010, n_rows),
+            "day_of_week": rng.integers(0, 7, n_rows),
+            "start_hour": rng.uniform(0, 24, n_rows),
+            "end_hour": rng.uniform(0, 24, n_rows),
+        }
+    )
+    df["target"] = df["trip_duration_seconds"] < 1800
+    return df
+
+
+def test_successive_halving_keeps_num_trials_points(tmp_path):
+    df = make_features()
+    paths = prepare_search(df, df, tmp_path, halving=True)
+    init_search(paths, 1, (tmp_path / "mlruns").as_uri(), "test")
+    space = {
+        "n_estimators": scope.int(hp.quniform("n_estimators", 2, 10, 1)),
+        "max_depth": scope.int(hp.quniform("max_depth", 1, 5, 1)),
+        "random_state": 42,
+    }
+
+    points = successive_halving(space, 2, np.random.default_rng(42))
+
+    assert len(points) == 2
+    assert all(set(point) == {"n_estimators", "max_depth"} for point in points)
+    again = successive_halving(space, 2, np.random.default_rng(42))
+    assert points == again
+
+
+def test_cached_encoder_rebuilds_end_to_end_pipeline(tmp_path):
+    train, test = make_features(), make_features(100)
+    paths = prepare_search(train, test, tmp_path)
+    init_search(paths, 1, (tmp_path / "mlruns").as_uri(), "test")
+    rf = RandomForestClassifier(n_estimators=5, random_state=42)
+    rf.fit(_SEARCH["Xt_train"], _SEARCH["y_train"])
+
+    clf = make_pipeline(_SEARCH["ct"], rf)
+
+    assert len(_SEARCH["cv_folds"]) == 5
+    # trials read the encoded data from the shared files
+    assert isinstance(_SEARCH["Xt_train"].data, np.memmap)
+    np.testing.assert_array_equal(
+        clf.predict_proba(test.drop("target", axis=1)),
+        rf.predict_proba(_SEARCH["Xt_test"]),
+    )
+
+
+def test_worker_logger_failures_are_counted(tmp_path):
+    tracking_uri = (tmp_path / "mlruns").as_uri()
+    exp_id = MlflowClient(tracking_uri=tracking_uri).create_experiment("test")
+    run_logger = RunLogger(tracking_uri, exp_id)
+    # mlflow rejects param keys with "?"
+    run_logger.log_run({"C?": 1}, {})
+    failures = multiprocessing.Value("i", 0)
+
+    close_worker_logger(run_logger, failures)
+    assert failures.value == 1
+
+
+def test_target_encoded_folds_do_not_see_validation_labels(tmp_path):
+    train = make_features()
+    paths = prepare_search(train, make_features(100), tmp_path, encoder="target")
+    X, y = train.drop("target", axis=1), train["target"].values
+    fit_idx, val_idx = next(StratifiedKFold(n_splits=5).split(X, y))
+
+    ct = make_encoder("target", handle_unknown="ignore")
+    ct.fit(X.iloc[fit_idx], y[fit_idx])
+    np.testing.assert_allclose(
+        load_matrices(paths)["fold0_Xt_val"],
+        to_matrix(ct.transform(X.iloc[val_idx])),
+    )
+
+
+class RecordingLogger:
+    """Stands in for a RunLogger, keeping what each trial logs"""
+
+    def __init__(self):
+        self.runs = []
+
+    def log_run(self, params, metrics, tags=None, model=None, **kwargs):
+        self.runs.append({"params": params, "metrics": metrics, "model": model})
+
+
+def test_only_improving_trials_fit_and_stage_a_model(tmp_path, monkeypatch):
+    paths = prepare_search(make_features(), make_features(100), tmp_path)
+    init_search(paths, 1, (tmp_path / "mlruns").as_uri(), "test", keep_models=1)
+    _SEARCH["run_logger"].close()
+    run_logger = RecordingLogger()
+    monkeypatch.setitem(_SEARCH, "run_logger", run_logger)
+    # each trial's CV roc_auc, set by its number of trees
+    monkeypatch.setattr(
+        trials_module, "fold_score", lambda clf, *fold: clf.n_estimators / 100
+    )
+
+    losses = [
+        objective({"n_estimators": n_estimators, "random_state": 42})["loss"]
+        for n_estimators in [70, 60, 80]
+    ]
+
+    assert losses == pytest.approx([1 / 0.7, 1 / 0.6, 1 / 0.8])
+    improving, worse, best = run_logger.runs
+    # the worse trial is ranked by its CV score only: no fit, test score or model
+    assert worse["model"] is None and "roc_auc" not in worse["metrics"]
+    for run in [improving, best]:
+        assert "roc_auc" in run["metrics"]
+        rf = run["model"].steps[-1][1]
+        assert len(rf.estimators_) == run["params"]["n_estimators"]
@@ -0,0 +1,104 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import mongomock
+import pytest
+
+from bikeshare.deploy.predict_service.writer import MongoWriter
+
+
+def unavailable(*args, **kwargs):
+    raise ConnectionError("mongo is down")
+
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient().get_database("prediction_service")["data"]
+
+
+def test_records_are_written_in_batches(collection):
+    writer = MongoWriter(collection, batch_size=50, flush_ms=50)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda i: writer.write({"i": i}), range(200)))
+    writer.write_many([{"i": i} for i in range(200, 230)])
+    writer.close()
+
+    assert sorted(doc["i"] for doc in collection.find()) == list(range(230))
+    metrics = writer.metrics()
+    assert metrics["written"] == 230 and metrics["buffered"] == 0
+    assert metrics["batches"] < 230
+
+
+def test_records_are_flushed_after_the_window(collection):
+    writer = MongoWriter(collection, batch_size=500, flush_ms=20)
+    writer.write({"i": 0})
+    time.sleep(0.3)
+    assert collection.count_documents({}) == 1
+    writer.close()
+
+
+def test_failed_batches_are_spilled_and_written_later(
+    collection, tmp_path, monkeypatch
+):
+    insert_many = collection.insert_many
+    monkeypatch.setattr(collection, "insert_many", unavailable)
+    writer = MongoWriter(
+        collection, batch_size=10, flush_ms=10, spill_dir=tmp_path, retry_s=0.05
+    )
+    writer.write_many([{"i": i} for i in range(25)])
+    time.sleep(0.3)
+    assert collection.count_documents({}) == 0
+    assert writer.metrics()["spilled"] == 25
+    assert writer.metrics()["spill_files"] > 0
+
+    monkeypatch.setattr(collection, "insert_many", insert_many)
+    writer.write({"i": 25})
+    writer.close()
+    assert sorted(doc["i"] for doc in collection.find()) == list(range(26))
+    assert not list(tmp_path.glob("*.pkl"))
+
+
+def test_full_buffer_blocks_writes_until_mongo_is_back(collection, monkeypatch):
+    insert_many = collection.insert_many
+    monkeypatch.setattr(collection, "insert_many", unavailable)
+    writer = MongoWriter(
+        collection, batch_size=2, flush_ms=1, max_buffer=2, retry_s=0.05
+    )
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        writes = pool.submit(writer.write_many, [{"i": i} for i in range(10)])
+        time.sleep(0.3)
+        # the worker holds a failed batch, and the buffer is full
+        assert not writes.done()
+        monkeypatch.setattr(collection, "insert_many", insert_many)
+        writes.result(timeout=5)
+    writer.close()
+    assert collection.count_documents({}) == 10
+
+
+def test_retried_records_are_not_duplicated(collection):
+    records = [{"i": i} for i in range(5)]
+    collection.insert_many(records[:3])
+    writer = MongoWriter(collection, flush_ms=10)
+    # the first 3 records kept their _id from the partly written attempt
+    writer.write_many(records)
+    writer.close()
+    assert collection.count_documents({}) == 5
+    assert writer.metrics()["errors"] == 0
+
+
+def test_setup_is_retried_until_it_succeeds(collection):
+    calls = []
+
+    def setup():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ConnectionError("mongo is down")
+        collection.create_index("ts")
+
+    writer = MongoWriter(collection, flush_ms=10, retry_s=0.01, setup=setup)
+    writer.write({"i": 0})
+    writer.write({"i": 1})
+    time.sleep(0.3)
+    writer.close()
+    assert len(calls) == 3 and "ts_1" in collection.index_information()
+    assert collection.count_documents({}) == 2